@@ -0,0 +1,113 @@
+"""Fake launcher / game processes used by processtrees.py.
+
+Roles:
+- launcher: Starts some children (staggered, so the tree needs a while to become
+  stable), then the game, and stays alive. Its behaviour depends on the scenario:
+  "fork"      plain launcher
+  "reexec"    re-executes itself once before doing anything
+  "respawn"   restarts children that were killed
+  "sigterm"   launcher and children ignore SIGTERM
+  "handoff"   the first game process starts a second one and exits
+- child: Idles forever.
+- game: Runs for a given time. Start and exit are appended to the events file.
+
+Events are written as JSON lines: {"event": ..., "pid": ..., "time": ...}"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def write_event(events_path, event):
+    line = json.dumps({"event": event, "pid": os.getpid(), "time": time.time()}) + "\n"
+    # Appending small lines is atomic, several processes write to the same file
+    fd = os.open(events_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def spawn_child(ignore_sigterm):
+    args = [sys.executable, __file__, "child"]
+    if ignore_sigterm:
+        args.append("--ignore-sigterm")
+    return subprocess.Popen(args)
+
+
+def run_launcher(args):
+    if args.scenario == "reexec" and not args.reexeced:
+        os.execv(sys.executable, [sys.executable, __file__] + sys.argv[1:] + ["--reexeced"])
+
+    ignore_sigterm = args.scenario == "sigterm"
+    if ignore_sigterm:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    children = []
+    for _ in range(args.children):
+        children.append(spawn_child(ignore_sigterm))
+        time.sleep(args.stagger)
+
+    game_args = [args.game, __file__, "game", "--events", args.events, "--time", str(args.game_time)]
+    if args.scenario == "handoff":
+        game_args.append("--handoff")
+    write_event(args.events, "game_started")
+    game = subprocess.Popen(game_args)
+
+    while True:
+        if args.scenario == "respawn":
+            for i, child in enumerate(children):
+                if child.poll() is not None:
+                    children[i] = spawn_child(ignore_sigterm)
+        game.poll()
+        time.sleep(0.1)
+
+
+def run_child(args):
+    if args.ignore_sigterm:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        time.sleep(60)
+
+
+def run_game(args):
+    if args.handoff:
+        write_event(args.events, "game_started")
+        subprocess.Popen([sys.executable, __file__, "game", "--events", args.events, "--time", str(args.time)])
+        write_event(args.events, "game_exit")
+        return
+    time.sleep(args.time)
+    write_event(args.events, "game_exit")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    launcher = subparsers.add_parser("launcher")
+    launcher.add_argument("--scenario", default="fork")
+    launcher.add_argument("--game", required=True, help="Executable used for the game process.")
+    launcher.add_argument("--events", required=True)
+    launcher.add_argument("--children", type=int, default=3)
+    launcher.add_argument("--stagger", type=float, default=0.2)
+    launcher.add_argument("--game-time", type=float, default=2)
+    launcher.add_argument("--reexeced", action="store_true")
+
+    child = subparsers.add_parser("child")
+    child.add_argument("--ignore-sigterm", action="store_true")
+
+    game = subparsers.add_parser("game")
+    game.add_argument("--events", required=True)
+    game.add_argument("--time", type=float, default=2)
+    game.add_argument("--handoff", action="store_true")
+
+    args = parser.parse_args()
+    {"launcher": run_launcher, "child": run_child, "game": run_game}[args.role](args)
+
+
+if __name__ == "__main__":
+    main()
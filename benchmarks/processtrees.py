@@ -0,0 +1,202 @@
+"""Benchmarks game detection and termination on synthetic launcher process trees
+(Linux only, see fakeprocesses.py for the scenarios).
+
+For every scenario a full session is run through `AsyncExternalGame.run()` while
+a configurable number of unrelated background processes is running. Reported
+(as JSON) per scenario:
+- launch_stable_seconds: launch of the game starter until its tree was stable
+- launch_overhead_seconds: the same, minus the required min_launch_stable time
+- game_detect_seconds: game process started until STEGL detected it
+- exit_detect_seconds: (last) game process exited until STEGL noticed
+- shutdown_seconds: terminating all remaining processes
+Additionally, the cost of a single process table scan is measured per tracking mode.
+
+Usage: python benchmarks/processtrees.py [--background 200] [--scenarios fork,respawn] [--output results.json]"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import psutil
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPOSITORY))
+
+from stegl.logging import SINK
+from stegl.processlaunching import AsyncExternalGame, AsyncProcessCapture, ProcessTable
+
+HELPER = Path(__file__).resolve().parent / "fakeprocesses.py"
+SCENARIOS = ["fork", "reexec", "respawn", "sigterm", "handoff"]
+
+
+def start_background_processes(count):
+    """Starts unrelated processes. They are started through an intermediate process
+    that exits immediately, so they aren't descendants of the benchmark."""
+    sleep = shutil.which("sleep")
+    command = [sleep, "3600"] if sleep else [sys.executable, "-c", "import time; time.sleep(3600)"]
+    spawner_code = (
+        "import subprocess\n"
+        f"for _ in range({count}):\n"
+        f"    print(subprocess.Popen({command!r}, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,\n"
+        "                           stderr=subprocess.DEVNULL, start_new_session=True).pid)\n"
+    )
+    spawner = subprocess.run([sys.executable, "-c", spawner_code], capture_output=True, text=True, check=True)
+    return [psutil.Process(int(pid)) for pid in spawner.stdout.split()]
+
+
+def stop_background_processes(processes):
+    for p in processes:
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+def read_events(events_path):
+    try:
+        with open(events_path) as f:
+            return [json.loads(line) for line in f]
+    except OSError:
+        return []
+
+
+def measure_scan_cost(tracking, ticks):
+    table = ProcessTable(tracking=tracking)
+    table.register("STEGL_BENCHMARK_0")
+    durations = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        table.snapshot()
+        durations.append(time.perf_counter() - start)
+    table.unregister("STEGL_BENCHMARK_0")
+    return {
+        "first_scan_ms": durations[0] * 1000,
+        "median_scan_ms": statistics.median(durations[1:] or durations) * 1000,
+        "environ_reads_per_scan": table.environ_reads / ticks
+    }
+
+
+async def run_scenario(scenario, directory, game_exe, args):
+    events_path = Path(directory) / f"{scenario}.events"
+    environ = dict(os.environ)
+    # The game is a copy of the interpreter, which has to find its standard library
+    environ["PYTHONHOME"] = sys.base_prefix
+
+    starter = AsyncProcessCapture(
+        sys.executable,
+        [str(HELPER), "launcher", "--scenario", scenario, "--game", str(game_exe), "--events", str(events_path),
+         "--children", str(args.children), "--game-time", str(args.game_time)],
+        max_launch_waiting=args.max_launch_waiting,
+        min_launch_stable=args.min_launch_stable,
+        termination_timeout=args.termination_timeout,
+        environ=environ
+    )
+    game = AsyncExternalGame(
+        [str(Path(game_exe).parent)],
+        starter,
+        game_search_timeout=30,
+        after_game_wait=0,
+        process_tracking=args.tracking,
+        process_watcher=args.watcher
+    )
+
+    # The session's output is timestamped to find the phase changes
+    log = []
+    SINK.set(lambda text, end="\n": log.append((time.time(), str(text))))
+    start = time.time()
+    await game.run()
+    SINK.set(None)
+
+    def logged(prefix):
+        return next((t for t, text in log if text.startswith(prefix)), None)
+
+    events = read_events(events_path)
+    started = [e["time"] for e in events if e["event"] == "game_started"]
+    exited = [e["time"] for e in events if e["event"] == "game_exit"]
+    stable = logged("Stable") or logged("Max. waiting time reached")
+    detected = logged("Detected game process")
+    no_more_game = logged("No more game process found")
+    stopping = logged("Stopping remaining processes")
+    success = logged("Success")
+
+    return {
+        "launch_stable_seconds": stable - start,
+        "launch_overhead_seconds": stable - start - args.min_launch_stable,
+        "game_detect_seconds": detected - started[0] if detected and started else None,
+        "exit_detect_seconds": no_more_game - max(exited) if no_more_game and exited else None,
+        "shutdown_seconds": success - stopping if success and stopping else None,
+        "table_scans": game.process_table.scan_count,
+        "environ_reads": game.process_table.environ_reads
+    }
+
+
+def stegl_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPOSITORY, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--background", type=int, default=200, help="Number of unrelated background processes.")
+    parser.add_argument("--children", type=int, default=3, help="Children started by each fake launcher.")
+    parser.add_argument("--game-time", type=float, default=2)
+    parser.add_argument("--tracking", default="environ", choices=ProcessTable.TRACKING_MODES)
+    parser.add_argument("--watcher", default="auto")
+    parser.add_argument("--min-launch-stable", type=float, default=1)
+    parser.add_argument("--max-launch-waiting", type=float, default=10)
+    parser.add_argument("--termination-timeout", type=float, default=2)
+    parser.add_argument("--scan-ticks", type=int, default=20)
+    parser.add_argument("--output", default=None, help="File to write the results to (default: stdout).")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        sys.exit("The process tree benchmarks require Linux.")
+
+    results = {
+        "benchmark": "process_trees",
+        "revision": stegl_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "scan_cost": {},
+        "scenarios": {}
+    }
+
+    background = start_background_processes(args.background)
+    try:
+        for tracking in ProcessTable.TRACKING_MODES:
+            results["scan_cost"][tracking] = measure_scan_cost(tracking, args.scan_ticks)
+
+        with tempfile.TemporaryDirectory() as directory:
+            game_dir = Path(directory) / "game"
+            game_dir.mkdir()
+            game_exe = game_dir / "fakegame"
+            shutil.copy(sys.executable, game_exe)
+
+            for scenario in args.scenarios.split(","):
+                results["scenarios"][scenario] = asyncio.run(run_scenario(scenario, directory, game_exe, args))
+    finally:
+        stop_background_processes(background)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
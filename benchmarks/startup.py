@@ -0,0 +1,96 @@
+"""Measures the time-to-first-process of `launch-external-game`: the time from
+starting the CLI until the first process of the launch configuration is running.
+
+The launched "game" is a tiny Python script writing a timestamp to a file. Its own
+startup time is measured separately (child baseline) and subtracted, so the
+`net` value is what STEGL adds on top. Results are printed as JSON.
+
+Usage: python benchmarks/startup.py [--runs N] [--supervisor] [--command steglcli.exe]"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+MARKER_SCRIPT = "import sys, time; open(sys.argv[1], 'w').write(repr(time.time()))"
+
+
+def create_configuration(directory, marker_path):
+    config = {
+        "GAME": {
+            "game_search_paths": [str(Path(directory) / "no_game")],
+            "game_search_timeout": 0,
+            "after_game_wait": 0,
+            # Benchmark runs must not end up in the user's launch history
+            "launch_history": False,
+            "launch_config": {
+                "exe_path": sys.executable,
+                "args": ["-S", "-c", MARKER_SCRIPT, str(marker_path)],
+                "max_launch_waiting": 0,
+                "min_launch_stable": 0,
+                "termination_timeout": 1,
+                "termination_retries": 1
+            }
+        },
+        "DEPENDENCIES": []
+    }
+    config_path = Path(directory) / "startup_benchmark.stegl"
+    with config_path.open("w") as f:
+        json.dump(config, f, indent=4)
+    return config_path
+
+
+def measure(command, marker_path):
+    """Runs the command and returns the seconds until the marker was written."""
+    marker_path.unlink(missing_ok=True)
+    start = time.time()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return float(marker_path.read_text()) - start
+
+
+def summarize(values):
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--supervisor", action="store_true", help="Launch through a running supervisor.")
+    parser.add_argument("--command", default=None, help="CLI to benchmark (e.g. a built steglcli.exe). Defaults to runstegl.py.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        marker_path = Path(directory) / "marker"
+        config_path = create_configuration(directory, marker_path)
+
+        cli = [args.command] if args.command else [sys.executable, str(REPOSITORY / "runstegl.py")]
+        command = cli + ["launch-external-game", "--slient", str(config_path)]
+        if not args.supervisor:
+            command.append("--no-supervisor")
+
+        baseline = [measure([sys.executable, "-S", "-c", MARKER_SCRIPT, str(marker_path)], marker_path) for _ in range(args.runs)]
+        total = [measure(command, marker_path) for _ in range(args.runs)]
+
+    results = {
+        "benchmark": "time_to_first_process",
+        "runs": args.runs,
+        "supervisor": args.supervisor,
+        "command": cli,
+        "total_seconds": summarize(total),
+        "child_baseline_seconds": summarize(baseline),
+        "net_seconds": summarize([t - statistics.median(baseline) for t in total])
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 from pathlib import Path
 import json
+import os
 import time
 
 import click
 
-from stegl.processlaunching import ProcessCapture, ExternalGame
-from stegl import configurationui
+# Only lightweight modules are imported here, as the time until the game is
+# launched directly depends on it. Heavier ones (psutil, asyncio, tkinter)
+# are imported by the commands needing them.
+from stegl.supervisorclient import launch_via_supervisor
 from stegl import logging as stegl_logging
 from stegl.logging import print_log
 
@@ -22,13 +25,21 @@ def cli(ctx):
 @cli.command()
 @click.argument("configuration")
 @click.option("--slient", is_flag=True, default=False, help="Supresses all console outputs.")
-def launch_external_game(configuration, slient):
+@click.option("--no-supervisor", is_flag=True, default=False, help="Runs the game in this process, even if a STEGL supervisor is running.")
+@click.option("--trace", default=None, type=click.Path(dir_okay=False), help="Appends timings of all launch phases as JSON lines to this file.")
+@click.option("--record", default=None, type=click.Path(dir_okay=False), help="Records the processes of the session to this file, for replay-trace. Runs the game in this process.")
+def launch_external_game(configuration, slient, no_supervisor, trace, record):
     """Invokes the external game with its dependencies (e.g. launchers).
     
-    For CONFIGURATION, a path to a configuration .stegl-file is expected."""
+    For CONFIGURATION, a path to a configuration .stegl-file is expected.
+    If a STEGL supervisor is running (see run-supervisor), the game is launched
+    by it, otherwise by this process."""
     
     stegl_logging.ACTIVE = not slient
 
+    externalGame = None
+    tracer = None
+    recorder = None
     try:
         config_path = Path(configuration)
         del configuration
@@ -39,17 +50,6 @@ def launch_external_game(configuration, slient):
         with config_path.open() as f:
             config = json.load(f)
 
-        game_starter = ProcessCapture(**config["GAME"]["launch_config"])
-        dependencies = [ProcessCapture(**dep_config) for dep_config in config["DEPENDENCIES"]]
-
-        externalGame = ExternalGame(
-            game_search_paths=config["GAME"]["game_search_paths"],
-            game_starter=game_starter, 
-            dependencies=dependencies,
-            game_search_timeout=config["GAME"]["game_search_timeout"],
-            after_game_wait=config["GAME"]["after_game_wait"]
-        )
-
         launch_art = """
 Launched using:
 
@@ -63,19 +63,216 @@ Launched using:
 
 """
         print_log(launch_art)
+
+        if not no_supervisor and record is None:
+            # Blocks until the session ended, so Steam still sees the game running
+            trace_path = str(Path(trace).resolve()) if trace is not None else None
+            exit_code = launch_via_supervisor(config, os.getcwd(), dict(os.environ), print_log, trace_path=trace_path)
+            if exit_code is not None:
+                time.sleep(2)
+                exit(exit_code)
+
+        if trace is not None:
+            from stegl.tracing import JsonLinesTracer, TRACER
+            tracer = JsonLinesTracer(trace)
+            TRACER.set(tracer)
+        if record is not None:
+            from stegl.processrecording import ProcessRecorder, RECORDER
+            recorder = ProcessRecorder(record, config)
+            RECORDER.set(recorder)
+
+        from stegl.processlaunching import ExternalGame
+        externalGame = ExternalGame.from_configuration(config)
         externalGame.run()
         time.sleep(2)
     except Exception as e:
         print_log(f"An error occured: {repr(e)}")
-        print_log(f"Trying to terminate game processes.")
-        externalGame.terminate()
+        if externalGame is not None:
+            print_log(f"Trying to terminate game processes.")
+            externalGame.terminate()
+        time.sleep(2)
+        exit(1)
+    finally:
+        if tracer is not None:
+            tracer.close()
+        if recorder is not None:
+            recorder.close()
+
+
+@cli.command()
+@click.argument("configurations", nargs=-1, required=True)
+@click.option("--primary", default=None, help="Configuration whose game ends the session (default: the first one).")
+@click.option("--slient", is_flag=True, default=False, help="Supresses all console outputs.")
+@click.option("--trace", default=None, type=click.Path(dir_okay=False), help="Appends timings of all launch phases as JSON lines to this file.")
+def launch_many(configurations, primary, slient, trace):
+    """Invokes several external games as one session in this process.
+
+    Useful for a game and separately configured tools, like a voice client.
+    For CONFIGURATIONS, paths to configuration .stegl-files are expected. All of
+    them are launched concurrently. Once the game of the primary configuration
+    closed, the processes of all configurations are stopped."""
+
+    stegl_logging.ACTIVE = not slient
+
+    batch = None
+    tracer = None
+    try:
+        config_paths = [Path(configuration) for configuration in configurations]
+        primary_path = Path(primary) if primary is not None else config_paths[0]
+        if primary_path not in config_paths:
+            raise ValueError("The primary configuration must be one of the configurations")
+
+        # Output is prefixed with the file names, paths are only used if ambiguous
+        stems = [path.stem for path in config_paths]
+        names = [path.stem if stems.count(path.stem) == 1 else str(path) for path in config_paths]
+        configs = {}
+        for name, config_path in zip(names, config_paths):
+            if not config_path.exists():
+                raise ValueError(f"Configuration {str(config_path)} does not exist")
+            with config_path.open() as f:
+                configs[name] = json.load(f)
+
+        if trace is not None:
+            from stegl.tracing import JsonLinesTracer, TRACER
+            tracer = JsonLinesTracer(trace)
+            TRACER.set(tracer)
+
+        import asyncio
+        from stegl.batchlaunching import AsyncGameBatch
+        batch = AsyncGameBatch.from_configurations(configs, names[config_paths.index(primary_path)])
+        asyncio.run(batch.run())
+        time.sleep(2)
+    except Exception as e:
+        print_log(f"An error occured: {repr(e)}")
+        if batch is not None:
+            print_log(f"Trying to terminate game processes.")
+            asyncio.run(batch.terminate())
         time.sleep(2)
         exit(1)
+    finally:
+        if tracer is not None:
+            tracer.close()
+
+
+@cli.command()
+@click.argument("configurations", nargs=-1)
+@click.option("--history", default=None, type=click.Path(dir_okay=False), help="History file to read instead of the default one.")
+def launch_stats(configurations, history):
+    """Prints the recorded launch timings of configurations.
+
+    For CONFIGURATIONS, paths to configuration .stegl-files are expected. If none
+    are given, all recorded configurations are listed. Also shows the values
+    used for timing options set to "auto"."""
+    from stegl.launchhistory import LaunchHistory, configuration_key, describe
+
+    launch_history = LaunchHistory(history) if history is not None else LaunchHistory()
+    if configurations:
+        keys = []
+        for configuration in configurations:
+            with Path(configuration).open() as f:
+                config = json.load(f)
+            starter = config["GAME"]["launch_config"]
+            keys.append((configuration, configuration_key(config["GAME"]["game_search_paths"], starter["exe_path"], starter.get("args", []))))
+        recorded = {key: launch_history.sessions(key) for _, key in keys}
+        for configuration, key in keys:
+            if not recorded[key]:
+                print_log(f"No sessions of {configuration} recorded yet.")
+    else:
+        recorded = launch_history.sessions()
+        if not recorded:
+            print_log("No sessions recorded yet.")
+    for sessions in recorded.values():
+        if sessions:
+            print_log("\n".join(describe(sessions)))
+
+
+@cli.command()
+@click.argument("roots", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False))
+@click.option("--output", default=".", type=click.Path(file_okay=False), help="Directory the configurations are written to (default: the working directory).")
+@click.option("--workers", default=8, type=int, help="Number of directories scanned concurrently.")
+@click.option("--full", is_flag=True, default=False, help="Rescans all directories, even if unchanged since the last scan.")
+@click.option("--epic-launcher", default=None, help="Path of EpicGamesLauncher.exe used to start Epic Games titles.")
+@click.option("--epic-manifests", default=None, type=click.Path(file_okay=False), help="Directory of the Epic Games Launcher's *.item manifests.")
+def scan_library(roots, output, workers, full, epic_launcher, epic_manifests):
+    """Creates a configuration for every game found in library directories.
+
+    For ROOTS, directories containing game install directories (e.g. an Epic
+    Games or GOG library) or install directories themselves are expected. Epic
+    Games and GOG titles are recognized by their manifests, for other games the
+    main executable is guessed. Existing configurations are updated, keeping
+    values edited by hand. Directories unchanged since the last scan are skipped."""
+    from stegl.libraryscanning import LibraryScanner, EPIC_LAUNCHER_PATH, EPIC_MANIFESTS_PATH
+
+    start = time.perf_counter()
+    scanner = LibraryScanner(
+        output, workers=workers, full=full,
+        epic_launcher=epic_launcher or EPIC_LAUNCHER_PATH, epic_manifests=epic_manifests or EPIC_MANIFESTS_PATH
+    )
+    counts = scanner.scan(roots, report=print_log)
+    print_log(
+        f"{counts['created']} created, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+        f"{counts['skipped']} skipped as unchanged since the last scan ({time.perf_counter() - start:.2f}s)."
+    )
+
+
+@cli.command()
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option("--watcher", "watchers", multiple=True, type=click.Choice(["events", "polling"]), help="Watcher to simulate, may be given several times to compare them (default: both).")
+@click.option("--poll-interval", default=1.0, help="Poll interval of the simulated polling watcher.")
+@click.option("--configuration", default=None, type=click.Path(exists=True, dir_okay=False), help="Replays using this configuration instead of the recorded one.")
+@click.option("--output", "show_output", is_flag=True, default=False, help="Prints the console output of the replayed sessions.")
+def replay_trace(recording, watchers, poll_interval, configuration, show_output):
+    """Replays a session recorded with launch-external-game --record.
+
+    The recorded processes are replayed in simulated time, so a session of hours
+    takes milliseconds. Prints the durations of the launch phases, the signals
+    sent and the number of process scans side by side for each watcher."""
+    from stegl.processsimulation import ProcessTrace, replay
+
+    trace = ProcessTrace.load(recording)
+    config = None
+    if configuration is not None:
+        with Path(configuration).open() as f:
+            config = json.load(f)
+    results = {watcher: replay(trace, config, event_driven=watcher == "events", poll_interval=poll_interval)
+               for watcher in watchers or ("events", "polling")}
+
+    print_log(f"Recorded session: {trace.duration:.1f}s, {len(trace.plans)} processes.")
+    rows = [("outcome", lambda r: r["outcome"]), ("duration", lambda r: f"{r['duration']:.2f}s")]
+    phases = []
+    for result in results.values():
+        phases += [phase for phase in result["phases"] if phase not in phases]
+    rows += [(phase, lambda r, phase=phase: f"{r['phases'][phase]:.2f}s" if phase in r["phases"] else "-") for phase in phases]
+    rows += [
+        ("signals", lambda r: str(len(r["signals"]))),
+        ("remaining processes", lambda r: str(len(r["remaining"]))),
+        ("process scans", lambda r: str(r["scans"])),
+        ("replayed in", lambda r: f"{r['replay_seconds']:.3f}s")
+    ]
+    print_log(f"{'':<28}" + "".join(f"{watcher:>16}" for watcher in results))
+    for label, value in rows:
+        print_log(f"{label:<28}" + "".join(f"{value(result):>16}" for result in results.values()))
+    if show_output:
+        for watcher, result in results.items():
+            print_log(f"\nOutput ({watcher}):\n{result['output']}")
+
+
+@cli.command()
+@click.option("--port", type=int, default=0, help="Port to listen on (localhost only). A free port is chosen by default.")
+def run_supervisor(port):
+    """Runs a resident supervisor which launch-external-game forwards games to."""
+    import asyncio
+    from stegl.supervisor import Supervisor
+    try:
+        asyncio.run(Supervisor(port).serve())
+    except KeyboardInterrupt:
+        pass
 
 
 @cli.command()
 def setup_game():
     """(Default) Launches UI to create a configuration for a game."""
+    from stegl import configurationui
     configurationui.launch()
 
 
@@ -0,0 +1,121 @@
+"""Running several games as one session (`launch-many`).
+
+Some setups consist of a game plus separately configured tools (e.g. a voice
+client, a mod manager or a capture tool), each with its own .stegl file. Instead
+of one STEGL process per configuration, `AsyncGameBatch` runs all of them in
+this process: they share one process table and one watcher, so the number of
+scans per tick doesn't grow with the number of configurations. The session ends
+when the game of the primary configuration closed, then the launch groups of all
+configurations are terminated concurrently."""
+
+import asyncio
+
+from stegl.logging import print_log, prefixed_sink, SINK
+from stegl import tracing
+from stegl.processlaunching import AsyncExternalGame, ProcessTable, terminate_captures_async
+from stegl.processwatching import create_watcher
+
+
+class AsyncGameBatch:
+    """Runs `games` (a dict mapping a name to an `AsyncExternalGame`) concurrently.
+    All games should share one process table and watcher, see `from_configurations`.
+    Output of each game is prefixed with its name. The after game wait and the
+    shutdown timeout of the `primary` game apply to the whole session."""
+
+    def __init__(self, games : dict, primary : str, watcher = None):
+        if primary not in games:
+            raise ValueError(f"Unknown primary configuration {repr(primary)}.")
+        self.games = games
+        self.primary = primary
+        # Closed once the session ended
+        self.watcher = watcher
+
+    @classmethod
+    def from_configurations(cls, configs : dict, primary : str, **kwargs):
+        """Creates a batch from parsed .stegl configurations (a dict mapping a name to
+        a configuration). Process tracking and watcher are taken from the primary
+        configuration. Additional keyword arguments are passed to every game."""
+        if primary not in configs:
+            raise ValueError(f"Unknown primary configuration {repr(primary)}.")
+        primary_config = configs[primary]["GAME"]
+        process_table = ProcessTable(tracking=primary_config.get("process_tracking", "environ"))
+        watcher = create_watcher(primary_config.get("process_watcher", "auto"))
+        try:
+            games = {
+                name: AsyncExternalGame.from_configuration(config, process_table=process_table, watcher=watcher, **kwargs)
+                for name, config in configs.items()
+            }
+        except:
+            watcher.close()
+            raise
+        return cls(games, primary, watcher)
+
+    async def _run_game(self, name, game):
+        """Launches a game and waits until no game process of it is left."""
+        SINK.set(prefixed_sink(f"[{name}] "))
+        with tracing.span("session", configuration=name, stegl_id=game.game_starter.ID, dependencies=len(game.dependencies)):
+            await game._supervise(await game._launch())
+
+    async def _run_secondary(self, name, game):
+        # A failing tool must not end the session of the primary game
+        try:
+            await self._run_game(name, game)
+        except Exception as e:
+            print_log(f"An error occured in {repr(name)}: {repr(e)}")
+
+    async def run(self):
+        try:
+            with tracing.span("batch", primary=self.primary, configurations=list(self.games)):
+                await self._run()
+        except asyncio.CancelledError:
+            # Don't leave anything behind when the session gets cancelled
+            print_log("Session cancelled. Stopping remaining processes & dependencies.")
+            await self.terminate()
+            raise
+        except Exception:
+            # The launch groups are unregistered below, afterwards their processes
+            # can't be found any more
+            await self.terminate()
+            raise
+        finally:
+            for game in self.games.values():
+                game._unregister()
+            if self.watcher is not None:
+                self.watcher.close()
+
+    async def _run(self):
+        primary = self.games[self.primary]
+        secondaries = [
+            asyncio.create_task(self._run_secondary(name, game))
+            for name, game in self.games.items() if name != self.primary
+        ]
+        try:
+            # Runs in its own task, so only the game's output is prefixed
+            await asyncio.create_task(self._run_game(self.primary, primary))
+        finally:
+            # Secondary games keep running until the primary game closed, their
+            # throttled and tuned processes are restored when cancelled
+            for task in secondaries:
+                task.cancel()
+            await asyncio.gather(*secondaries, return_exceptions=True)
+
+        print_log(f"No more game process of {repr(self.primary)} found.")
+        await primary._after_game_wait()
+
+        print_log("Stopping remaining processes & dependencies of all configurations.")
+        await self.terminate()
+        for game in self.games.values():
+            game._record_history()
+
+        stats = primary.process_table.metadata.stats()
+        print_log(f"Process metadata cache: {stats['hits']} hits, {stats['misses']} misses.")
+        print_log("Success.")
+
+    async def terminate(self):
+        """Terminates the launch groups of all games concurrently."""
+        captures = []
+        for game in self.games.values():
+            captures += game._prepare_termination()
+        failed = await terminate_captures_async(captures, self.games[self.primary].shutdown_timeout)
+        for capture in failed:
+            print_log(f"Could not terminate all processes of launch group {repr(capture.ID)}.")
@@ -0,0 +1,162 @@
+"""Tracking launch groups using Linux cgroups (v2).
+
+Every launch group gets its own cgroup below the cgroup of this process. Its
+root process joins it before executing, so every descendant is a member as well,
+no matter what it does to its environment. Members are read from `cgroup.procs`
+and the whole group can be frozen (`cgroup.freeze`) and killed (`cgroup.kill`,
+Linux 5.14+) at once."""
+
+import os
+import subprocess
+import sys
+
+
+def _cgroup2_mount():
+    """Returns mount point and mounted root of the cgroup2 hierarchy, or None."""
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                fields = line.split()
+                separator = fields.index("-")
+                if fields[separator + 1] == "cgroup2":
+                    return fields[4], fields[3]
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _own_cgroup():
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].strip()
+    except OSError:
+        pass
+    return None
+
+
+def find_writable_cgroup():
+    """Returns the directory of this process' cgroup if child cgroups can be created
+    in it and processes can be moved into them, otherwise None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    mount = _cgroup2_mount()
+    own = _own_cgroup()
+    if mount is None or own is None:
+        return None
+    mount_point, mount_root = mount
+    relative = os.path.relpath(own, mount_root)
+    if relative.startswith(".."):
+        # Our cgroup is not visible in this mount (e.g. another namespace)
+        return None
+    base = os.path.normpath(os.path.join(mount_point, relative))
+
+    # Moving processes requires write access to the common ancestor's cgroup.procs
+    if not os.access(os.path.join(base, "cgroup.procs"), os.W_OK):
+        return None
+    # Moving may still be denied (e.g. by delegation rules or security modules),
+    # so a short-lived process joins a probe cgroup like a launch group's root does
+    probe = os.path.join(base, f"stegl_probe_{os.getpid()}")
+    try:
+        os.mkdir(probe)
+    except OSError:
+        return None
+    try:
+        subprocess.run([sys.executable, "-c", ""], preexec_fn=_joiner(probe), check=True,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    finally:
+        try:
+            os.rmdir(probe)
+        except OSError:
+            pass
+    return base
+
+
+def _joiner(directory : str):
+    """Returns a function moving the calling process into the cgroup. It runs
+    between fork and exec of a multithreaded process, where only async-signal-safe
+    calls are allowed (no buffered I/O), so the path is prepared beforehand."""
+    procs = os.fsencode(os.path.join(directory, "cgroup.procs"))
+    def join():
+        fd = os.open(procs, os.O_WRONLY)
+        try:
+            os.write(fd, b"0")
+        finally:
+            os.close(fd)
+    return join
+
+
+class CgroupGroups:
+    """Manages the cgroups of launch groups below `base`, one per STEGL ID."""
+
+    def __init__(self, base : str):
+        self.base = base
+        self.remove_stale()
+
+    def path(self, stegl_id : str):
+        return os.path.join(self.base, stegl_id)
+
+    def remove_stale(self):
+        """Removes empty cgroups left behind by STEGL processes that are gone."""
+        try:
+            entries = os.listdir(self.base)
+        except OSError:
+            return
+        for name in entries:
+            parts = name.split("_")
+            if len(parts) != 3 or parts[0] != "STEGL" or not parts[1].isdigit():
+                continue
+            if os.path.exists(f"/proc/{parts[1]}"):
+                continue
+            try:
+                os.rmdir(self.path(name))
+            except OSError:
+                # Still populated, these processes escaped their STEGL instance
+                pass
+
+    def create(self, stegl_id : str):
+        os.makedirs(self.path(stegl_id), exist_ok=True)
+
+    def remove(self, stegl_id : str):
+        """Removes the cgroup of the group, if it is empty."""
+        for directory, _, _ in sorted(os.walk(self.path(stegl_id)), reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def pids(self, stegl_id : str):
+        """PIDs of all processes in the group (including nested cgroups)."""
+        pids = set()
+        for directory, _, _ in os.walk(self.path(stegl_id)):
+            try:
+                with open(os.path.join(directory, "cgroup.procs")) as f:
+                    pids.update(int(line) for line in f if line.strip())
+            except (OSError, ValueError):
+                pass
+        return pids
+
+    def joiner(self, stegl_id : str):
+        """Returns a function moving the calling process into the group, to be used
+        as `preexec_fn` when launching the group's root process."""
+        return _joiner(self.path(stegl_id))
+
+    def _write(self, stegl_id : str, control : str, value : str):
+        try:
+            with open(os.path.join(self.path(stegl_id), control), "w") as f:
+                f.write(value)
+            return True
+        except OSError:
+            return False
+
+    def freeze(self, stegl_id : str, frozen : bool = True):
+        """Freezes (or thaws) all processes of the group. Returns False if not supported."""
+        return self._write(stegl_id, "cgroup.freeze", "1" if frozen else "0")
+
+    def kill(self, stegl_id : str):
+        """Kills all processes of the group, including ones just being forked.
+        Returns False if not supported."""
+        return self._write(stegl_id, "cgroup.kill", "1")
@@ -0,0 +1,14 @@
+"""Time source of the launch lifecycle.
+
+Deadlines and durations are measured with `monotonic()`, which reads the clock of
+the current context (`time.monotonic` by default). The replay simulator (see
+processsimulation.py) sets a simulated clock, so sessions run in simulated time."""
+
+import contextvars
+import time
+
+CLOCK = contextvars.ContextVar("CLOCK", default=time.monotonic)
+
+
+def monotonic():
+    return CLOCK.get()()
@@ -9,6 +9,9 @@ from pathlib import Path
 from tktooltip import ToolTip
 import sys
 
+from stegl.throttling import PRIORITIES, IO_PRIORITIES
+from stegl.processpicker import pick_process
+
 
 DEFAULT_PADDING = 5
 DEFAULT_PADDING_HALF = DEFAULT_PADDING / 2.
@@ -28,7 +31,8 @@ class PathSelectionWidget(tk.Frame):
         open_mode="open_filename",
         file_dialog_text = "Select File",
         filetypes=[("All Files", "*.*")],
-        file_dialog_button_text = "Browse..."
+        file_dialog_button_text = "Browse...",
+        pick_running = False
     ):
         super().__init__(master=master)
         self.path_variable = path_variable if path_variable is not None else tk.StringVar(self)
@@ -44,6 +48,19 @@ class PathSelectionWidget(tk.Frame):
         entry.grid(row=0, column=1, padx=DEFAULT_PADDING, sticky="EW")
         browse_button = tk.Button(self, text=file_dialog_button_text, command=self.browse)
         browse_button.grid(row=0, column=2)
+        if pick_running:
+            running_button = tk.Button(self, text="Running...", command=self.pick_running)
+            running_button.grid(row=0, column=3, padx=(DEFAULT_PADDING, 0))
+
+    def pick_running(self):
+        """Takes the path from a running process (its directory, if a directory is expected)."""
+        process = pick_process(self.winfo_toplevel())
+        if process is None:
+            return
+        if self.open_mode == "open_directory":
+            self.path_variable.set(str(Path(process.exe).parent))
+        else:
+            self.path_variable.set(process.exe)
 
     def browse(self):
         if self.open_mode == "open_filename":
@@ -65,6 +82,31 @@ class PathSelectionWidget(tk.Frame):
             self.path_variable.set(file_path)
 
 
+class AutoScale(tk.Frame):
+    """A slider which can be set to "auto" instead of a value, i.e. to derive the
+    value from the launch history."""
+
+    def __init__(self, master=None, **scale_options):
+        super().__init__(master=master)
+        self.columnconfigure(0, weight=1)
+        self.scale = tk.Scale(self, orient=tk.HORIZONTAL, **scale_options)
+        self.scale.grid(row=0, column=0, sticky="EW")
+        self.auto_var = tk.BooleanVar(self, False)
+        tk.Checkbutton(self, text="auto", variable=self.auto_var, command=self._update_state).grid(row=0, column=1, sticky="S")
+
+    def _update_state(self):
+        self.scale.configure(state=tk.DISABLED if self.auto_var.get() else tk.NORMAL)
+
+    def set(self, value):
+        self.auto_var.set(value == "auto")
+        if value != "auto":
+            self.scale.set(value)
+        self._update_state()
+
+    def get(self):
+        return "auto" if self.auto_var.get() else self.scale.get()
+
+
 class ProcessCaptureDetailsEditor(tk.Toplevel):
     def __init__(self, parent):
         
@@ -93,14 +135,14 @@ class ProcessCaptureDetailsEditor(tk.Toplevel):
 
         setting0 = tk.LabelFrame(innerFrame, text="Max. Launch Waiting Time (seconds):")
         ToolTip(setting0, msg="max_launch_waiting", delay=1.5)
-        self.max_launch_waiting_slider = tk.Scale(setting0, from_=0, to=60, orient=tk.HORIZONTAL)
+        self.max_launch_waiting_slider = AutoScale(setting0, from_=0, to=60, resolution=0.1)
         self.max_launch_waiting_slider.set(parent.configuration_data["max_launch_waiting"])
         self.max_launch_waiting_slider.pack(fill="x",padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
         setting0.pack(fill="x",padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
 
         setting1 = tk.LabelFrame(innerFrame, text="Min. Launch Stable Time (seconds):")
         ToolTip(setting1, msg="min_launch_stable", delay=1.5)
-        self.min_launch_stable_slider = tk.Scale(setting1, from_=0, to=60, orient=tk.HORIZONTAL)
+        self.min_launch_stable_slider = AutoScale(setting1, from_=0, to=60, resolution=0.1)
         self.min_launch_stable_slider.set(parent.configuration_data["min_launch_stable"])
         self.min_launch_stable_slider.pack(fill="x",padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
         setting1.pack(fill="x",padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
@@ -164,13 +206,15 @@ class ProcessCaptureEditor(tk.Frame):
             "termination_timeout": 5,
             "termination_retries": 3
         }
+        # Options not editable in the UI (e.g. depends_on) are kept as loaded
+        self.additional_configuration = {}
 
         innerFrame = tk.Frame(self)
         innerFrame.columnconfigure(0, weight=1)
 
         self.path_selector = PathSelectionWidget(
             self.configuration_data["exe_path"],
-            innerFrame, "Exe:", file_dialog_button_text="Open"
+            innerFrame, "Exe:", file_dialog_button_text="Open", pick_running=True
         )
         self.path_selector.grid(row=0, column=0, padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF, sticky="EW")
 
@@ -191,6 +235,7 @@ class ProcessCaptureEditor(tk.Frame):
             "termination_retries": 3
         })
         self.configuration_data["exe_path"].set("")
+        self.additional_configuration = {}
 
     def set_configuration(self, configuration):
         self.configuration_data["exe_path"].set(configuration["exe_path"])
@@ -202,9 +247,12 @@ class ProcessCaptureEditor(tk.Frame):
             "termination_retries"
         ]:
             self.configuration_data[key] = configuration[key]
+        self.additional_configuration = {
+            key: value for key, value in configuration.items() if key not in self.configuration_data
+        }
 
     def get_configuration(self):
-        config = {}
+        config = dict(self.additional_configuration)
         config["exe_path"] = self.configuration_data["exe_path"].get()
         for key in [
             "args",
@@ -255,7 +303,7 @@ class SteglEditor(tk.Tk):
 
         game_frame = tk.Frame(self)
         self.game_directory_selector = PathSelectionWidget(
-            None, game_frame, open_mode="open_directory", label_text="Game Dir.:"
+            None, game_frame, open_mode="open_directory", label_text="Game Dir.:", pick_running=True
         )
         ToolTip(self.game_directory_selector, msg="GAME.game_search_paths", delay=1.5)
         self.game_directory_selector.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
@@ -266,21 +314,41 @@ class SteglEditor(tk.Tk):
 
         setting0 = tk.LabelFrame(game_frame, text="Game Search Timeout (seconds):")
         ToolTip(setting0, msg="GAME.game_search_timeout", delay=1.5)
-        self.game_search_timeout_slider = tk.Scale(setting0, from_=0, to=300, orient=tk.HORIZONTAL)
+        self.game_search_timeout_slider = AutoScale(setting0, from_=0, to=300)
         self.game_search_timeout_slider.set(60)
         self.game_search_timeout_slider.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
         setting0.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
 
         setting1 = tk.LabelFrame(game_frame, text="After Game Wait (seconds):")
         ToolTip(setting1, msg="GAME.after_game_wait", delay=1.5)
-        self.after_game_wait_slider = tk.Scale(setting1, from_=0, to=300, orient=tk.HORIZONTAL)
+        self.after_game_wait_slider = AutoScale(setting1, from_=0, to=300)
         self.after_game_wait_slider.set(10)
         self.after_game_wait_slider.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
         setting1.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
 
+        setting2 = tk.LabelFrame(game_frame, text="Game Tuning (optional):")
+        ToolTip(setting2, msg="GAME.tuning", delay=1.5)
+        setting2.columnconfigure(1, weight=1)
+        tk.Label(setting2, text="Priority:").grid(row=0, column=0, sticky="W", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        self.tuning_priority_var = tk.StringVar(self, "")
+        ttk.Combobox(setting2, textvariable=self.tuning_priority_var, values=("",) + PRIORITIES, state="readonly").grid(
+            row=0, column=1, sticky="EW", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        tk.Label(setting2, text="Comma-separated CPU cores:").grid(row=1, column=0, sticky="W", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        self.tuning_affinity_var = tk.StringVar(self, "")
+        tk.Entry(setting2, textvariable=self.tuning_affinity_var).grid(
+            row=1, column=1, sticky="EW", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        tk.Label(setting2, text="I/O Priority:").grid(row=2, column=0, sticky="W", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        self.tuning_io_priority_var = tk.StringVar(self, "")
+        ttk.Combobox(setting2, textvariable=self.tuning_io_priority_var, values=("",) + IO_PRIORITIES, state="readonly").grid(
+            row=2, column=1, sticky="EW", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
+        setting2.pack(fill="x", padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+
         notebook.add(game_frame, text="Game")
 
         self.dependencies = []
+        # Options of GAME not editable in the UI are kept as loaded
+        self.additional_game_configuration = {}
+        self.additional_tuning = {}
 
         dep_frame = tk.Frame(self)
         tk.Label(dep_frame, text="Dependencies are optional. Leave empty if not needed.").pack(fill="x", padx=DEFAULT_PADDING_HALF, pady=DEFAULT_PADDING_HALF)
@@ -325,6 +393,8 @@ class SteglEditor(tk.Tk):
         self.game_directory_selector.path_variable.set("")
         self.game_search_timeout_slider.set(60)
         self.after_game_wait_slider.set(20)
+        self.set_tuning({})
+        self.additional_game_configuration = {}
         self.status.set("Ready")
         
     def load_config(self, confirm=True):
@@ -345,6 +415,12 @@ class SteglEditor(tk.Tk):
                 self.game_directory_selector.path_variable.set(config["GAME"]["game_search_paths"][0])
                 self.game_search_timeout_slider.set(config["GAME"]["game_search_timeout"])
                 self.after_game_wait_slider.set(config["GAME"]["after_game_wait"])
+                self.set_tuning(config["GAME"].get("tuning", {}))
+                self.additional_game_configuration = {
+                    key: value for key, value in config["GAME"].items() if key not in [
+                        "game_search_paths", "game_search_timeout", "after_game_wait", "launch_config", "tuning"
+                    ]
+                }
                 while len(self.dependencies) < len(config["DEPENDENCIES"]):
                     self.add_dependency()
                 for i,d in enumerate(config["DEPENDENCIES"]):
@@ -356,6 +432,27 @@ class SteglEditor(tk.Tk):
 
         self.status.set("Loaded configuration.")
 
+    def set_tuning(self, tuning):
+        self.tuning_priority_var.set(tuning.get("priority") or "")
+        self.tuning_affinity_var.set(",".join(str(core) for core in tuning.get("affinity") or []))
+        self.tuning_io_priority_var.set(tuning.get("io_priority") or "")
+        # Options of GAME.tuning not editable in the UI are kept as loaded
+        self.additional_tuning = {
+            key: value for key, value in tuning.items() if key not in ["priority", "affinity", "io_priority"]
+        }
+
+    def get_tuning(self):
+        """Returns the tuning configuration, raises ValueError for invalid CPU cores."""
+        tuning = dict(self.additional_tuning)
+        if self.tuning_priority_var.get():
+            tuning["priority"] = self.tuning_priority_var.get()
+        cores = [core.strip() for core in self.tuning_affinity_var.get().split(",") if core.strip()]
+        if cores:
+            tuning["affinity"] = [int(core) for core in cores]
+        if self.tuning_io_priority_var.get():
+            tuning["io_priority"] = self.tuning_io_priority_var.get()
+        return tuning
+
     def save_config(self):
 
         filepath = filedialog.asksaveasfilename(
@@ -367,12 +464,21 @@ class SteglEditor(tk.Tk):
             filepath = filepath.with_suffix(".stegl")
 
         configuration = {}
-        configuration["GAME"] = {
+        configuration["GAME"] = dict(self.additional_game_configuration)
+        configuration["GAME"].update({
             "game_search_paths": [self.game_directory_selector.path_variable.get()],
             "game_search_timeout": self.game_search_timeout_slider.get(),
             "after_game_wait": self.after_game_wait_slider.get(),
             "launch_config": self.game_editor.get_configuration()
-        }
+        })
+        try:
+            tuning = self.get_tuning()
+        except ValueError:
+            showerror("Invalid Configuration", "The CPU cores must be comma-separated numbers (e.g. 0,1,2).")
+            self.status.set("Invalid Configuration: Invalid CPU cores.")
+            return
+        if tuning:
+            configuration["GAME"]["tuning"] = tuning
         configuration["DEPENDENCIES"] = []
         for dep in self.dependencies:
             dep_config = dep.get_configuration()
@@ -0,0 +1,88 @@
+"""Matching executables against the game search rules of a configuration."""
+
+import fnmatch
+import os
+
+
+def normalize_path(path : str):
+    """Normalizes a path for comparisons (absolute, normalized separators and on
+    case-insensitive platforms lower case)."""
+    return os.path.normcase(os.path.abspath(os.path.expanduser(str(path))))
+
+
+def _components(normalized_path : str):
+    drive, rest = os.path.splitdrive(normalized_path)
+    return [drive] + [c for c in rest.split(os.sep) if c]
+
+
+def _is_pattern(rule : str):
+    return any(c in rule for c in "*?[")
+
+
+class _PathTrie:
+    """Prefix trie keyed on path components."""
+
+    _TERMINAL = None
+
+    def __init__(self, paths = []):
+        self.root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path : str):
+        node = self.root
+        for component in _components(normalize_path(path)):
+            node = node.setdefault(component, {})
+        node[_PathTrie._TERMINAL] = True
+
+    def contains_prefix_of(self, components):
+        """Returns True if any added path is a prefix of (or equal to) the path."""
+        node = self.root
+        for component in components:
+            if _PathTrie._TERMINAL in node:
+                return True
+            node = node.get(component)
+            if node is None:
+                return False
+        return _PathTrie._TERMINAL in node
+
+
+class GameSearchMatcher:
+    """Compiled form of the game search rules. An executable matches if it lies
+    inside one of the search paths, its file name matches one of the exe patterns
+    (if given) and it is not excluded. Exclusions are either paths (excluding
+    everything inside them) or glob patterns matched against the full path.
+
+    Lookup costs depend on the depth of the path, not on the number of rules, and
+    results are cached per executable."""
+
+    def __init__(self, search_paths, exe_patterns = None, excludes = None, cache_size : int = 4096):
+        self.search_paths = _PathTrie(search_paths)
+        self.exe_patterns = [os.path.normcase(p) for p in (exe_patterns or [])]
+        self.excluded_paths = _PathTrie(e for e in (excludes or []) if not _is_pattern(e))
+        # Patterns aren't made absolute, so e.g. "*/CrashReporter*" matches in any directory
+        self.excluded_patterns = [os.path.normcase(os.path.expanduser(e)) for e in (excludes or []) if _is_pattern(e)]
+
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def _match(self, exe_path : str):
+        normalized = normalize_path(exe_path)
+        components = _components(normalized)
+        if not self.search_paths.contains_prefix_of(components):
+            return False
+        if self.exe_patterns and not any(fnmatch.fnmatchcase(components[-1], p) for p in self.exe_patterns):
+            return False
+        if self.excluded_paths.contains_prefix_of(components):
+            return False
+        return not any(fnmatch.fnmatchcase(normalized, p) for p in self.excluded_patterns)
+
+    def matches(self, exe_path : str):
+        if not exe_path:
+            return False
+        result = self._cache.get(exe_path)
+        if result is None:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            result = self._cache[exe_path] = self._match(exe_path)
+        return result
@@ -0,0 +1,268 @@
+"""Recording how long launches actually take, to derive timing options from it.
+
+After every session one record per configuration is appended as a JSON line to
+the history file (`~/.stegl/launch_history.jsonl` by default):
+- launches: per launch group ("game_starter", "dependency <name or index>") the
+  time until its last PID change (`settle_seconds`) and the longest quiet gap
+  between two PID changes (`max_gap_seconds`)
+- game_search_seconds: launch of the game starter until a game process was found
+- activity_seconds: game closed until the remaining processes became quiet
+Values that hit their limit (e.g. a launch that timed out) are marked as censored,
+as the actual duration was longer. They are left out when deriving timing options.
+
+Configurations are identified by their game search paths and game starter, so
+changing other options doesn't lose their history. Only the most recent
+`max_sessions` records of at most `max_configurations` configurations are kept;
+the file is compacted once it grew beyond that.
+
+Timing options set to "auto" are derived from a high percentile of the recorded
+values plus some headroom for outliers, see `resolve_auto`."""
+
+from pathlib import Path
+import hashlib
+import json
+import math
+import os
+import time
+
+from stegl.logging import print_log
+
+HISTORY_PATH = Path.home() / ".stegl" / "launch_history.jsonl"
+
+# Used for "auto" values until enough sessions were recorded
+DEFAULTS = {"max_launch_waiting": 10, "min_launch_stable": 3, "game_search_timeout": 30, "after_game_wait": 10}
+MIN_SESSIONS = 3
+PERCENTILE = 95
+
+
+def configuration_key(game_search_paths, exe_path : str, args = ()):
+    return hashlib.sha256(json.dumps([list(game_search_paths), exe_path, list(args)]).encode("utf-8")).hexdigest()[:16]
+
+
+def configuration_name(game_search_paths, exe_path : str):
+    """Human readable name of a configuration, e.g. the game's directory."""
+    if game_search_paths:
+        return os.path.basename(os.path.normpath(game_search_paths[0])) or game_search_paths[0]
+    return os.path.basename(exe_path)
+
+
+def launch_label(index : int = None, name : str = None):
+    """Label of a launch group: the game starter (no index) or a dependency."""
+    if index is None:
+        return "game_starter"
+    return f"dependency {name or index}"
+
+
+def percentile(values, p : float):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class LaunchHistory:
+    def __init__(self, path = HISTORY_PATH, max_sessions : int = 30, max_configurations : int = 100):
+        self.path = Path(path)
+        self.max_sessions = max_sessions
+        self.max_configurations = max_configurations
+
+    def _read(self):
+        records = []
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # E.g. a partially written line
+                        pass
+        except FileNotFoundError:
+            pass
+        return records
+
+    def sessions(self, key : str = None):
+        """Records of one configuration (or of all, grouped by key), oldest first."""
+        grouped = {}
+        for record in self._read():
+            grouped.setdefault(record.get("key"), []).append(record)
+        if key is not None:
+            return grouped.get(key, [])[-self.max_sessions:]
+        return {k: records[-self.max_sessions:] for k, records in grouped.items()}
+
+    def append(self, record : dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        records = self._read()
+        if len(records) > 2 * self.max_sessions * min(len(set(r.get("key") for r in records)), self.max_configurations):
+            self._compact(records)
+
+    def _compact(self, records):
+        grouped = {}
+        for record in records:
+            grouped.setdefault(record.get("key"), []).append(record)
+        # Configurations used most recently are kept
+        keys = sorted(grouped, key=lambda k: grouped[k][-1].get("time", 0))[-self.max_configurations:]
+        kept = sorted((r for k in keys for r in grouped[k][-self.max_sessions:]), key=lambda r: r.get("time", 0))
+        temporary = self.path.with_suffix(".tmp")
+        with temporary.open("w", encoding="utf-8") as f:
+            for record in kept:
+                f.write(json.dumps(record) + "\n")
+        os.replace(temporary, self.path)
+
+
+def _values(sessions, read, censored = None):
+    """Values read from the sessions, leaving out censored ones (only lower bounds
+    of the actual durations)."""
+    values = []
+    for session in sessions:
+        try:
+            value = read(session)
+            if censored is not None and censored(session):
+                continue
+        except (KeyError, TypeError):
+            continue
+        if value is not None:
+            values.append(value)
+    return values
+
+
+def statistics(sessions):
+    """Recorded (uncensored) values of all timing options, per launch group where
+    applicable."""
+    labels = []
+    for session in sessions:
+        labels += [label for label in session.get("launches", {}) if label not in labels]
+    stats = {
+        "game_search_seconds": _values(sessions, lambda s: s["game_search_seconds"], lambda s: s.get("game_search_censored")),
+        "activity_seconds": _values(sessions, lambda s: s["activity_seconds"], lambda s: s.get("activity_censored")),
+        "launches": {}
+    }
+    for label in labels:
+        stats["launches"][label] = {
+            "settle_seconds": _values(sessions, lambda s: s["launches"][label]["settle_seconds"],
+                                      lambda s: s["launches"][label].get("censored")),
+            # Gaps seen during a launch that timed out did happen
+            "max_gap_seconds": _values(sessions, lambda s: s["launches"][label]["max_gap_seconds"])
+        }
+    return stats
+
+
+def auto_values(sessions):
+    """Derives timing options from the recorded sessions. Options without enough
+    recorded values are missing."""
+    stats = statistics(sessions)
+    def derive(values, factor, padding, minimum=0):
+        if len(values) < MIN_SESSIONS:
+            return None
+        return round(max(minimum, percentile(values, PERCENTILE) * factor + padding), 1)
+
+    values = {
+        "game_search_timeout": derive(stats["game_search_seconds"], 1.5, 5),
+        "after_game_wait": derive(stats["activity_seconds"], 1.25, 2),
+        "launches": {}
+    }
+    for label, launch in stats["launches"].items():
+        # Shorter stable times would have ended the launch during one of the gaps
+        # The launch is only considered stable `min_launch_stable` after settling
+        values["launches"][label] = {
+            "min_launch_stable": derive(launch["max_gap_seconds"], 1.25, 0.5, minimum=1.0),
+            "settle": derive(launch["settle_seconds"], 1.25, 1)
+        }
+    return values
+
+
+def _max_launch_waiting(settle, min_launch_stable):
+    return None if settle is None else round(settle + min_launch_stable, 1)
+
+
+def _launch_configs(config : dict):
+    return [(launch_label(), config["GAME"]["launch_config"])] + [
+        (launch_label(i, dep.get("name")), dep) for i, dep in enumerate(config["DEPENDENCIES"])
+    ]
+
+
+def history_from_option(option):
+    """The history configured by `GAME.launch_history`: True for the default file,
+    a path for another one or False to disable it."""
+    if option is False or option is None:
+        return None
+    return LaunchHistory() if option is True else LaunchHistory(Path(option).expanduser())
+
+
+def resolve_auto(config : dict, history : LaunchHistory = None):
+    """Returns a copy of the configuration with all "auto" timing options replaced by
+    values derived from the history (or defaults while there is too little or no
+    history)."""
+    options = [config["GAME"]] + [launch_config for _, launch_config in _launch_configs(config)]
+    if not any(value == "auto" for o in options for value in o.values()):
+        return config
+
+    starter = config["GAME"]["launch_config"]
+    key = configuration_key(config["GAME"]["game_search_paths"], starter["exe_path"], starter.get("args", []))
+    sessions = history.sessions(key) if history is not None else []
+    values = auto_values(sessions)
+
+    def resolve(options, option, value, label):
+        if options.get(option) != "auto":
+            return
+        options[option] = value if value is not None else DEFAULTS[option]
+        if value is not None:
+            source = f"{len(sessions)} recorded sessions"
+        else:
+            source = "default, too few recorded sessions" if history is not None else "default, launch history disabled"
+        print_log(f"Using {option} of {options[option]} seconds for {label} ({source}).")
+
+    config = dict(config, GAME=dict(config["GAME"]), DEPENDENCIES=[dict(dep) for dep in config["DEPENDENCIES"]])
+    config["GAME"]["launch_config"] = dict(config["GAME"]["launch_config"])
+    for option in ("game_search_timeout", "after_game_wait"):
+        resolve(config["GAME"], option, values[option], "the game")
+    for label, launch_config in _launch_configs(config):
+        launch = values["launches"].get(label, {})
+        resolve(launch_config, "min_launch_stable", launch.get("min_launch_stable"), label)
+        min_launch_stable = launch_config.get("min_launch_stable", DEFAULTS["min_launch_stable"])
+        resolve(launch_config, "max_launch_waiting", _max_launch_waiting(launch.get("settle"), min_launch_stable), label)
+    return config
+
+
+def session_record(game):
+    """Builds the history record of a finished session of an `AsyncExternalGame`."""
+    launches = {}
+    for i, capture in enumerate(game.dependencies + [game.game_starter]):
+        if capture.launch_stats is None:
+            # E.g. attached to a running instance
+            continue
+        label = launch_label() if capture is game.game_starter else launch_label(i, capture.name)
+        launches[label] = capture.launch_stats
+    starter = game.game_starter
+    return {
+        "key": configuration_key(game.game_search_paths, starter.exe_path, starter.args),
+        "name": configuration_name(game.game_search_paths, starter.exe_path),
+        "time": time.time(),
+        "launches": launches,
+        **game.measurements
+    }
+
+
+def describe(sessions):
+    """Lines summarizing the recorded sessions of one configuration, e.g. for the
+    launch-stats command."""
+    stats = statistics(sessions)
+    values = auto_values(sessions)
+    last = time.strftime("%Y-%m-%d %H:%M", time.localtime(sessions[-1].get("time", 0)))
+    lines = [f"{sessions[-1].get('name')} ({sessions[-1].get('key')}): {len(sessions)} sessions, last on {last}"]
+
+    def line(label, measured, option, value):
+        if not measured:
+            return f"  {label:<34} no measurements"
+        summary = f"p50 {percentile(measured, 50):.1f}s, p{PERCENTILE} {percentile(measured, PERCENTILE):.1f}s, max {max(measured):.1f}s"
+        auto = f"{value}s" if value is not None else f"{DEFAULTS[option]}s (default, too few sessions)"
+        return f"  {label:<34} {summary:<40} auto {option}: {auto}"
+
+    lines.append(line("game search", stats["game_search_seconds"], "game_search_timeout", values["game_search_timeout"]))
+    lines.append(line("activity after game", stats["activity_seconds"], "after_game_wait", values["after_game_wait"]))
+    for label, launch in stats["launches"].items():
+        auto = values["launches"][label]
+        max_launch_waiting = _max_launch_waiting(auto["settle"], auto["min_launch_stable"] or DEFAULTS["min_launch_stable"])
+        lines.append(line(f"{label} settling", launch["settle_seconds"], "max_launch_waiting", max_launch_waiting))
+        lines.append(line(f"{label} longest gap", launch["max_gap_seconds"], "min_launch_stable", auto["min_launch_stable"]))
+    return lines
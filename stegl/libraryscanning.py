@@ -0,0 +1,456 @@
+"""Generating configurations for whole game libraries (`scan-library`).
+
+Every directory directly inside a library root (or a root which is itself an
+install directory) is considered a title if it contains a launcher manifest or
+an executable:
+- Epic Games: `.egstore/*.mancpn` inside the install directory, or the launcher's
+  `*.item` manifests. The game is started through the Epic Games Launcher.
+- GOG: `goggame-*.info` inside the install directory, whose primary play task
+  names the executable and its arguments.
+- Otherwise the most likely main executable is guessed from its name, size and
+  depth, skipping installers, crash reporters, anti-cheat and similar helpers.
+
+Titles are scanned on a bounded thread pool. The modification times of the
+directories and manifests a title was derived from are stored in a state file
+next to the configurations, so unchanged titles are skipped by later scans. So
+are directories without a title, until they or their subdirectories change.
+Existing configurations are updated in place: only values still equal to what an
+earlier scan generated are replaced, everything edited by hand is kept."""
+
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+import json
+import math
+import os
+import re
+import sys
+
+from stegl.gamematching import normalize_path
+
+EPIC_LAUNCHER_PATH = "C:/Program Files (x86)/Epic Games/Launcher/Portal/Binaries/Win64/EpicGamesLauncher.exe"
+EPIC_MANIFESTS_PATH = "C:/ProgramData/Epic/EpicGamesLauncher/Data/Manifests"
+STATE_FILE = ".stegl-library.json"
+
+# Executables which are never the game itself (matched against the lower case file name without suffix)
+EXCLUDED_EXES = (
+    "unins*", "*setup*", "*install*", "*redist*", "dxwebsetup", "dotnet*", "ue4prereq*", "ue5prereq*",
+    "*crash*", "*report*", "*updater*", "*update", "*helper*", "*_be", "*easyanticheat*", "battleye*",
+    "*config*", "*settings*", "*server*", "*editor*", "*benchmark*", "*touchup*", "*diagnostic*",
+    "cefsharp*", "*webhelper*", "unitycrashhandler*", "python*", "pythonw", "7z*"
+)
+EXCLUDED_DIRECTORIES = {
+    ".egstore", "_commonredist", "commonredist", "redist", "redistributables", "directx", "dotnetfx",
+    "vcredist", "__installer", "installer", "support", "__pycache__"
+}
+# Limits of the search for executables inside one install directory
+MAX_DEPTH = 4
+MAX_ENTRIES = 20000
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0].lower()
+
+
+def _tokens(text : str):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _is_executable(entry : os.DirEntry):
+    name = entry.name.lower()
+    if name.endswith(".exe"):
+        return True
+    if sys.platform == "win32":
+        return False
+    # Native Linux builds, e.g. "game.x86_64" or "game" without suffix
+    return (name.endswith(".x86_64") or "." not in name) and os.access(entry.path, os.X_OK)
+
+
+def find_executables(directory : str, max_depth : int = MAX_DEPTH, max_entries : int = MAX_ENTRIES):
+    """Candidate executables inside a directory as (path, size, depth), skipping
+    helpers. Stops after `max_entries` directory entries, e.g. inside asset folders."""
+    executables = []
+    pending = [(directory, 0)]
+    entries = 0
+    while pending and entries < max_entries:
+        current, depth = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    entries += 1
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if depth < max_depth and entry.name.lower() not in EXCLUDED_DIRECTORIES:
+                                pending.append((entry.path, depth + 1))
+                        elif entry.is_file() and _is_executable(entry):
+                            if not any(fnmatch(_stem(entry.name), pattern) for pattern in EXCLUDED_EXES):
+                                executables.append((entry.path, entry.stat().st_size, depth))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return executables
+
+
+def _exe_score(path, size, depth, title):
+    stem = _stem(path)
+    compact_stem = re.sub(r"[^a-z0-9]", "", stem)
+    compact_title = re.sub(r"[^a-z0-9]", "", title.lower())
+    # Game executables are large, helpers and bootstrappers small
+    score = math.log2(max(size, 1)) - 2 * depth
+    if compact_title and compact_stem and (compact_title in compact_stem or compact_stem in compact_title):
+        score += 8
+    else:
+        score += 3 * len(_tokens(stem) & _tokens(title))
+    if "shipping" in stem:
+        # Unreal Engine's actual game binary
+        score += 4
+    if "launcher" in stem:
+        score -= 4
+    return score
+
+
+def guess_main_executable(directory : str, title : str):
+    """The most likely main executable of a game or None."""
+    candidates = find_executables(directory)
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (_exe_score(c[0], c[1], c[2], title), -len(c[0])))[0]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _directory_mtimes(directory):
+    """Modification times of a directory and its subdirectories, which change once
+    something gets installed into it."""
+    mtimes = {directory: _mtime(directory)}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    mtimes[entry.path] = _mtime(entry.path)
+    except OSError:
+        pass
+    return mtimes
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8-sig") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_epic_manifests(directory : str = EPIC_MANIFESTS_PATH):
+    """Epic Games Launcher manifests (`*.item`) by normalized install location."""
+    manifests = {}
+    try:
+        paths = list(Path(directory).glob("*.item"))
+    except OSError:
+        return manifests
+    for path in paths:
+        manifest = _read_json(path)
+        if manifest and manifest.get("InstallLocation"):
+            manifest["_path"] = str(path)
+            manifests[normalize_path(manifest["InstallLocation"])] = manifest
+    return manifests
+
+
+def _epic_args(namespace, catalog_item, app_name):
+    return [f"-com.epicgames.launcher://apps/{namespace}%3A{catalog_item}%3A{app_name}?action=launch&silent=true"]
+
+
+def _epic_title(directory, manifests, epic_launcher):
+    manifest = manifests.get(normalize_path(directory))
+    if manifest is not None:
+        sources = [manifest["_path"]]
+    else:
+        for path in Path(directory, ".egstore").glob("*.mancpn"):
+            manifest = _read_json(path)
+            if manifest:
+                sources = [str(path)]
+                break
+        else:
+            return None
+    try:
+        args = _epic_args(manifest["CatalogNamespace"], manifest["CatalogItemId"], manifest["AppName"])
+    except KeyError:
+        return None
+    return {
+        "name": manifest.get("DisplayName") or os.path.basename(directory),
+        "source": "epic",
+        "exe_path": epic_launcher,
+        "args": args,
+        "sources": sources
+    }
+
+
+def split_arguments(arguments : str):
+    """Splits a command line into arguments the way Windows programs do (see
+    CommandLineToArgvW): quotes group whitespace and are removed, `""` inside
+    quotes is a literal quote and backslashes only escape quotes."""
+    args = []
+    current = None # None until the current argument started
+    quoted = False
+    backslashes = 0
+    i = 0
+    while i < len(arguments):
+        c = arguments[i]
+        if c == "\\":
+            backslashes += 1
+        else:
+            if c == '"':
+                current = (current or "") + "\\" * (backslashes // 2)
+                if backslashes % 2 == 1:
+                    current += '"'
+                elif quoted and arguments[i + 1:i + 2] == '"':
+                    current += '"'
+                    i += 1
+                else:
+                    quoted = not quoted
+            else:
+                if backslashes > 0:
+                    current = (current or "") + "\\" * backslashes
+                if c in " \t" and not quoted:
+                    if current is not None:
+                        args.append(current)
+                    current = None
+                else:
+                    current = (current or "") + c
+            backslashes = 0
+        i += 1
+    if backslashes > 0:
+        current = (current or "") + "\\" * backslashes
+    if current is not None:
+        args.append(current)
+    return args
+
+
+def _gog_title(directory):
+    for path in Path(directory).glob("goggame-*.info"):
+        info = _read_json(path)
+        if not info:
+            continue
+        tasks = [task for task in info.get("playTasks", []) if task.get("type") == "FileTask" and task.get("path")]
+        task = next((task for task in tasks if task.get("isPrimary")), tasks[0] if tasks else None)
+        if task is None:
+            continue
+        exe_path = os.path.join(directory, task["path"])
+        return {
+            "name": info.get("name") or os.path.basename(directory),
+            "source": "gog",
+            "exe_path": exe_path,
+            "args": split_arguments(task.get("arguments", "")),
+            "sources": [str(path), os.path.dirname(exe_path)]
+        }
+    return None
+
+
+def scan_title(directory : str, epic_manifests : dict = {}, epic_launcher : str = EPIC_LAUNCHER_PATH):
+    """Recognises the game installed in a directory. Returns None if there is none,
+    otherwise a dict with name, source, exe_path, args and the modification times
+    (`mtimes`) of everything it was derived from."""
+    title = _epic_title(directory, epic_manifests, epic_launcher) or _gog_title(directory)
+    if title is None:
+        name = os.path.basename(os.path.normpath(directory))
+        exe_path = guess_main_executable(directory, name)
+        if exe_path is None:
+            return None
+        title = {"name": name, "source": "directory", "exe_path": exe_path, "args": [], "sources": [os.path.dirname(exe_path)]}
+    title["install_dir"] = directory
+    sources = [directory] + title.pop("sources")
+    title["mtimes"] = {path: _mtime(path) for path in sources}
+    return title
+
+
+def _is_install_directory(directory):
+    return (
+        any(Path(directory).glob("goggame-*.info"))
+        or any(Path(directory, ".egstore").glob("*.mancpn"))
+    )
+
+
+def candidate_directories(roots):
+    """Directories which may contain a title: roots that are install directories
+    themselves and all directories directly inside the other roots."""
+    directories = []
+    for root in roots:
+        root = os.path.abspath(root)
+        if _is_install_directory(root):
+            directories.append(root)
+            continue
+        try:
+            with os.scandir(root) as it:
+                directories += sorted(
+                    entry.path for entry in it
+                    if entry.is_dir() and not entry.name.startswith(".") and entry.name.lower() not in EXCLUDED_DIRECTORIES
+                )
+        except OSError:
+            continue
+    return directories
+
+
+def _file_name(name : str):
+    return re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", name).strip(" .") or "game"
+
+
+def _posix(path : str):
+    return Path(path).as_posix()
+
+
+def generated_values(title : dict):
+    return {
+        "game_search_paths": [_posix(title["install_dir"])],
+        "exe_path": _posix(title["exe_path"]),
+        "args": title["args"]
+    }
+
+
+def new_configuration(values : dict):
+    """A configuration in the layout of `Control_Example.stegl`."""
+    return {
+        "GAME": {
+            "game_search_paths": values["game_search_paths"],
+            "game_search_timeout": 60,
+            "after_game_wait": 20,
+            "launch_config": {
+                "exe_path": values["exe_path"],
+                "args": values["args"],
+                "max_launch_waiting": 10,
+                "min_launch_stable": 3,
+                "termination_timeout": 5,
+                "termination_retries": 3
+            }
+        },
+        "DEPENDENCIES": []
+    }
+
+
+def update_configuration(config : dict, values : dict, previous : dict = None):
+    """Replaces the generated values of an existing configuration, unless they were
+    changed since they were generated (`previous`). Returns whether anything changed."""
+    targets = {
+        "game_search_paths": config["GAME"],
+        "exe_path": config["GAME"]["launch_config"],
+        "args": config["GAME"]["launch_config"]
+    }
+    changed = False
+    for key, target in targets.items():
+        if previous is not None and key in previous and target.get(key) != previous[key]:
+            # Edited by hand
+            continue
+        if target.get(key) != values[key]:
+            target[key] = values[key]
+            changed = True
+    return changed
+
+
+class LibraryScanner:
+    """Writes one configuration per title found in `roots` to `output`."""
+
+    def __init__(
+        self,
+        output,
+        workers : int = 8,
+        epic_launcher : str = EPIC_LAUNCHER_PATH,
+        epic_manifests : str = EPIC_MANIFESTS_PATH,
+        full : bool = False
+    ):
+        self.output = Path(output)
+        self.workers = workers
+        self.epic_launcher = epic_launcher
+        self.epic_manifests = read_epic_manifests(epic_manifests) if epic_manifests else {}
+        self.full = full
+        self.state_path = self.output / STATE_FILE
+        # Also read for full scans, so configurations keep their file and hand edits
+        self.state = _read_json(self.state_path) or {"titles": {}}
+        # Directories without a title, by normalized path
+        self.state.setdefault("empty", {})
+
+    def _unchanged(self, directory):
+        if self.full:
+            return False
+        key = normalize_path(directory)
+        empty = self.state["empty"].get(key)
+        if empty is not None:
+            return _directory_mtimes(directory) == empty["mtimes"]
+        entry = self.state["titles"].get(key)
+        if entry is None or not (self.output / entry["file"]).exists():
+            return False
+        return all(_mtime(path) == mtime for path, mtime in entry["mtimes"].items())
+
+    def _scan(self, directory):
+        if self._unchanged(directory):
+            return directory, "unchanged"
+        # Taken before scanning, so changes during the scan are noticed next time
+        mtimes = _directory_mtimes(directory)
+        title = scan_title(directory, self.epic_manifests, self.epic_launcher)
+        return directory, title if title is not None else {"mtimes": mtimes}
+
+    def _configuration_path(self, title):
+        key = normalize_path(title["install_dir"])
+        entry = self.state["titles"].get(key)
+        if entry is not None:
+            return self.output / entry["file"]
+        used = {entry["file"].lower() for entry in self.state["titles"].values()}
+        name = _file_name(title["name"])
+        file_name = f"{name}.stegl"
+        index = 2
+        while file_name.lower() in used or (self.output / file_name).exists():
+            file_name = f"{name} ({index}).stegl"
+            index += 1
+        return self.output / file_name
+
+    def _write(self, title):
+        """Writes the configuration of a title, returns whether it was created,
+        updated or left as is."""
+        key = normalize_path(title["install_dir"])
+        entry = self.state["titles"].get(key)
+        path = self._configuration_path(title)
+        values = generated_values(title)
+        config = _read_json(path) if path.exists() else None
+        if config is None:
+            config = new_configuration(values)
+            result = "created"
+        else:
+            result = "updated" if update_configuration(config, values, entry and entry.get("generated")) else "unchanged"
+        if result != "unchanged":
+            with path.open("w") as f:
+                json.dump(config, f, indent=4)
+        self.state["titles"][key] = {"file": path.name, "name": title["name"], "mtimes": title["mtimes"], "generated": values}
+        return path, result
+
+    def scan(self, roots, report = None):
+        """Scans all roots, returns the number of titles per result ("created",
+        "updated", "unchanged", "skipped")."""
+        self.output.mkdir(parents=True, exist_ok=True)
+        counts = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Configurations are written in order, so file names are assigned deterministically
+            for directory, title in executor.map(self._scan, candidate_directories(roots)):
+                if title == "unchanged":
+                    counts["skipped"] += 1
+                    continue
+                key = normalize_path(directory)
+                if "exe_path" not in title:
+                    self.state["empty"][key] = title
+                    continue
+                self.state["empty"].pop(key, None)
+                path, result = self._write(title)
+                counts[result] += 1
+                if report is not None and result != "unchanged":
+                    report(f"{result.capitalize()} {path.name} ({title['source']}: {title['exe_path']} {' '.join(title['args'])}".rstrip() + ").")
+
+        for key in [key for key in self.state["empty"] if not os.path.isdir(key)]:
+            del self.state["empty"][key]
+        temporary = self.state_path.with_suffix(".tmp")
+        with temporary.open("w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temporary, self.state_path)
+        return counts
@@ -1,4 +1,29 @@
+import contextvars
+
 ACTIVE = True
 
+# Optional per-context sink replacing the console output, e.g. for streaming the
+# output of a session run by the supervisor back to its client
+SINK = contextvars.ContextVar("SINK", default=None)
+
 def print_log(text, end="\n"):
-    if ACTIVE: print(text, end=end, flush=True)
\ No newline at end of file
+    sink = SINK.get()
+    if sink is not None:
+        sink(text, end)
+    elif ACTIVE:
+        print(text, end=end, flush=True)
+
+def prefixed_sink(prefix : str):
+    """Returns a sink prefixing every line with `prefix` before passing it on to the
+    current sink (or the console), e.g. to tell apart the output of concurrent games."""
+    parent = SINK.get()
+    at_line_start = True
+    def sink(text, end="\n"):
+        nonlocal at_line_start
+        text = f"{prefix}{text}" if at_line_start else str(text)
+        at_line_start = end.endswith("\n")
+        if parent is not None:
+            parent(text, end)
+        elif ACTIVE:
+            print(text, end=end, flush=True)
+    return sink
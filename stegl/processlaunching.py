@@ -1,196 +1,1503 @@
+from collections import OrderedDict
+from fnmatch import fnmatch
 from pathlib import Path
+import asyncio
+import subprocess
+import threading
 import time
 import psutil
 import os
 
+from stegl import clock
+from stegl.cgroups import CgroupGroups, find_writable_cgroup
+from stegl.gamematching import GameSearchMatcher
+from stegl.launchhistory import LaunchHistory, history_from_option, resolve_auto, session_record
 from stegl.logging import print_log
+from stegl import processrecording as recording
+from stegl import tracing
+from stegl.processwatching import PollingProcessWatcher, create_watcher, is_process_alive
+from stegl.resourceprofiling import ActivityMonitor, ResourceProfiler
+from stegl.throttling import Throttle, Tuning
 
-class ProcessCapture:
+
+class ProcessMetadataCache:
+    """Caches metadata which doesn't change during the lifetime of a process (exe path,
+    create time, cmdline, PPID and STEGL membership). Entries are keyed by
+    (pid, create_time), so reused PIDs don't return stale data. The cache is bounded
+    to `max_size` entries (least recently used are evicted first) and entries of
+    exited processes are dropped via `retain`."""
+
+    def __init__(self, max_size : int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(process):
+        # psutil already reads the create time when the process object is created
+        return (process.pid, process.create_time())
+
+    def _entry(self, process):
+        key = self.key(process)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {}
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _get(self, process, field, read):
+        entry = self._entry(process)
+        if field in entry:
+            self.hits += 1
+            return entry[field]
+        self.misses += 1
+        value = read()
+        with self._lock:
+            # Values set meanwhile (see `set_membership`) are more recent
+            return entry.setdefault(field, value)
+
+    def exe(self, process, refresh : bool = False):
+        """`refresh` re-reads the exe path, which changes if the process executed
+        another program."""
+        if refresh:
+            self._entry(process).pop("exe", None)
+            return self._get(process, "exe", lambda: self._read_exe(process))
+        return self._get(process, "exe", process.exe)
+
+    def _read_exe(self, process):
+        # psutil caches the exe path in the process object as well
+        return psutil.Process(process.pid).exe()
+
+    def create_time(self, process):
+        return self._get(process, "create_time", process.create_time)
+
+    def cmdline(self, process):
+        return self._get(process, "cmdline", process.cmdline)
+
+    def ppid(self, process):
+        return self._get(process, "ppid", process.ppid)
+
+    def membership(self, process, read):
+        """STEGL IDs found in the environment of the process, `read` is only called
+        if not cached yet."""
+        return self._get(process, "membership", read)
+
+    def set_membership(self, process, ids):
+        """Overwrites the membership of a process that just executed another program.
+        Until the exec, it still had the environment (and exe path) of its parent,
+        which a concurrent scan might have cached already."""
+        entry = self._entry(process)
+        with self._lock:
+            entry["membership"] = frozenset(ids)
+            entry.pop("exe", None)
+            entry.pop("cmdline", None)
+
+    def retain(self, keys):
+        """Drops all entries not belonging to the passed (running) keys."""
+        with self._lock:
+            for key in [key for key in self._entries if key not in keys]:
+                del self._entries[key]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0
+        }
+
+
+class ProcessTable:
+    """Shared view on the system's process table. A single scan sorts every process
+    into the buckets of the STEGL IDs found in its environment, so that any number
+    of ProcessCaptures can be served by one pass over the table.
+
+    Three tracking modes are available:
+    - "environ": Every scan lists all processes. Their environment is read once per
+      process (the membership is cached for the lifetime of the process).
+    - "tree": Keeps a live set of member processes and grows it along parent/child
+      links. Every scan only lists the PIDs, processes started since the last scan
+      are attributed to their parent if it is a member. The environment is only
+      read for new processes that can't be attributed otherwise (e.g. reparented
+      processes), the cost of a scan doesn't depend on the other processes'.
+    - "cgroup" (Linux): Every launch group gets its own cgroup, scans only read the
+      members of the groups (see cgroups.py). Falls back to "environ" if no
+      writable cgroup is available.
+
+    Already running processes can be adopted into a launch group (see `adopt`).
+    Lacking the group's environment variable and cgroup, they and their
+    descendants are tracked along parent/child links in every mode."""
+
+    TRACKING_MODES = ("environ", "tree", "cgroup")
+    # Callers requesting a fresh snapshot share a scan running at the time of their
+    # request if it started at most this many milliseconds before
+    SHARED_SCAN_TOLERANCE_MS = 50
+
+    def __init__(self, root_pid : int = None, tracking : str = "environ", metadata : ProcessMetadataCache = None):
+        if tracking not in ProcessTable.TRACKING_MODES:
+            raise ValueError(f"Unknown tracking mode {repr(tracking)}.")
+        self.root_pid = root_pid if root_pid is not None else psutil.Process().pid
+        self.tracking = tracking
+        self.cgroups = None
+        if tracking == "cgroup":
+            base = find_writable_cgroup()
+            if base is not None:
+                self.cgroups = CgroupGroups(base)
+            else:
+                print_log("No writable cgroup available, falling back to \"environ\" process tracking.")
+                self.tracking = "environ"
+        self.metadata = metadata if metadata is not None else ProcessMetadataCache()
+        self.ids = set()
+        self.scan_count = 0
+        self.environ_reads = 0
+
+        self._buckets = {}
+        self._timestamp = None
+        self._finished = None # End of the last scan
+        self._lock = threading.Lock()
+
+        # State of the "tree" tracking mode. Processes existing before the table
+        # was created can't belong to any of its launch groups.
+        self._members = {} # pid -> psutil.Process
+        self._seen_pids = set(psutil.pids()) if tracking == "tree" else set()
+        self._launched = {} # pid -> psutil.Process, roots launched since the last scan
+
+        # Adopted process trees: STEGL ID -> {pid -> psutil.Process}
+        self._adopted = {}
+        self._adopted_seen_pids = set()
+
+    def register(self, stegl_id : str):
+        with self._lock:
+            if self.cgroups is not None:
+                self.cgroups.create(stegl_id)
+            self.ids.add(stegl_id)
+            # Force a rescan, the current snapshot doesn't know about the new ID
+            self._timestamp = None
+
+    def unregister(self, stegl_id : str):
+        with self._lock:
+            self.ids.discard(stegl_id)
+            self._buckets.pop(stegl_id, None)
+            self._adopted.pop(stegl_id, None)
+            if self.cgroups is not None:
+                self.cgroups.remove(stegl_id)
+
+    def adopt(self, stegl_id : str, processes):
+        """Adds already running processes and their descendants to a launch group.
+        Processes they start later join the group as well."""
+        with self._lock:
+            # Children started since the last scan must join their trees first
+            self._scan_adopted()
+            tree = self._adopted.setdefault(stegl_id, {})
+            for p in processes:
+                try:
+                    for member in [p] + p.children(recursive=True):
+                        tree[member.pid] = member
+                except psutil.NoSuchProcess:
+                    pass
+            self._timestamp = None
+
+    def adopted_pids(self, stegl_id : str):
+        """PIDs of the group's adopted processes as of the last snapshot."""
+        with self._lock:
+            return set(self._adopted.get(stegl_id, ()))
+
+    def popen_arguments(self, stegl_id : str):
+        """Additional arguments for launching the root process of a launch group."""
+        if self.cgroups is None:
+            return {}
+        # Joining happens before exec, so no descendant can escape the group
+        return {"preexec_fn": self.cgroups.joiner(stegl_id)}
+
+    def launch(self, stegl_id : str, command, environ : dict, cwd : str = None):
+        """Starts the root process of a launch group."""
+        try:
+            process = psutil.Popen(command, env=environ, cwd=cwd, **self.popen_arguments(stegl_id))
+        except subprocess.SubprocessError as e:
+            if self.cgroups is None:
+                raise
+            # The root couldn't join its cgroup. Launched processes carry their
+            # STEGL IDs in their environment as well, so all groups remain tracked.
+            print_log(f"Joining the cgroup of {repr(stegl_id)} failed ({e}), falling back to \"environ\" process tracking.")
+            self._stop_cgroup_tracking()
+            process = psutil.Popen(command, env=environ, cwd=cwd)
+        # A scan running concurrently might have seen it before the exec
+        self.metadata.set_membership(process, (key for key in environ if key.startswith("STEGL_")))
+        if self.tracking == "tree":
+            self._launched[process.pid] = process
+        return process
+
+    def _stop_cgroup_tracking(self):
+        with self._lock:
+            for stegl_id in self.ids:
+                self.cgroups.remove(stegl_id)
+            self.cgroups = None
+            self.tracking = "environ"
+            self._timestamp = None
+
+    def freeze(self, stegl_id : str, frozen : bool = True):
+        """Freezes (or thaws) the whole launch group at once. Returns False if not
+        supported by the tracking mode, in which case processes have to be suspended
+        one by one."""
+        return self.cgroups is not None and self.cgroups.freeze(stegl_id, frozen)
+
+    def kill(self, stegl_id : str):
+        """Kills the whole launch group at once. Returns False if not supported by
+        the tracking mode."""
+        return self.cgroups is not None and self.cgroups.kill(stegl_id)
+
+    def _scan(self):
+        if self.tracking == "tree":
+            members = self._scan_tree()
+        elif self.tracking == "cgroup":
+            members = self._scan_cgroup()
+        else:
+            members = self._scan_environ()
+        if self._adopted:
+            known = set(p.pid for p, _ in members)
+            members += [(p, ids) for p, ids in self._scan_adopted() if p.pid not in known]
+        self.scan_count += 1
+
+        buckets = {stegl_id: [] for stegl_id in self.ids}
+        for p, ids in members:
+            # Zombies keep their membership, but can't be interacted with any more
+            if not ids.isdisjoint(buckets) and is_process_alive(p):
+                for stegl_id in ids.intersection(buckets):
+                    buckets[stegl_id].append(p)
+        return buckets
+
+    def _read_ids(self, process):
+        """Reads the STEGL IDs (of any STEGL instance) from the environment."""
+        self.environ_reads += 1
+        try:
+            return frozenset(key for key in process.environ() if key.startswith("STEGL_"))
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return frozenset()
+
+    def _membership(self, process):
+        try:
+            return self.metadata.membership(process, lambda: self._read_ids(process))
+        except psutil.NoSuchProcess:
+            return frozenset()
+
+    def _scan_environ(self):
+        members = []
+        running = set()
+        for p in psutil.process_iter():
+            if p.pid == self.root_pid:
+                continue
+            running.add(self.metadata.key(p))
+            ids = self._membership(p)
+            if ids:
+                members.append((p, ids))
+        self.metadata.retain(running)
+        return members
+
+    def _scan_tree(self):
+        # Listing PIDs is cheap, only processes started since the last scan are read
+        pids = set(psutil.pids())
+
+        # Keep members that are still alive (is_running compares the create time,
+        # so reused PIDs are detected and their new processes classified again)
+        members = {}
+        candidates = {}
+        for pid, p in self._members.items():
+            if pid not in pids:
+                continue
+            if p.is_running():
+                members[pid] = p
+            else:
+                candidates[pid] = None
+
+        # Candidates are processes started since the last scan, as well as roots
+        # launched meanwhile (a scan between their fork and exec saw them without
+        # their STEGL ID, see `launch`)
+        while self._launched:
+            pid, p = self._launched.popitem()
+            if pid in pids and pid not in members:
+                candidates[pid] = p
+        for pid in pids.difference(self._seen_pids):
+            if pid not in members and pid != self.root_pid:
+                candidates.setdefault(pid, None)
+        for pid in [pid for pid, p in candidates.items() if p is None]:
+            try:
+                candidates[pid] = psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                del candidates[pid]
+        started = dict(candidates)
+
+        def parent(p):
+            """The member or newly started process that started `p`, None if it was
+            launched by STEGL itself, by a foreign process or reparented (e.g. its
+            parent exited before it was seen)."""
+            try:
+                ppid = self.metadata.ppid(p)
+                parent = members.get(ppid, started.get(ppid))
+                # A parent younger than its child is an unrelated process reusing the PID
+                if ppid == self.root_pid or parent is None or \
+                        self.metadata.create_time(parent) > self.metadata.create_time(p):
+                    return None
+                return parent
+            except psutil.NoSuchProcess:
+                return None
+
+        non_members = set()
+
+        def classify(pid):
+            if pid in members:
+                return self._membership(members[pid])
+            if pid in non_members or pid not in candidates:
+                return None
+            p = candidates.pop(pid)
+            inherited_from = parent(p)
+            if inherited_from is not None:
+                # Environment is inherited from the parent
+                ids = self.metadata.membership(p, lambda: classify(inherited_from.pid) or frozenset())
+            else:
+                ids = self._membership(p)
+            if ids:
+                members[pid] = p
+            else:
+                non_members.add(pid)
+            return ids
+
+        while candidates:
+            classify(next(iter(candidates)))
+
+        self._members = members
+        self._seen_pids = pids
+        self.metadata.retain(set(self.metadata.key(p) for p in members.values()))
+
+        return [(p, self._membership(p)) for p in members.values()]
+
+    def _scan_adopted(self):
+        """Members of adopted trees. Processes started since the last scan join the
+        tree of their parent."""
+        pids = set(psutil.pids())
+        started = {}
+        for pid in pids.difference(self._adopted_seen_pids):
+            try:
+                p = psutil.Process(pid)
+                started[pid] = (p, self.metadata.ppid(p))
+            except psutil.NoSuchProcess:
+                pass
+        self._adopted_seen_pids = pids
+
+        members = []
+        for stegl_id, tree in self._adopted.items():
+            # is_running also detects reused PIDs
+            for pid in [pid for pid, p in tree.items() if pid not in pids or not p.is_running()]:
+                del tree[pid]
+            grown = True
+            while grown:
+                grown = False
+                for pid, (p, ppid) in list(started.items()):
+                    if ppid in tree:
+                        tree[pid] = p
+                        del started[pid]
+                        grown = True
+            members += [(p, frozenset([stegl_id])) for p in tree.values()]
+        return members
+
+    def _scan_cgroup(self):
+        ids = {}
+        for stegl_id in self.ids:
+            for pid in self.cgroups.pids(stegl_id):
+                ids.setdefault(pid, set()).add(stegl_id)
+
+        members = {}
+        for pid in ids:
+            p = self._members.get(pid)
+            # is_running also detects reused PIDs
+            if p is None or not p.is_running():
+                try:
+                    p = psutil.Process(pid)
+                except psutil.NoSuchProcess:
+                    continue
+            members[pid] = p
+
+        self._members = members
+        self.metadata.retain(set(self.metadata.key(p) for p in members.values()))
+        return [(p, frozenset(ids[pid])) for pid, p in members.items()]
+
+    def snapshot(self, max_age_ms : float = 0, requested : float = None):
+        """Returns a dict mapping each registered STEGL ID to its processes. A previous
+        snapshot is reused if it is not older than `max_age_ms`. A scan that started
+        after the request is always recent enough, so concurrent callers (e.g. the
+        launch groups of several games waking up at once) share scans instead of
+        scanning one after another. So does a scan that was still running when
+        requested and started at most `SHARED_SCAN_TOLERANCE_MS` before. Callers
+        scanning in a thread pass the time of their `requested`, as waiting for the
+        thread would make it later than scans started meanwhile."""
+        if requested is None:
+            requested = clock.monotonic()
+        with self._lock:
+            # Snapshots are dated by the start of their scan
+            age_ms = None if self._timestamp is None else (requested - self._timestamp) * 1000
+            shared = age_ms is not None and self._finished >= requested and age_ms <= ProcessTable.SHARED_SCAN_TOLERANCE_MS
+            if age_ms is None or (age_ms > max_age_ms and not shared):
+                timestamp = clock.monotonic()
+                self._buckets = self._scan()
+                self._timestamp = timestamp
+                self._finished = clock.monotonic()
+                recording.snapshot(self, self._buckets)
+            return self._buckets
+
+    def processes(self, stegl_id : str, max_age_ms : float = 0, requested : float = None):
+        return list(self.snapshot(max_age_ms, requested).get(stegl_id, []))
+
+
+class LaunchStabilityDetector:
+    """Decides when the process tree of a launch group became stable, i.e. its set of
+    PIDs didn't change for `min_stable` seconds. Sampling starts at `min_interval`
+    and backs off up to `max_interval` while nothing changes. Both added and
+    removed PIDs count as churn, every sample is recorded in `timeline`."""
+
+    def __init__(
+        self,
+        min_stable  : float,
+        max_waiting : float,
+        min_interval : float = 0.05,
+        max_interval : float = 1.0,
+        backoff : float = 1.5
+    ):
+        self.min_stable = min_stable
+        self.max_waiting = max_waiting
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.timeline = [] # (seconds since start, added PIDs, removed PIDs)
+        self.interval = min_interval
+        self.start_time = None
+        self.stable_since = None
+        self.pid_set = set()
+
+    def start(self, pid_set, now : float = None):
+        now = clock.monotonic() if now is None else now
+        self.start_time = now
+        self.stable_since = now
+        self.pid_set = set(pid_set)
+        self.timeline.append((0.0, sorted(self.pid_set), []))
+
+    def sample(self, pid_set, now : float = None):
+        """Records a new sample and returns the churn (number of added plus removed PIDs)."""
+        now = clock.monotonic() if now is None else now
+        pid_set = set(pid_set)
+        added = pid_set.difference(self.pid_set)
+        removed = self.pid_set.difference(pid_set)
+        self.pid_set = pid_set
+        churn = len(added) + len(removed)
+        if churn > 0:
+            self.timeline.append((now - self.start_time, sorted(added), sorted(removed)))
+            self.stable_since = now
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return churn
+
+    def stable_time(self, now : float = None):
+        now = clock.monotonic() if now is None else now
+        return now - self.stable_since
+
+    def is_stable(self, now : float = None):
+        return self.stable_time(now) >= self.min_stable
+
+    def is_timed_out(self, now : float = None):
+        now = clock.monotonic() if now is None else now
+        return now - self.start_time >= self.max_waiting
+
+    def next_timeout(self, now : float = None):
+        """Time to wait until the next sample should be taken."""
+        now = clock.monotonic() if now is None else now
+        until_decided = min(self.stable_since + self.min_stable, self.start_time + self.max_waiting) - now
+        return max(0, min(self.interval, until_decided))
+
+
+class AsyncProcessCapture:
     """Launches a process and keeps track of all running derived processes using
-    a custom-set environment variable."""
+    a custom-set environment variable. All waiting is done in coroutines, see
+    `ProcessCapture` for the blocking interface."""
 
     COUNTER = 0
+    # Seconds the command may take to hand its arguments over to an adopted instance
+    ATTACHED_LAUNCH_GRACE = 2
 
     def __init__(
         self,
         exe_path : str,
         args = [],
-        max_launch_waiting  : int = 10,
-        min_launch_stable   : int = 3,
-        termination_timeout : int = 5,
-        termination_retries : int = 3
+        max_launch_waiting  : float = 10,
+        min_launch_stable   : float = 3,
+        termination_timeout : float = 5,
+        termination_retries : int = 3,
+        name : str = None,
+        depends_on : list = None,
+        parallel : bool = False,
+        while_in_game : str = None,
+        while_in_game_cores : list = None,
+        attach_if_running : bool = False,
+        attach_cmdline : str = None,
+        terminate_adopted : bool = False,
+        cwd : str = None,
+        environ : dict = None,
+        process_table : ProcessTable = None,
+        watcher : PollingProcessWatcher = None
     ):
         self.exe_path = exe_path
         self.args = args
+        # Working directory and base environment of the launched process,
+        # defaulting to the ones of this process
+        self.cwd = cwd
+        self.environ = environ
         self.max_launch_waiting = max_launch_waiting
         self.min_launch_stable = min_launch_stable
         self.termination_timeout = termination_timeout
         self.termination_retries = termination_retries
+
+        # Only relevant for dependencies, see ExternalGame
+        self.name = name
+        self.depends_on = depends_on
+        self.parallel = parallel
+        # Policy applied to the group while the game is running, see throttling.py
+        self.throttle = Throttle(while_in_game, while_in_game_cores) if while_in_game is not None else None
+        # Running instances may be adopted instead of launching another one.
+        # Adopted processes are only stopped with the group if `terminate_adopted`.
+        self.attach_if_running = attach_if_running
+        self.attach_cmdline = attach_cmdline
+        self.terminate_adopted = terminate_adopted
+        self.adopted = False
+        # Whether the command still runs if an instance was adopted, so the running
+        # instance receives its arguments (set for game starters, see AsyncExternalGame)
+        self.run_when_attached = False
+        # Measured durations of the launch, see launchhistory.py
+        self.launch_stats = None
         
         self.root_pid = psutil.Process().pid # PID of the python process
-        self.ID = f"STEGL_{self.root_pid}_{ProcessCapture.COUNTER}"
+        self.ID = f"STEGL_{self.root_pid}_{AsyncProcessCapture.COUNTER}"
         self.launched = False
+        self.launch_timeline = []
         
-        ProcessCapture.COUNTER += 1
+        AsyncProcessCapture.COUNTER += 1
+
+        self.process_table = None
+        self.watcher = None
+        self.attach(
+            process_table if process_table is not None else ProcessTable(self.root_pid),
+            watcher if watcher is not None else PollingProcessWatcher()
+        )
+
+    def attach(self, process_table : ProcessTable, watcher : PollingProcessWatcher = None):
+        """Lets the capture use a (shared) process table for finding its processes
+        and a (shared) watcher for waiting on changes."""
+        self.process_table = process_table
+        self.process_table.register(self.ID)
+        if watcher is not None:
+            self.watcher = watcher
     
-    def launch(self):
+    async def launch(self):
         if self.launched:
             raise RuntimeError("ProcessCapture can only be launched once. Create a new instance.")
         try:
-            print_log(f"Running {repr(Path(self.exe_path).name)} using STEGL ID {repr(self.ID)}.")
-            os.environ[self.ID] = str(time.time())
-            psutil.Popen([self.exe_path] + self.args)
-
-            # Perform "launch waiting" - observe child processes and wait until
-            # a stable state was reached (e.g. the PIDs dont change any more).
-            print_log(f"Waiting for stable process-tree (min {self.min_launch_stable} consecutive seconds): ", end="")
-            stable_counter = 0
-            pid_set = set(p.pid for p in self.find_descendent_processes())
-            for _ in range(self.max_launch_waiting):
-                time.sleep(1)
-                new_pid_set = set(p.pid for p in self.find_descendent_processes())
-                diff = pid_set.difference(new_pid_set)
-                if not diff:
-                    stable_counter += 1
-                    print_log(stable_counter, end=" ")
-                    if stable_counter >= self.min_launch_stable:
-                        print_log("Stable")
+            with tracing.span("launch", stegl_id=self.ID, exe=Path(self.exe_path).name) as span:
+                if self.attach_if_running:
+                    instances = await asyncio.to_thread(self._find_running_instances)
+                    if instances:
+                        # Already running instances are settled, no need to wait
+                        self.process_table.adopt(self.ID, instances)
+                        self.adopted = True
+                        pids = ", ".join(str(p.pid) for p in instances)
+                        print_log(f"Attached to running {repr(Path(self.exe_path).name)} (PID {pids}) using STEGL ID {repr(self.ID)}.")
+                        span.set(outcome="attached", pids=[p.pid for p in instances])
+                        if not self.args and not self.run_when_attached:
+                            return
+                        # Launchers like EpicGamesLauncher.exe hand their arguments (e.g. a
+                        # launch URI) over to the running instance and exit
+
+                print_log(f"Running {repr(Path(self.exe_path).name)} using STEGL ID {repr(self.ID)}.")
+                # The ID is only passed to this process, as captures might be
+                # launched concurrently and must not inherit each others IDs
+                environ = dict(os.environ if self.environ is None else self.environ)
+                environ[self.ID] = str(time.time())
+                process = self.process_table.launch(self.ID, [self.exe_path] + self.args, environ, self.cwd)
+                recording.launch(self.ID, process)
+                span.set(pid=process.pid)
+
+                if self.adopted:
+                    # The adopted instance is settled already, only the command itself
+                    # is waited for (it usually exits once it handed over its arguments)
+                    grace = min(self.ATTACHED_LAUNCH_GRACE, self.max_launch_waiting)
+                    exited = await self.watcher.async_wait_for_exit([process], grace)
+                    span.set(handed_over=bool(exited))
+                    return
+
+                # Perform "launch waiting" - observe child processes and wait until
+                # a stable state was reached (e.g. the PIDs dont change any more).
+                print_log(f"Waiting for stable process-tree (min {self.min_launch_stable} consecutive seconds): ", end="")
+                detector = LaunchStabilityDetector(self.min_launch_stable, self.max_launch_waiting)
+                detector.start(p.pid for p in await self.find_descendent_processes())
+                self.launch_timeline = detector.timeline
+                stable_seconds = 0
+                while True:
+                    if detector.is_stable():
+                        print_log(f"Stable ({clock.monotonic() - detector.start_time:.2f}s)")
+                        span.set(outcome="stable", processes=len(detector.pid_set))
                         break
-                else:
-                    stable_counter = 0
-                    print_log("X", end=" ")
-                pid_set = new_pid_set
+                    if detector.is_timed_out():
+                        print_log("Max. waiting time reached. Assuming launched.")
+                        span.set(outcome="timeout", processes=len(detector.pid_set))
+                        break
+
+                    # Wakes up early if the watcher observes changes in the process tree
+                    await self.watcher.async_wait_for_change(detector.next_timeout(), detector.pid_set)
+
+                    churn = detector.sample(p.pid for p in await self.find_descendent_processes())
+                    if tracing.is_enabled():
+                        added, removed = detector.timeline[-1][1:] if churn > 0 else ([], [])
+                        tracing.event("stability_tick", stegl_id=self.ID, churn=churn, added=added, removed=removed,
+                                      stable_time=detector.stable_time())
+                    if churn > 0:
+                        stable_seconds = 0
+                        print_log("X", end=" ")
+                    elif int(detector.stable_time()) > stable_seconds:
+                        stable_seconds = int(detector.stable_time())
+                        print_log(stable_seconds, end=" ")
+
+                changes = [t for t, _, _ in detector.timeline]
+                self.launch_stats = {
+                    "settle_seconds": changes[-1],
+                    "max_gap_seconds": max((b - a for a, b in zip(changes, changes[1:])), default=0.0),
+                    # The tree was still changing, settling took longer
+                    "censored": not detector.is_stable()
+                }
 
-            if stable_counter < self.min_launch_stable:
-                print_log("Max. waiting time reached. Assuming launched.")
         except:
             raise
         finally:
             self.launched = True
 
-    def find_descendent_processes(self):
+    def _find_running_instances(self):
+        """Returns the root processes of running instances of the executable, matched
+        by exe path or `attach_cmdline` (blocking)."""
+        exe_paths = {os.path.normcase(self.exe_path), os.path.normcase(os.path.realpath(self.exe_path))}
+        # Processes of launch groups are never adopted twice
+        grouped = set(p.pid for processes in self.process_table.snapshot(float("inf")).values() for p in processes)
+        metadata = self.process_table.metadata
+        matching = {}
+        for p in psutil.process_iter():
+            if p.pid == self.root_pid or p.pid in grouped:
+                continue
+            try:
+                if os.path.normcase(metadata.exe(p)) in exe_paths or (
+                    self.attach_cmdline is not None and fnmatch(" ".join(metadata.cmdline(p)), self.attach_cmdline)
+                ):
+                    matching[p.pid] = p
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+
+        roots = []
+        for p in matching.values():
+            try:
+                if metadata.ppid(p) not in matching:
+                    roots.append(p)
+            except psutil.NoSuchProcess:
+                pass
+        return roots
+
+    async def find_descendent_processes(self, max_age_ms : float = 0):
 
         # Derived processes will inherit the STEGL_PID value,
-        # and therefore can be identified by it
-        processes = [p for p in psutil.process_iter(["environ"]) 
-                     if (p.info["environ"] is not None) and (self.ID in p.info["environ"]) and (self.root_pid != p.pid)]
-        return processes
+        # and therefore can be identified by it. Scanning is blocking,
+        # so it doesn't happen on the event loop.
+        return await asyncio.to_thread(self.process_table.processes, self.ID, max_age_ms, clock.monotonic())
     
-    def terminate(self):
+    async def terminate(self):
+        failed = await terminate_captures_async([self])
+        if failed:
+            raise RuntimeError(f"Termination failed after {self.termination_retries} repetitions.")
+
+    async def wait_for_termination(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            processes = [p for p in await self.find_descendent_processes() if is_process_alive(p)]
+            remaining = None if deadline is None else deadline - loop.time()
+            if not processes or (remaining is not None and remaining <= 0):
+                return
+            await self.watcher.async_wait_for_exit(processes, remaining)
+
+
+def _signal(process, signal : str):
+    """Sends "terminate", "kill", "suspend" or "resume" to a process, ignoring
+    processes that already exited."""
+    recording.signal(process, signal)
+    try:
+        getattr(process, signal)()
+    except psutil.NoSuchProcess:
+        pass
+
+
+def _kill(process):
+    _signal(process, "kill")
+
+
+async def _wait_and_escalate(processes, timeouts, watcher, deadline=None, kill=_kill):
+    """Waits for all passed (already terminated) processes at once. Each process
+    is killed (using `kill`) once its own termination timeout passed, or once the
+    overall deadline was reached. Returns the processes that are still alive."""
+    now = clock.monotonic()
+    process_deadlines = {p.pid: now + timeouts[p.pid] for p in processes}
+    killed = set()
+
+    alive = list(processes)
+    while alive:
+        now = clock.monotonic()
+        budget_exceeded = deadline is not None and now >= deadline
+        for p in list(alive):
+            if now < process_deadlines[p.pid] and not budget_exceeded:
+                continue
+            if p.pid in killed:
+                # Even killing was not successful (in time)
+                alive.remove(p)
+                continue
+            # Last resort
+            tracing.event("kill", pid=p.pid, reason="shutdown_timeout" if budget_exceeded else "termination_timeout")
+            kill(p)
+            killed.add(p.pid)
+            # Give killed processes a moment to disappear, but don't exceed the budget by much
+            process_deadlines[p.pid] = now + (min(timeouts[p.pid], 1) if budget_exceeded else timeouts[p.pid])
+        if not alive:
+            break
+
+        next_wakeup = min(process_deadlines[p.pid] for p in alive)
+        if deadline is not None and not budget_exceeded:
+            next_wakeup = min(next_wakeup, deadline)
+        await watcher.async_wait_for_exit(alive, max(0, next_wakeup - clock.monotonic()))
+        gone = [p for p in alive if not is_process_alive(p)]
+        recording.exited(gone)
+        for p in gone:
+            alive.remove(p)
+            process_deadlines.pop(p.pid)
+
+    return [p for p in processes if p.pid in process_deadlines and is_process_alive(p)]
+
+
+async def terminate_captures_async(captures, shutdown_timeout : float = None):
+    """Terminates the processes of all passed launch groups concurrently and returns
+    the captures whose processes could not be terminated.
+
+    All processes are signalled together and waited on at once, each being killed
+    as soon as its own group's termination timeout passed. Thus the total time is
+    bound by the slowest process instead of the sum of all of them. If
+    `shutdown_timeout` is given, everything still running after that many seconds
+    is killed and no further retries are made."""
+    if len(captures) == 0:
+        return []
+    with tracing.span("terminate", stegl_ids=[c.ID for c in captures]) as span:
+        failed = await _terminate_captures(captures, shutdown_timeout)
+        span.set(failed=[c.ID for c in failed])
+        return failed
+
+
+async def _processes_to_terminate(capture):
+    """Processes of the group as of the last snapshot. Adopted ones are kept running,
+    unless the group should terminate them as well."""
+    processes = await capture.find_descendent_processes(max_age_ms=float("inf"))
+    if capture.terminate_adopted:
+        return processes
+    kept = capture.process_table.adopted_pids(capture.ID)
+    return [p for p in processes if p.pid not in kept]
+
+
+async def _terminate_captures(captures, shutdown_timeout : float = None):
+    deadline = None if shutdown_timeout is None else clock.monotonic() + shutdown_timeout
+    tables = {id(c.process_table): c.process_table for c in captures}.values()
+
+    print_log(f"Launch groups with STEGL IDs {', '.join(repr(c.ID) for c in captures)} are terminating .", end=" ")
+    # Running multiple loops, as sometimes processes are restarted
+    # by other processes and might be missed
+    for attempt in range(max(c.termination_retries for c in captures)):
+        if deadline is not None and clock.monotonic() >= deadline:
+            break
 
-        print_log(f"Launch group with STEGL ID {repr(self.ID)} is terminating .", end=" ")
-        # Running multiple loops, as sometimes processes are restarted
-        # by other processes and might be missed
-        for _ in range(self.termination_retries):
+        # One scan per process table serves all of its groups
+        for table in tables:
+            await asyncio.to_thread(table.snapshot, 0, clock.monotonic())
+        processes = {}
+        timeouts = {}
+        creation_order = {}
+        groups = {}
+        adopted = set()
+        for capture in captures:
+            if attempt >= capture.termination_retries:
+                continue
+            for p in await _processes_to_terminate(capture):
+                if not is_process_alive(p):
+                    continue
+                processes.setdefault(p.pid, p)
+                groups.setdefault(p.pid, capture)
+                if p.pid in capture.process_table.adopted_pids(capture.ID):
+                    adopted.add(p.pid)
+                creation_order.setdefault(p.pid, capture.process_table.metadata.create_time(p))
+                timeouts[p.pid] = min(timeouts.get(p.pid, capture.termination_timeout), capture.termination_timeout)
 
-            # Try to kill oldest process first, as this is most likely the main one,
+        if len(processes) == 0:
+            print_log("Terminated")
+            return []
+
+        print_log(".", end=" ")
+
+        with tracing.span("terminate_attempt", attempt=attempt, processes=len(processes)) as span:
+            # Try to kill oldest processes first, as these are most likely the main ones,
             # which would also be restarting the child processes
-            processes = sorted(self.find_descendent_processes(), key=lambda p: p.create_time())
-            if len(processes) == 0:
-                print_log("Terminated")
-                return
-            
-            print_log(".", end=" ")
-            
-            for p in processes:
-                p.suspend()
+            processes = sorted(processes.values(), key=lambda p: creation_order[p.pid])
+            # Groups tracked by cgroups are frozen as a whole, including processes
+            # forked in the meantime. Adopted processes aren't part of the cgroup.
+            frozen = {c for c in set(groups.values()) if c.process_table.freeze(c.ID)}
+            suspended = [p for p in processes if groups[p.pid] not in frozen or p.pid in adopted]
+            for p in suspended:
+                _signal(p, "suspend")
             for p in processes:
-                if p.is_running():
-                    p.terminate()
-                try:
-                    p.wait(self.termination_timeout)
-                except psutil.TimeoutExpired:
-                    # Last resort
-                    p.kill()
-        
-        processes = self.find_descendent_processes()
-        if len(processes) > 0:
-            raise RuntimeError(f"Termination failed after {self.termination_retries} repetitions.")
+                _signal(p, "terminate")
+            # Stopped processes would not handle SIGTERM before being continued
+            for capture in frozen:
+                capture.process_table.freeze(capture.ID, False)
+            if psutil.POSIX:
+                for p in suspended:
+                    _signal(p, "resume")
 
-    def wait_for_termination(self, timeout=None):
-        psutil.wait_procs(
-            self.find_descendent_processes(),
-            timeout=timeout
-        )
+            def kill(p):
+                capture = groups[p.pid]
+                if p.pid in adopted or not capture.process_table.kill(capture.ID):
+                    _kill(p)
+                else:
+                    recording.signal(p, "kill")
 
+            remaining = await _wait_and_escalate(processes, timeouts, captures[0].watcher, deadline, kill)
+            span.set(remaining=len(remaining))
+
+    for table in tables:
+        await asyncio.to_thread(table.snapshot, 0, clock.monotonic())
+    failed = []
+    for capture in captures:
+        if any(is_process_alive(p) for p in await _processes_to_terminate(capture)):
+            failed.append(capture)
+    print_log("Failed" if failed else "Terminated")
+    return failed
+
+
+def _configuration_arguments(config : dict, capture_class, **kwargs):
+    """Translates a parsed .stegl configuration into the arguments of a game.
+    Additional keyword arguments are passed to every capture if they are capture
+    arguments (`cwd`, `environ`), otherwise to the game (e.g. `process_table`)."""
+    capture_arguments = {k: v for k, v in kwargs.items() if k in ("cwd", "environ")}
+    game_arguments = {k: v for k, v in kwargs.items() if k not in capture_arguments}
+
+    game_arguments.setdefault("process_tracking", config["GAME"].get("process_tracking", "environ"))
+    game_arguments.setdefault("process_watcher", config["GAME"].get("process_watcher", "auto"))
+    game_arguments.setdefault("shutdown_timeout", config["GAME"].get("shutdown_timeout"))
+    game_arguments.setdefault("game_exe_patterns", config["GAME"].get("game_exe_patterns"))
+    game_arguments.setdefault("game_search_excludes", config["GAME"].get("game_search_excludes"))
+    game_arguments.setdefault("tuning", config["GAME"].get("tuning"))
+    game_arguments.setdefault("after_game_wait_adaptive", config["GAME"].get("after_game_wait_adaptive"))
+    game_arguments.setdefault("game_handoff_grace", config["GAME"].get("game_handoff_grace", 1))
+    resource_profile = config["GAME"].get("resource_profile")
+    if resource_profile is not None and capture_arguments.get("cwd") is not None:
+        # Relative to the launching client, not to e.g. the supervisor
+        resource_profile = os.path.join(capture_arguments["cwd"], resource_profile)
+    game_arguments.setdefault("resource_profile", resource_profile)
+    game_arguments.setdefault("resource_profile_interval", config["GAME"].get("resource_profile_interval", 1))
+    launch_history = config["GAME"].get("launch_history", True)
+    if isinstance(launch_history, str) and capture_arguments.get("cwd") is not None:
+        launch_history = os.path.join(capture_arguments["cwd"], os.path.expanduser(launch_history))
+    game_arguments.setdefault("launch_history", history_from_option(launch_history))
+    # "auto" timing options are derived from the recorded sessions
+    config = resolve_auto(config, game_arguments["launch_history"])
+    return dict(
+        game_search_paths=config["GAME"]["game_search_paths"],
+        game_starter=capture_class(**config["GAME"]["launch_config"], **capture_arguments),
+        dependencies=[capture_class(**dep_config, **capture_arguments) for dep_config in config["DEPENDENCIES"]],
+        game_search_timeout=config["GAME"]["game_search_timeout"],
+        after_game_wait=config["GAME"]["after_game_wait"],
+        **game_arguments
+    )
+
+
+class AsyncExternalGame:
+    """Launches a game through its game starter after launching its dependencies,
+    waits for the game to exit and terminates everything afterwards. All waiting
+    is done in coroutines, so many games can be supervised on one event loop.
+    See `ExternalGame` for the blocking interface.
+
+    By default dependencies are launched one after another. A dependency may
+    instead declare `depends_on` (names or indices of other dependencies) or be
+    marked `parallel` (no prerequisites), in which case independent dependencies
+    are launched concurrently.
+
+    All running game processes are tracked at once. The game counts as closed once
+    the last of them exited and no other one appeared within `game_handoff_grace`
+    seconds.
+
+    If `resource_profile` is given, the resource usage of all launch groups is
+    sampled while the game is running and a summary is appended to that file.
+
+    If `after_game_wait_adaptive` is given (True or a dict of `quiet_window`,
+    `min_wait`, `cpu_percent`, `io_bytes_per_second` and `interval`), the remaining processes
+    are terminated as soon as they have been quiet for `quiet_window` seconds, but
+    not before `min_wait` seconds and at most after `after_game_wait` seconds."""
+
+    # Options of `after_game_wait_adaptive`, see `_wait_until_quiet`
+    ADAPTIVE_WAIT_OPTIONS = ("quiet_window", "min_wait", "cpu_percent", "io_bytes_per_second", "interval")
 
-class ExternalGame:
     def __init__(
         self,
         game_search_paths,
-        game_starter : ProcessCapture,
-        dependencies : ProcessCapture = [],
-        game_search_timeout : int = 30,
-        after_game_wait : int = 10
+        game_starter : AsyncProcessCapture,
+        dependencies : AsyncProcessCapture = [],
+        game_search_timeout : float = 30,
+        after_game_wait : float = 10,
+        after_game_wait_adaptive = None,
+        game_handoff_grace : float = 1,
+        process_tracking : str = "environ",
+        process_watcher : str = "auto",
+        shutdown_timeout : float = None,
+        game_exe_patterns : list = None,
+        game_search_excludes : list = None,
+        tuning : dict = None,
+        resource_profile : str = None,
+        resource_profile_interval : float = 1,
+        launch_history : LaunchHistory = None,
+        process_table : ProcessTable = None,
+        watcher : PollingProcessWatcher = None
     ):
         self.game_search_paths = game_search_paths
+        # Compiled once, as it is evaluated for every candidate process on every check
+        self.game_matcher = GameSearchMatcher(game_search_paths, game_exe_patterns, game_search_excludes)
         self.game_starter = game_starter
+        # The game is only started by running the game starter's command
+        self.game_starter.run_when_attached = True
         self.dependencies = dependencies
         self.game_search_timeout = game_search_timeout
         self.after_game_wait = after_game_wait
+        if after_game_wait_adaptive is True:
+            after_game_wait_adaptive = {}
+        if after_game_wait_adaptive:
+            # Checked now, as they are only used after the game closed
+            if not isinstance(after_game_wait_adaptive, dict):
+                raise ValueError("after_game_wait_adaptive must be true or an object of options.")
+            unknown = set(after_game_wait_adaptive) - set(AsyncExternalGame.ADAPTIVE_WAIT_OPTIONS)
+            if unknown:
+                raise ValueError(f"Unknown after_game_wait_adaptive options {', '.join(sorted(map(repr, unknown)))}.")
+        self.after_game_wait_adaptive = after_game_wait_adaptive or None
+        self.game_handoff_grace = game_handoff_grace
+        self.shutdown_timeout = shutdown_timeout
+        # Priority, affinity and I/O priority of the game's processes, see throttling.py
+        self.tuning = Tuning(**tuning) if tuning else None
+        self.game_processes = []
+        self.resource_profile = resource_profile
+        self.resource_profiler = ResourceProfiler(resource_profile_interval) if resource_profile is not None else None
+        # Measured durations of the session are recorded here, see launchhistory.py
+        self.launch_history = launch_history
+        self.measurements = {}
+
+        # All launch groups share one process table, so a single scan per tick
+        # serves all of them
+        self.process_table = process_table if process_table is not None else ProcessTable(game_starter.root_pid, process_tracking)
+        # A passed (shared) watcher is closed by its owner
+        self.watcher = watcher if watcher is not None else create_watcher(process_watcher)
+        self._owns_watcher = watcher is None
+        # Resolved before registering the launch groups, which a shared table would keep otherwise
+        self.prerequisites = self._resolve_prerequisites()
+        for capture in self.dependencies + [self.game_starter]:
+            capture.attach(self.process_table, self.watcher)
+
+    @classmethod
+    def from_configuration(cls, config : dict, **kwargs):
+        """Creates a game from a parsed .stegl configuration, see `_configuration_arguments`."""
+        return cls(**_configuration_arguments(config, AsyncProcessCapture, **kwargs))
+
+    def _resolve_prerequisites(self):
+        """Maps each dependency's index to the indices of the dependencies that have
+        to be launched before it."""
+        names = {dep.name: i for i, dep in enumerate(self.dependencies) if dep.name is not None}
+        prerequisites = {}
+        for i, dep in enumerate(self.dependencies):
+            if dep.depends_on is not None:
+                required = []
+                for reference in dep.depends_on:
+                    if isinstance(reference, int) and 0 <= reference < len(self.dependencies):
+                        required.append(reference)
+                    elif reference in names:
+                        required.append(names[reference])
+                    else:
+                        raise ValueError(f"Dependency {i} depends on unknown dependency {repr(reference)}.")
+                prerequisites[i] = required
+            elif dep.parallel or i == 0:
+                prerequisites[i] = []
+            else:
+                # Default: launch after the previous dependency (serial)
+                prerequisites[i] = [i - 1]
+
+        # Reject cycles, as these would never be launched
+        visited = set()
+        def visit(i, path):
+            if i in path:
+                raise ValueError(f"Dependencies contain a cycle involving dependency {i}.")
+            if i in visited:
+                return
+            for j in prerequisites[i]:
+                visit(j, path | {i})
+            visited.add(i)
+        for i in prerequisites:
+            visit(i, set())
+        return prerequisites
+
+    async def _launch_dependencies(self):
+        # Every dependency gets its own task, waiting for its prerequisites first.
+        # The tasks only start running once all of them were created.
+        tasks = {}
+        async def launch(i):
+            if self.prerequisites[i]:
+                await asyncio.gather(*(tasks[j] for j in self.prerequisites[i]))
+            await self.dependencies[i].launch()
+
+        for i in self.prerequisites:
+            tasks[i] = asyncio.create_task(launch(i))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
 
-    def _process_in_searchpaths(self, process):
-        if not process.is_running():
+    def _process_in_searchpaths(self, process, refresh : bool = False):
+        try:
+            exe_path = self.process_table.metadata.exe(process, refresh)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
             return False
-        exe_path = process.exe()
-        if exe_path is None:
+        if refresh:
+            recording.exe_changed(process, exe_path)
+        return self.game_matcher.matches(exe_path)
+
+    async def _search_game_processes(self, refresh : bool = False):
+        """Returns all running game processes, oldest first. `refresh` re-reads exe
+        paths, e.g. to detect a process executing the game while handing over."""
+        processes = await self.game_starter.find_descendent_processes()
+        game_processes = [p for p in processes if self._process_in_searchpaths(p, refresh) and is_process_alive(p)]
+        def create_time(p):
+            try:
+                return self.process_table.metadata.create_time(p)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                return float("inf")
+        return sorted(game_processes, key=create_time)
+
+    async def _wait_for_game_processes(self, timeout, progress=False, refresh=False):
+        """Searches for game processes until at least one is found or `timeout` seconds
+        passed. Rescans whenever the watcher reports changes in the game starter's tree."""
+        deadline = clock.monotonic() + timeout
+        while True:
+            game_processes = await self._search_game_processes(refresh)
+            remaining = deadline - clock.monotonic()
+            if game_processes or remaining <= 0:
+                return game_processes
+            if progress:
+                print_log(".", end="")
+            pids = set(p.pid for p in await self.game_starter.find_descendent_processes(max_age_ms=float("inf")))
+            pids.add(self.game_starter.root_pid)
+            await self.watcher.async_wait_for_change(min(remaining, 1), pids)
+
+    async def _resource_groups(self):
+        """Processes of every launch group, with the game processes in their own group."""
+        await asyncio.to_thread(self.process_table.snapshot, 0, clock.monotonic())
+        groups = {"game": []}
+        for i, capture in enumerate(self.dependencies + [self.game_starter]):
+            label = "game_starter" if capture is self.game_starter else f"dependency {capture.name or i}"
+            groups[label] = []
+            for p in await capture.find_descendent_processes(max_age_ms=float("inf")):
+                if capture is self.game_starter and self._process_in_searchpaths(p):
+                    groups["game"].append(p)
+                else:
+                    groups[label].append(p)
+        return groups
+
+    async def _apply_throttles(self, dependencies, max_age_ms : float = 0):
+        """Applies the `while_in_game` policies to the processes of the dependencies
+        not throttled yet. Returns the number of changed processes per dependency."""
+        changed = {}
+        for dep in dependencies:
+            processes = await dep.find_descendent_processes(max_age_ms)
+            changed[dep] = dep.throttle.apply(processes, lambda frozen, dep=dep: dep.process_table.freeze(dep.ID, frozen))
+        return changed
+
+    async def _throttle_dependencies(self):
+        """Applies the `while_in_game` policies of the dependencies. Returns whether
+        there are any."""
+        throttled = [dep for dep in self.dependencies if dep.throttle is not None]
+        if len(throttled) == 0:
             return False
-        return any(Path(exe_path).is_relative_to(sp) for sp in self.game_search_paths)
+        with tracing.span("throttle", stegl_ids=[dep.ID for dep in throttled]):
+            for dep, changed in (await self._apply_throttles(throttled)).items():
+                print_log(f"Applied while_in_game policy {repr(dep.throttle.policy)} to launch group {repr(dep.ID)} ({changed} changed).")
+                if dep.throttle.kept_priority > 0:
+                    print_log(
+                        f"Kept the CPU priority of {dep.throttle.kept_priority} processes of launch group {repr(dep.ID)}, "
+                        "as it couldn't be restored without privileges (only their I/O priority was lowered)."
+                    )
+        return True
 
-    def _search_game_process(self):
-        processes = self.game_starter.find_descendent_processes()
-        return next((p for p in processes if self._process_in_searchpaths(p)), None)
+    async def _keep_dependencies_throttled(self, interval : float = 2):
+        """Throttles processes the dependencies start while the game is running
+        (e.g. helpers spawned by a launcher), until cancelled. Frozen groups include
+        such processes already. Other groups are only checked once the watcher
+        observed changes in their trees, reusing recent snapshots."""
+        while True:
+            pending = [dep for dep in self.dependencies if dep.throttle is not None and not dep.throttle.frozen]
+            if not pending:
+                return
+            pids = set()
+            for dep in pending:
+                pids.update(p.pid for p in await dep.find_descendent_processes(max_age_ms=float("inf")))
+            if not await self.watcher.async_wait_for_change(interval, pids):
+                continue
+            for dep, changed in (await self._apply_throttles(pending, max_age_ms=interval * 1000)).items():
+                if changed > 0:
+                    tracing.event("throttle", stegl_id=dep.ID, changed=changed)
 
-    def terminate(self):
-        for dep in reversed(self.dependencies + [self.game_starter]):
-            try:
-                dep.terminate()
-            except RuntimeError as e:
-                # TODO: Log
-                pass
+    def _unthrottle_dependencies(self):
+        """Reverts the `while_in_game` policies. Doesn't block, so it is safe to be
+        called while being cancelled."""
+        for dep in self.dependencies:
+            if dep.throttle is None or not dep.throttle.applied:
+                continue
+            with tracing.span("unthrottle", stegl_id=dep.ID) as span:
+                failed = dep.throttle.revert()
+                span.set(failed=failed)
+            if failed > 0:
+                print_log(
+                    f"Could not fully revert while_in_game policy of launch group {repr(dep.ID)} ({failed} processes), "
+                    "raising priorities again may require privileges."
+                )
+            else:
+                print_log(f"Reverted while_in_game policy of launch group {repr(dep.ID)}.")
 
-    def run(self):
+    async def _wait_until_quiet(
+        self,
+        quiet_window : float = 3,
+        min_wait : float = 2,
+        cpu_percent : float = 2,
+        io_bytes_per_second : float = 65536,
+        interval : float = 0.5
+    ):
+        """Waits until the processes of all launch groups have been quiet (CPU and
+        I/O) for `quiet_window` seconds, at least `min_wait` and at most
+        `after_game_wait` seconds. Returns the waited time."""
+        print_log(f"Waiting for remaining processes to be quiet for {quiet_window} seconds (max. {self.after_game_wait} seconds): ", end="")
+        monitor = ActivityMonitor(quiet_window, cpu_percent, io_bytes_per_second)
+        start = clock.monotonic()
+        while True:
+            await self._sample_activity(monitor)
+            waited = clock.monotonic() - start
+            if waited >= min_wait and monitor.is_quiet():
+                print_log(f"Quiet ({waited:.2f}s)")
+                break
+            if waited >= self.after_game_wait:
+                print_log("Max. waiting time reached.")
+                break
+            await asyncio.sleep(min(interval, max(0, self.after_game_wait - waited)))
+        self._record_activity(monitor, start, waited)
+        return waited
+
+    async def _wait_measuring_activity(self, interval : float = 0.5):
+        """Waits `after_game_wait` seconds, measuring how long the remaining processes
+        stayed active for the launch history."""
+        monitor = ActivityMonitor()
+        start = clock.monotonic()
+        while True:
+            await self._sample_activity(monitor)
+            waited = clock.monotonic() - start
+            if waited >= self.after_game_wait:
+                break
+            await asyncio.sleep(min(interval, self.after_game_wait - waited))
+        self._record_activity(monitor, start, waited)
+
+    async def _sample_activity(self, monitor : ActivityMonitor):
+        await asyncio.to_thread(self.process_table.snapshot, 0, clock.monotonic())
+        processes = []
+        for capture in self.dependencies + [self.game_starter]:
+            processes += await capture.find_descendent_processes(max_age_ms=float("inf"))
+        cpu, io = await asyncio.to_thread(monitor.sample, processes)
+        tracing.event("activity", cpu_percent=cpu, io_bytes_per_second=io, processes=len(processes))
+
+    def _record_activity(self, monitor : ActivityMonitor, start : float, waited : float):
+        if monitor.quiet_since is None:
+            # Still active, the activity lasted longer than measured
+            self.measurements.update(activity_seconds=waited, activity_censored=True)
+        else:
+            self.measurements.update(activity_seconds=max(0.0, monitor.quiet_since - start), activity_censored=False)
+
+    async def _tune_game(self):
+        """Applies `tuning` to the current game processes and their children."""
+        def tree():
+            processes = []
+            for game_process in self.game_processes:
+                try:
+                    processes += [game_process] + game_process.children(recursive=True)
+                except psutil.NoSuchProcess:
+                    pass
+            return processes
+        tuned = self.tuning.apply(await asyncio.to_thread(tree))
+        if tuned > 0:
+            tracing.event("tune", pids=[p.pid for p in self.game_processes], tuned=tuned)
+
+    async def _keep_game_tuned(self, interval : float = 2):
+        """Tunes the game, as well as new children and processes that executed
+        another program, until cancelled."""
+        print_log("Applying game tuning.")
+        while True:
+            await self._tune_game()
+            await asyncio.sleep(interval)
+
+    def _untune_game(self):
+        if self.tuning is None:
+            return
+        failed = self.tuning.revert()
+        if failed > 0:
+            print_log(f"Could not restore {failed} original settings of game processes.")
+
+    def _report_resources(self):
+        summary = self.resource_profiler.summary()
+        overhead = summary["groups"].get(ResourceProfiler.OVERHEAD)
+        if overhead is not None:
+            print_log(
+                f"Launcher overhead while in game: {overhead['cpu_percent_average']:.1f}% CPU "
+                f"(peak {overhead['cpu_percent_peak']:.1f}%), {overhead['rss_average'] / 2**20:.0f} MB RSS "
+                f"(peak {overhead['rss_peak'] / 2**20:.0f} MB)."
+            )
+        tracing.event("resource_summary", **summary)
+        try:
+            self.resource_profiler.write_summary(self.resource_profile, stegl_id=self.game_starter.ID)
+        except OSError as e:
+            print_log(f"Could not write resource profile: {repr(e)}")
+
+    def _prepare_termination(self):
+        """Restores throttled and tuned processes, returns the captures in the order
+        they should be terminated (starting with the game starter)."""
+        self._unthrottle_dependencies()
+        self._untune_game()
+        return list(reversed(self.dependencies + [self.game_starter]))
+
+    def _record_history(self):
+        if self.launch_history is None:
+            return
+        try:
+            self.launch_history.append(session_record(self))
+        except OSError as e:
+            print_log(f"Could not write launch history: {repr(e)}")
+
+    def _unregister(self):
+        # The launch groups are done (e.g. their cgroups are removed)
+        for capture in self.dependencies + [self.game_starter]:
+            self.process_table.unregister(capture.ID)
+
+    async def terminate(self):
+        # All groups are terminated at once
+        failed = await terminate_captures_async(self._prepare_termination(), self.shutdown_timeout)
+        for capture in failed:
+            print_log(f"Could not terminate all processes of launch group {repr(capture.ID)}.")
+
+    async def run(self):
+        recording.groups(self)
+        try:
+            with tracing.span("session", stegl_id=self.game_starter.ID, dependencies=len(self.dependencies)):
+                await self._run()
+        except asyncio.CancelledError:
+            # Don't leave anything behind when the session gets cancelled
+            print_log("Session cancelled. Stopping remaining processes & dependencies.")
+            await self.terminate()
+            raise
+        except Exception:
+            # The launch groups are unregistered below, afterwards their processes
+            # can't be found any more
+            await self.terminate()
+            raise
+        finally:
+            self._unregister()
+            if self._owns_watcher:
+                self.watcher.close()
+
+    async def _run(self):
+        await self._supervise(await self._launch())
+
+        print_log("No more game process found.")
+        await self._after_game_wait()
+
+        print_log("Stopping remaining processes & dependencies.")
+        await self.terminate()
+        self._record_history()
+
+        stats = self.process_table.metadata.stats()
+        print_log(f"Process metadata cache: {stats['hits']} hits, {stats['misses']} misses.")
+        print_log("Success.")
+
+    async def _launch(self):
+        """Launches dependencies and game starter, returns the detected game processes."""
         if len(self.dependencies) > 0:
             print_log("Launching game dependencies.")
-        for dep in self.dependencies:
-            dep.launch()
+            with tracing.span("dependencies", count=len(self.dependencies)):
+                await self._launch_dependencies()
         
         print_log("Launching game.")
-        self.game_starter.launch()
+        await self.game_starter.launch()
         
         # Wait until a game-process was found
         print_log("Waiting for game process.", end=" ")
-        game_process = None
-        for _ in range(self.game_search_timeout):
-            game_process = self._search_game_process()
-            if game_process is not None:
-                print_log("")
-                break
-            print_log(".", end="")
-            time.sleep(1)
+        with tracing.span("game_search", timeout=self.game_search_timeout) as span:
+            start = clock.monotonic()
+            game_processes = await self._wait_for_game_processes(self.game_search_timeout, progress=True)
+            span.set(pids=[p.pid for p in game_processes])
+        self.measurements.update(game_search_seconds=clock.monotonic() - start, game_search_censored=not game_processes)
+        print_log("")
 
-        if game_process is not None:
-            print_log(f"Detected game process with PID {game_process.pid}.")
-            print_log("Waiting for game to terminate.")
+        if len(game_processes) == 1:
+            print_log(f"Detected game process with PID {game_processes[0].pid}.")
+        elif game_processes:
+            print_log(f"Detected game processes with PIDs {', '.join(str(p.pid) for p in game_processes)}.")
         else:
             print_log("No game process could be detected!")
+        if game_processes:
+            print_log("Waiting for game to terminate.")
+        return game_processes
 
-        while game_process is not None:
-            game_process.wait()
-            # Wait for a short moment to make sure that pot. child-processes
-            # are ready to be detected (it could happen that the original process
-            # immediately launches another and closes)
-            time.sleep(1)
-            game_process = self._search_game_process()
+    async def _supervise(self, game_processes):
+        """Waits until no game process is left. Dependencies are throttled and the
+        game is tuned in the meantime."""
+        self.game_processes = game_processes
+        background = []
+        if self.resource_profiler is not None and game_processes:
+            background.append(asyncio.create_task(self.resource_profiler.run(self._resource_groups)))
+        if self.tuning is not None and game_processes:
+            background.append(asyncio.create_task(self._keep_game_tuned()))
+        try:
+            if game_processes and await self._throttle_dependencies():
+                background.append(asyncio.create_task(self._keep_dependencies_throttled()))
+            with tracing.span("game_running", pids=[p.pid for p in game_processes]):
+                while game_processes:
+                    # Wakes on the first exit of any game process
+                    exited = await self.watcher.async_wait_for_exit(game_processes)
+                    recording.exited(exited)
+                    previous = game_processes
+                    game_processes = await self._search_game_processes()
+                    if not game_processes:
+                        # The exited process may just be launching another one and
+                        # closing, which is detected as soon as it appears
+                        game_processes = await self._wait_for_game_processes(self.game_handoff_grace, refresh=True)
+                    self.game_processes = game_processes
 
-        print_log("No more game process found.")
-        print_log(f"Waiting for {self.after_game_wait} seconds (after_game_wait).")
-        time.sleep(self.after_game_wait)
+                    previous_pids = set(p.pid for p in previous)
+                    pids = set(p.pid for p in game_processes)
+                    tracing.event(
+                        "game_processes",
+                        exited=[p.pid for p in exited],
+                        started=sorted(pids - previous_pids),
+                        pids=sorted(pids)
+                    )
+                    if game_processes and not pids & previous_pids:
+                        tracing.event("game_handoff", pids=sorted(previous_pids), next_pids=sorted(pids))
+                    if pids - previous_pids and self.tuning is not None:
+                        await self._tune_game()
+        finally:
+            for task in background:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            # Dependencies must be fully available again, e.g. for cloud saves
+            # during the after game wait or for terminating them. The game's
+            # original settings are restored in case it is still running.
+            self._unthrottle_dependencies()
+            self._untune_game()
+        if self.resource_profiler is not None and self.resource_profiler.start_time is not None:
+            self._report_resources()
 
-        print_log("Stopping remaining processes & dependencies.")
+    async def _after_game_wait(self):
+        with tracing.span("after_game_wait", seconds=self.after_game_wait) as span:
+            if self.after_game_wait_adaptive is None:
+                print_log(f"Waiting for {self.after_game_wait} seconds (after_game_wait).")
+                if self.launch_history is None:
+                    await asyncio.sleep(self.after_game_wait)
+                else:
+                    await self._wait_measuring_activity()
+            else:
+                span.set(adaptive=True, waited=await self._wait_until_quiet(**self.after_game_wait_adaptive))
 
-        # Will start with the game started and than
-        # walk backwards through the dependencies
-        self.terminate()
 
-        print_log("Success.")
+class ProcessCapture:
+    """Blocking interface of `AsyncProcessCapture`, taking the same arguments.
+    Every other attribute is forwarded to the wrapped capture."""
+
+    def __init__(self, *args, **kwargs):
+        self.capture = AsyncProcessCapture(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+    def launch(self):
+        asyncio.run(self.capture.launch())
+
+    def find_descendent_processes(self, max_age_ms : float = 0):
+        return self.capture.process_table.processes(self.capture.ID, max_age_ms)
+
+    def terminate(self):
+        asyncio.run(self.capture.terminate())
+
+    def wait_for_termination(self, timeout=None):
+        asyncio.run(self.capture.wait_for_termination(timeout))
+
+
+def _unwrap(capture):
+    return capture.capture if isinstance(capture, ProcessCapture) else capture
+
+
+def terminate_captures(captures, shutdown_timeout : float = None):
+    """Blocking version of `terminate_captures_async`."""
+    unwrapped = {id(_unwrap(c)): c for c in captures}
+    failed = asyncio.run(terminate_captures_async([_unwrap(c) for c in captures], shutdown_timeout))
+    return [unwrapped[id(c)] for c in failed]
+
+
+class ExternalGame:
+    """Blocking interface of `AsyncExternalGame`, taking the same arguments but
+    (synchronous) `ProcessCapture`s. Every other attribute is forwarded to the
+    wrapped game."""
+
+    def __init__(self, game_search_paths, game_starter : ProcessCapture, dependencies : ProcessCapture = [], **kwargs):
+        self.game = AsyncExternalGame(
+            game_search_paths,
+            _unwrap(game_starter),
+            [_unwrap(dep) for dep in dependencies],
+            **kwargs
+        )
+        self.game_starter = game_starter
+        self.dependencies = dependencies
+
+    @classmethod
+    def from_configuration(cls, config : dict, **kwargs):
+        return cls(**_configuration_arguments(config, ProcessCapture, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.game, name)
+
+    def run(self):
+        asyncio.run(self.game.run())
+
+    def terminate(self):
+        asyncio.run(self.game.terminate())
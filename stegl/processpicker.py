@@ -0,0 +1,271 @@
+"""Picking the exe path of a running process in the configurator.
+
+Listing thousands of processes with psutil takes long enough to freeze a Tk
+window, so `ProcessListWorker` scans on a background thread and hands snapshots
+to the mainloop through a queue, which `ProcessPickerDialog` polls. The dialog
+only updates the rows that changed and applies updates in chunks, so large
+process tables don't stall it either. In tree mode, children are only inserted
+once their parent is expanded."""
+
+from collections import namedtuple
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk
+
+import psutil
+
+
+ProcessRow = namedtuple("ProcessRow", ["pid", "ppid", "name", "exe", "cpu_percent", "rss"])
+
+# Treeview operations applied per mainloop tick
+CHUNK_SIZE = 300
+
+
+class ProcessListWorker:
+    """Scans all processes every `interval` seconds on a background thread. Each
+    snapshot (a dict mapping PIDs to `ProcessRow`s) is put into `results`."""
+
+    def __init__(self, interval : float = 2.0):
+        self.interval = interval
+        self.results = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stegl-process-list", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stops after the current scan, without waiting for it."""
+        self._stopped.set()
+
+    def refresh(self):
+        """Scans once (blocking)."""
+        rows = {}
+        # process_iter reuses its Process instances, so CPU usage is relative to the previous scan
+        for p in psutil.process_iter(["pid", "ppid", "name", "exe", "cpu_percent", "memory_info"]):
+            info = p.info
+            memory = info["memory_info"]
+            rows[info["pid"]] = ProcessRow(
+                info["pid"], info["ppid"], info["name"] or "", info["exe"] or "",
+                info["cpu_percent"] or 0.0, memory.rss if memory is not None else 0
+            )
+        return rows
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.results.put(self.refresh())
+            except Exception as e:
+                self.results.put(e)
+            self._stopped.wait(self.interval)
+
+
+def _format_rss(rss):
+    return f"{rss / 2**20:.1f} MB"
+
+
+class ProcessPickerDialog(tk.Toplevel):
+    """Lists running processes, the selected one is stored in `result` (a
+    `ProcessRow`) once the dialog was closed."""
+
+    COLUMNS = ("pid", "exe", "parent", "cpu", "rss")
+
+    def __init__(self, parent, title="Pick Running Process"):
+        super().__init__(parent)
+        self.title(title)
+        self.geometry("900x500")
+        self.transient(parent)
+        self.result = None
+
+        self.rows = {}
+        self._expanded = set()
+        self._pending = []
+        self._wanted = set()
+        self._positions = {}
+        self._render_job = None
+        self._filter_job = None
+
+        tools = tk.Frame(self)
+        tk.Label(tools, text="Filter:").pack(side="left", padx=5)
+        self.filter_var = tk.StringVar(self, "")
+        self.filter_var.trace_add("write", self._on_filter_changed)
+        filter_entry = tk.Entry(tools, textvariable=self.filter_var)
+        filter_entry.pack(side="left", fill="x", expand=True, padx=5)
+        self.tree_mode_var = tk.BooleanVar(self, False)
+        tk.Checkbutton(tools, text="Group by process tree", variable=self.tree_mode_var, command=self._render).pack(side="left", padx=5)
+        tools.pack(fill="x", pady=5)
+
+        list_frame = tk.Frame(self)
+        self.tree = ttk.Treeview(list_frame, columns=ProcessPickerDialog.COLUMNS, selectmode="browse")
+        self.tree.heading("#0", text="Name")
+        self.tree.heading("pid", text="PID")
+        self.tree.heading("exe", text="Exe")
+        self.tree.heading("parent", text="Parent")
+        self.tree.heading("cpu", text="CPU %")
+        self.tree.heading("rss", text="RSS")
+        self.tree.column("#0", width=180)
+        self.tree.column("pid", width=70, anchor="e", stretch=False)
+        self.tree.column("exe", width=380)
+        self.tree.column("parent", width=140)
+        self.tree.column("cpu", width=60, anchor="e", stretch=False)
+        self.tree.column("rss", width=80, anchor="e", stretch=False)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        list_frame.pack(fill="both", expand=True, padx=5)
+        self.tree.bind("<<TreeviewOpen>>", self._on_open)
+        self.tree.bind("<<TreeviewClose>>", self._on_close)
+        self.tree.bind("<Double-1>", lambda event: self.select())
+
+        buttons = tk.Frame(self)
+        self.status_var = tk.StringVar(self, "Loading processes...")
+        tk.Label(buttons, textvariable=self.status_var, anchor=tk.W).pack(side="left", fill="x", expand=True, padx=5)
+        tk.Button(buttons, text="Cancel", command=self.destroy).pack(side="right", padx=5)
+        tk.Button(buttons, text="Select", command=self.select).pack(side="right", padx=5)
+        buttons.pack(fill="x", pady=5)
+
+        self.worker = ProcessListWorker()
+        self.worker.start()
+        self.bind("<Destroy>", self._on_destroy)
+        self.after(50, self._poll)
+        filter_entry.focus_set()
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.worker.stop()
+
+    def _poll(self):
+        # Only the most recent snapshot is of interest
+        snapshot = None
+        while True:
+            try:
+                snapshot = self.worker.results.get_nowait()
+            except queue.Empty:
+                break
+        if isinstance(snapshot, Exception):
+            self.status_var.set(f"Could not list processes: {repr(snapshot)}")
+        elif snapshot is not None:
+            self.rows = snapshot
+            self._render()
+        self.after(100, self._poll)
+
+    def _on_filter_changed(self, *args):
+        # Re-rendering on every key stroke isn't needed
+        if self._filter_job is not None:
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(150, self._render)
+
+    def _on_open(self, event):
+        self._expanded.add(self.tree.focus())
+        self._render()
+
+    def _on_close(self, event):
+        self._expanded.discard(self.tree.focus())
+        self._render()
+
+    def _matches(self, row, text):
+        return text in row.name.lower() or text in row.exe.lower() or text == str(row.pid)
+
+    def _values(self, row):
+        parent = self.rows.get(row.ppid)
+        parent_text = f"{parent.name} ({parent.pid})" if parent is not None else str(row.ppid or "")
+        return (row.pid, row.exe, parent_text, f"{row.cpu_percent:.1f}", _format_rss(row.rss))
+
+    def _layout(self):
+        """Returns the items to show in order, as (iid, parent iid, text, values, open)."""
+        text = self.filter_var.get().strip().lower()
+        matching = [row for row in self.rows.values() if not text or self._matches(row, text)]
+        def order(row):
+            return (row.name.lower(), row.pid)
+
+        if not self.tree_mode_var.get():
+            return [(str(row.pid), "", row.name, self._values(row), False) for row in sorted(matching, key=order)]
+
+        # Matching processes are shown along with their ancestors
+        shown = {row.pid for row in matching}
+        if text:
+            for row in matching:
+                ppid = row.ppid
+                while ppid in self.rows and ppid not in shown:
+                    shown.add(ppid)
+                    ppid = self.rows[ppid].ppid
+        children = {}
+        for pid in shown:
+            row = self.rows[pid]
+            parent = row.ppid if row.ppid in shown and row.ppid != pid else None
+            children.setdefault(parent, []).append(row)
+
+        layout = []
+        def add(rows, parent_iid):
+            for row in sorted(rows, key=order):
+                iid = str(row.pid)
+                # While filtering, everything leading to a match is expanded
+                expanded = bool(text) or iid in self._expanded
+                layout.append((iid, parent_iid, row.name, self._values(row), expanded and row.pid in children))
+                if row.pid not in children:
+                    continue
+                if expanded:
+                    add(children[row.pid], iid)
+                else:
+                    # Children are only inserted once expanded
+                    layout.append((f"{iid}:more", iid, "...", (), False))
+        add(children.get(None, []), "")
+        return layout
+
+    def _render(self):
+        self._filter_job = None
+        if self._render_job is not None:
+            self.after_cancel(self._render_job)
+        layout = self._layout()
+        self._pending = list(enumerate(layout))
+        self._wanted = {iid for iid, *_ in layout}
+        self._positions = {}
+        self._render_job = self.after_idle(self._apply_chunk)
+        self.status_var.set(f"{len(layout)} of {len(self.rows)} processes shown.")
+
+    def _apply_chunk(self):
+        chunk, self._pending = self._pending[:CHUNK_SIZE], self._pending[CHUNK_SIZE:]
+        for _, (iid, parent, text, values, is_open) in chunk:
+            index = self._positions.get(parent, 0)
+            self._positions[parent] = index + 1
+            if self.tree.exists(iid):
+                if self.tree.parent(iid) != parent or self.tree.index(iid) != index:
+                    self.tree.move(iid, parent, index)
+                self.tree.item(iid, text=text, values=values, open=is_open)
+            else:
+                self.tree.insert(parent, index, iid=iid, text=text, values=values, open=is_open)
+        if self._pending:
+            self._render_job = self.after(1, self._apply_chunk)
+            return
+        self._render_job = None
+        self._remove_unwanted("")
+
+    def _remove_unwanted(self, parent):
+        for iid in self.tree.get_children(parent):
+            if iid not in self._wanted:
+                self.tree.delete(iid)
+            else:
+                self._remove_unwanted(iid)
+
+    def select(self):
+        iid = self.tree.focus()
+        if not iid or ":" in iid:
+            return
+        row = self.rows.get(int(iid))
+        if row is None:
+            return
+        if not row.exe:
+            self.status_var.set(f"The exe path of {row.name} ({row.pid}) is not accessible.")
+            return
+        self.result = row
+        self.destroy()
+
+
+def pick_process(parent):
+    """Shows the dialog until closed, returns the selected `ProcessRow` or None."""
+    dialog = ProcessPickerDialog(parent)
+    dialog.grab_set()
+    dialog.wait_window()
+    return dialog.result
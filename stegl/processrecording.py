@@ -0,0 +1,189 @@
+"""Recording the processes STEGL sees during a session, for replaying it later (see
+processsimulation.py).
+
+The recorder of the current context (see `RECORDER`) is fed by the process table
+and the launch lifecycle. Only changes are written, as one compact JSON line each,
+`t` being the seconds since the recording started:
+    {"type":"header","version":1,"time":1700000000.0,"config":{...}}
+    {"type":"groups","t":0.0,"groups":{"game_starter":"STEGL_1234_1","dependency 0":"STEGL_1234_0"}}
+    {"type":"launch","t":0.01,"id":"STEGL_1234_0","pid":4321}
+    {"type":"start","t":0.52,"pid":4322,"ct":1700000000.5,"ppid":4321,"exe":"C:/...","ids":["STEGL_1234_0"]}
+    {"type":"exec","t":9.7,"pid":4322,"ct":1700000000.5,"exe":"C:/..."}
+    {"type":"signal","t":1801.2,"pid":4322,"ct":1700000000.5,"signal":"terminate"}
+    {"type":"exit","t":1801.3,"pid":4322,"ct":1700000000.5}
+    {"type":"end","t":1815.0}
+Processes are identified by PID and create time (`ct`), so reused PIDs are told
+apart. Without a recorder, all functions of this module do nothing."""
+
+import contextvars
+import json
+import threading
+import time
+
+import psutil
+
+from stegl import clock
+from stegl.launchhistory import launch_label
+
+# Recorder of the current context
+RECORDER = contextvars.ContextVar("RECORDER", default=None)
+
+VERSION = 1
+
+
+def _key(process):
+    return (process.pid, round(process.create_time(), 3))
+
+
+class ProcessRecorder:
+    """Writes the processes of all launch groups seen by process tables and the
+    signals sent to them to `path` (overwriting it). `config` is the configuration
+    of the recorded session, stored for the replay."""
+
+    def __init__(self, path, config : dict = None):
+        self.path = path
+        self._origin = clock.monotonic()
+        self._lock = threading.Lock()
+        self._alive = {} # key -> STEGL IDs
+        self._exes = {}
+        self._file = open(path, "w", encoding="utf-8")
+        self._write({"type": "header", "version": VERSION, "time": time.time(), "config": config}, timed=False)
+
+    def _write(self, record : dict, timed : bool = True):
+        if timed:
+            record["t"] = round(clock.monotonic() - self._origin, 4)
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def groups(self, groups : dict):
+        self._write({"type": "groups", "groups": groups})
+
+    def launch(self, stegl_id : str, process):
+        self._write({"type": "launch", "id": stegl_id, "pid": process.pid})
+        # Recorded right away, as it might exit before the next snapshot
+        try:
+            key = _key(process)
+            ppid = process.ppid()
+        except psutil.NoSuchProcess:
+            return
+        try:
+            exe = process.exe()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            exe = None
+        self._start(key, ppid, exe, {stegl_id})
+
+    def _start(self, key, ppid, exe, ids):
+        self._alive[key] = ids
+        self._exes[key] = exe
+        self._write({"type": "start", "pid": key[0], "ct": key[1], "ppid": ppid, "exe": exe, "ids": sorted(ids)})
+
+    def snapshot(self, table, buckets : dict):
+        """Records processes that joined or left the groups since the previous
+        snapshot. Processes of groups no longer registered don't count as exited."""
+        current = {}
+        for stegl_id, processes in buckets.items():
+            for p in processes:
+                try:
+                    key = _key(p)
+                except psutil.NoSuchProcess:
+                    continue
+                current.setdefault(key, (p, set()))[1].add(stegl_id)
+
+        for key, (p, ids) in current.items():
+            if key in self._alive:
+                continue
+            try:
+                ppid = table.metadata.ppid(p)
+            except psutil.NoSuchProcess:
+                continue
+            try:
+                exe = table.metadata.exe(p)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                exe = None
+            self._start(key, ppid, exe, ids)
+
+        for key, ids in list(self._alive.items()):
+            if key not in current and not ids.isdisjoint(buckets):
+                self._exit(key)
+
+    def _exit(self, key):
+        if self._alive.pop(key, None) is None:
+            return
+        self._write({"type": "exit", "pid": key[0], "ct": key[1]})
+
+    def exited(self, processes):
+        """Records exits as soon as they were noticed, e.g. by a watcher."""
+        for p in processes:
+            try:
+                self._exit(_key(p))
+            except psutil.NoSuchProcess:
+                pass
+
+    def exe_changed(self, process, exe : str):
+        try:
+            pid, ct = _key(process)
+        except psutil.NoSuchProcess:
+            return
+        if self._exes.get((pid, ct), exe) == exe:
+            return
+        self._exes[(pid, ct)] = exe
+        self._write({"type": "exec", "pid": pid, "ct": ct, "exe": exe})
+
+    def signal(self, process, signal : str):
+        try:
+            pid, ct = _key(process)
+        except psutil.NoSuchProcess:
+            return
+        self._write({"type": "signal", "pid": pid, "ct": ct, "signal": signal})
+
+    def close(self):
+        self._write({"type": "end"})
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def groups(game):
+    """Records the STEGL IDs of the launch groups of an `AsyncExternalGame`, by
+    launch label (see launchhistory.py)."""
+    recorder = RECORDER.get()
+    if recorder is not None:
+        labels = {launch_label(i, dep.name): dep.ID for i, dep in enumerate(game.dependencies)}
+        labels[launch_label()] = game.game_starter.ID
+        recorder.groups(labels)
+
+
+def launch(stegl_id : str, process):
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.launch(stegl_id, process)
+
+
+def snapshot(table, buckets : dict):
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.snapshot(table, buckets)
+
+
+def exited(processes):
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.exited(processes)
+
+
+def exe_changed(process, exe : str):
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.exe_changed(process, exe)
+
+
+def signal(process, signal : str):
+    """Records a signal ("terminate", "kill", "suspend" or "resume") sent to a process."""
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.signal(process, signal)
@@ -0,0 +1,596 @@
+"""Replaying recorded sessions (see processrecording.py) in simulated time.
+
+`replay` runs `AsyncExternalGame.run()` unchanged against a simulated process
+table and watcher. The event loop runs on a `SimulatedClock`: instead of waiting
+for its next timer, the clock jumps to it, so a session of hours is replayed in
+milliseconds, deterministically. Blocking calls (`asyncio.to_thread`) run inline.
+
+The recorded processes are replayed relative to what STEGL does in the replay:
+- Processes of a launch group start relative to the launch of the group. Processes
+  that started after STEGL began terminating the group (e.g. respawned children)
+  start relative to the group's first termination signal instead. A process only
+  starts if its recorded parent is still running.
+- Exits before any signal happen at their recorded time, relative to the same
+  reference. A process that exited after being terminated (or killed) exits that
+  long after receiving the same signal in the replay, one that survived a signal
+  ignores it. Processes STEGL never signalled exit `default_termination_delay`
+  seconds after being terminated.
+Scheduling changes (`while_in_game`, `GAME.tuning`), attaching to running
+instances and resource profiles aren't simulated and are dropped from the
+replayed configuration."""
+
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import contextlib
+import copy
+import json
+import math
+import os
+import re
+import selectors
+import time
+
+import psutil
+
+from stegl import clock
+from stegl import processrecording as recording
+from stegl import tracing
+from stegl.launchhistory import launch_label
+from stegl.logging import SINK
+from stegl.processlaunching import AsyncExternalGame, ProcessMetadataCache, ProcessTable
+from stegl.processwatching import PollingProcessWatcher, is_process_alive
+
+_CpuTimes = namedtuple("_CpuTimes", ["user", "system"])
+_IoCounters = namedtuple("_IoCounters", ["read_bytes", "write_bytes"])
+_MemoryInfo = namedtuple("_MemoryInfo", ["rss", "vms"])
+
+# Capture and game options which can't be replayed
+_UNSUPPORTED_CAPTURE_OPTIONS = ("while_in_game", "while_in_game_cores", "attach_if_running", "attach_cmdline", "terminate_adopted")
+_UNSUPPORTED_GAME_OPTIONS = ("tuning", "resource_profile", "process_tracking", "process_watcher")
+
+# Shortest time a simulated wait takes
+MIN_WAIT = 1e-6
+
+
+class SimulatedClock:
+    def __init__(self, now : float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds : float):
+        # Timeouts computed from deadlines can be too small to change the sum,
+        # time must pass regardless
+        self.now = max(self.now + seconds, math.nextafter(self.now, math.inf))
+
+
+class _SimulatedSelector:
+    """Never blocks: instead of waiting for the next timer, the clock is advanced to it."""
+
+    def __init__(self, simulated_clock : SimulatedClock, max_duration : float):
+        self._selector = selectors.DefaultSelector()
+        self._clock = simulated_clock
+        self._max_duration = max_duration
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or (timeout is not None and timeout <= 0):
+            return events
+        if timeout is None:
+            raise RuntimeError("The simulated session stalled, nothing is scheduled any more.")
+        self._clock.advance(timeout)
+        if self._clock.now > self._max_duration:
+            raise TimeoutError(f"The simulated session exceeded {self._max_duration} seconds.")
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class _InlineExecutor(ThreadPoolExecutor):
+    """Runs submitted calls immediately, keeping the simulation single threaded."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    """Event loop running on a `SimulatedClock`."""
+
+    def __init__(self, simulated_clock : SimulatedClock, max_duration : float = 7 * 24 * 3600):
+        super().__init__(_SimulatedSelector(simulated_clock, max_duration))
+        self.simulated_clock = simulated_clock
+        self.set_default_executor(_InlineExecutor())
+
+    def time(self):
+        return self.simulated_clock.now
+
+
+def _portable(path):
+    """Recorded Windows paths with normalized separators, so they are compared like
+    paths on the replaying platform."""
+    if path is None or os.sep == "\\":
+        return path
+    return path.replace("\\", "/") if re.match(r"^[A-Za-z]:[\\/]", path) else path
+
+
+# Plan of a recorded process: `start` and `exit` are (reference, offset) with the
+# reference being "launch" or "signal" (see module docstring), `execs` a list of
+# (reference, offset, exe), `on_terminate`/`on_kill` the delay until exiting after
+# the signal (None if ignored)
+ProcessPlan = namedtuple("ProcessPlan", ["key", "pid", "ppid", "parent", "exe", "ct", "ids", "group", "start", "execs", "exit", "on_terminate", "on_kill"])
+
+
+class ProcessTrace:
+    """A parsed recording, see processrecording.py for the format."""
+
+    def __init__(self, records, default_termination_delay : float = 0.1):
+        if not records or records[0].get("type") != "header":
+            raise ValueError("Not a STEGL process trace.")
+        header = records[0]
+        if header.get("version") != recording.VERSION:
+            raise ValueError(f"Unsupported trace version {header.get('version')}.")
+        self.config = header.get("config")
+        self.start_time = header["time"]
+        self.groups = {}
+        self.launches = {} # STEGL ID -> (t, pid)
+        self.duration = 0.0
+
+        processes = {}
+        launch_order = []
+        for record in records[1:]:
+            kind = record["type"]
+            self.duration = max(self.duration, record.get("t", 0.0))
+            key = (record["pid"], record["ct"]) if "ct" in record else None
+            if kind == "groups":
+                self.groups.update(record["groups"])
+            elif kind == "launch":
+                self.launches[record["id"]] = (record["t"], record["pid"])
+                launch_order.append(record["id"])
+            elif kind == "start":
+                processes[key] = dict(record, execs=[], exit=None, signals=[])
+            elif key in processes:
+                if kind == "exec":
+                    processes[key]["execs"].append((record["t"], record["exe"]))
+                elif kind == "exit":
+                    processes[key]["exit"] = record["t"]
+                elif kind == "signal":
+                    processes[key]["signals"].append((record["t"], record["signal"]))
+
+        # Traces of sessions not run through AsyncExternalGame.run() lack labels
+        if not self.groups:
+            self.groups = {f"group {i}": stegl_id for i, stegl_id in enumerate(launch_order)}
+
+        self.plans = self._plans(processes, default_termination_delay)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()], **kwargs)
+
+    def _plans(self, processes, default_termination_delay):
+        first_signal = {}
+        for process in processes.values():
+            group = self._group(process)
+            for t, signal in process["signals"]:
+                if signal in ("terminate", "kill") and group is not None:
+                    first_signal[group] = min(first_signal.get(group, t), t)
+
+        def relative(group, t):
+            if group in first_signal and t >= first_signal[group]:
+                return ("signal", t - first_signal[group])
+            return ("launch", t - self.launches[group][0])
+
+        # The root of a group is recorded right when it was launched
+        roots = {}
+        for key, process in processes.items():
+            group = self._group(process)
+            if group is not None and group not in roots and process["pid"] == self.launches[group][1] \
+                    and process["t"] >= self.launches[group][0]:
+                roots[group] = key
+
+        starts = {}
+        for key, process in processes.items():
+            group = self._group(process)
+            if group is None or group not in roots:
+                continue
+            launched = self.launches[group][0]
+            # Processes are seen by the next snapshot only, their create time (which
+            # might be offset from the wall clock, so it's taken relative to the
+            # root's) is more precise
+            since_root = process["ct"] - roots[group][1]
+            starts[key] = launched if key == roots[group] else min(process["t"], max(launched, launched + since_root))
+        self.roots = roots # STEGL ID -> key of the launched process
+
+        plans = []
+        for key, process in sorted(processes.items(), key=lambda item: starts.get(item[0], 0)):
+            if key not in starts:
+                continue
+            group = self._group(process)
+            # The latest process with the parent's PID started before this one
+            parents = [k for k in starts if k[0] == process["ppid"] and starts[k] <= starts[key] and k != key]
+            parent = max(parents, key=lambda k: starts[k]) if parents else None
+
+            terminated = [t for t, signal in process["signals"] if signal == "terminate"]
+            killed = [t for t, signal in process["signals"] if signal == "kill"]
+            exit_time = process["exit"]
+            exit_plan = None
+            on_terminate, on_kill = default_termination_delay, 0.0
+            if exit_time is not None:
+                if killed and exit_time >= killed[0]:
+                    on_terminate, on_kill = None, exit_time - killed[0]
+                elif terminated and exit_time >= terminated[0]:
+                    on_terminate = exit_time - terminated[0]
+                else:
+                    exit_plan = relative(group, exit_time)
+            elif killed:
+                on_terminate = on_kill = None
+            elif terminated:
+                on_terminate = None
+
+            plans.append(ProcessPlan(
+                key, process["pid"], process["ppid"], parent, _portable(process["exe"]), process["ct"], process["ids"], group,
+                relative(group, starts[key]),
+                [relative(group, t) + (_portable(exe),) for t, exe in process["execs"]],
+                exit_plan, on_terminate, on_kill
+            ))
+        return plans
+
+    def _group(self, process):
+        """The launched group of a process (the earliest launched, if several)."""
+        launched = [stegl_id for stegl_id in process["ids"] if stegl_id in self.launches]
+        return min(launched, key=lambda stegl_id: self.launches[stegl_id][0]) if launched else None
+
+
+class SimulatedProcess:
+    """Stands in for a `psutil.Process` of a replayed process."""
+
+    def __init__(self, world, plan : ProcessPlan, ids):
+        self.world = world
+        self.plan = plan
+        self.pid = plan.pid
+        self.ids = ids
+        self.exe_path = plan.exe
+        self.running = True
+        self.suspended = False
+
+    def __repr__(self):
+        return f"SimulatedProcess(pid={self.pid}, exe={self.exe_path!r}, running={self.running})"
+
+    def _check(self):
+        if not self.running:
+            raise psutil.NoSuchProcess(self.pid)
+
+    def is_running(self):
+        return self.running
+
+    def status(self):
+        self._check()
+        return psutil.STATUS_STOPPED if self.suspended else psutil.STATUS_RUNNING
+
+    def create_time(self):
+        return self.plan.ct
+
+    def ppid(self):
+        self._check()
+        return self.plan.ppid
+
+    def exe(self):
+        self._check()
+        if self.exe_path is None:
+            raise psutil.AccessDenied(self.pid)
+        return self.exe_path
+
+    def cmdline(self):
+        return [self.exe()]
+
+    def environ(self):
+        self._check()
+        return {stegl_id: "" for stegl_id in self.ids}
+
+    def children(self, recursive : bool = False):
+        self._check()
+        children = [p for p in self.world.running() if p.plan.ppid == self.pid]
+        if recursive:
+            for child in list(children):
+                children += child.children(recursive=True)
+        return children
+
+    def oneshot(self):
+        return contextlib.nullcontext()
+
+    def cpu_times(self):
+        self._check()
+        return _CpuTimes(0.0, 0.0)
+
+    def io_counters(self):
+        self._check()
+        return _IoCounters(0, 0)
+
+    def memory_info(self):
+        self._check()
+        return _MemoryInfo(0, 0)
+
+    def num_threads(self):
+        self._check()
+        return 1
+
+    def terminate(self):
+        self.world.signal(self, "terminate")
+
+    def kill(self):
+        self.world.signal(self, "kill")
+
+    def suspend(self):
+        self.world.signal(self, "suspend")
+
+    def resume(self):
+        self.world.signal(self, "resume")
+
+
+class SimulatedWorld:
+    """The replayed processes. Starts, exits and exec calls are scheduled on the
+    (simulated) event loop, relative to launches and signals of the replay."""
+
+    def __init__(self, trace : ProcessTrace, root_pid : int = 0):
+        self.trace = trace
+        self.root_pid = root_pid
+        self.signals = [] # (time, pid, signal)
+        self.ids = {} # recorded STEGL ID -> STEGL ID of the replay
+
+        self._processes = {} # key -> SimulatedProcess
+        self._references = {} # (group, reference) -> time
+        self._pending = {} # (group, reference) -> [(offset, callback)]
+        self._orphans = {} # key -> plans of children due before it started
+        self._waiters = []
+        self._loop = asyncio.get_running_loop()
+        for plan in trace.plans:
+            self._at(plan.group, plan.start, lambda plan=plan: self._start(plan))
+
+    def map_groups(self, groups : dict):
+        """Maps launch labels to the STEGL IDs of the replay."""
+        for label, stegl_id in groups.items():
+            if label in self.trace.groups:
+                self.ids[self.trace.groups[label]] = stegl_id
+
+    def running(self):
+        return [p for p in self._processes.values() if p.running]
+
+    def _at(self, group, when, callback):
+        reference, offset = when
+        if (group, reference) in self._references:
+            self._loop.call_at(max(self._loop.time(), self._references[(group, reference)] + offset), callback)
+        else:
+            self._pending.setdefault((group, reference), []).append((offset, callback))
+
+    def _set_reference(self, group, reference):
+        if (group, reference) in self._references:
+            return
+        self._references[(group, reference)] = self._loop.time()
+        for offset, callback in self._pending.pop((group, reference), []):
+            self._at(group, (reference, offset), callback)
+
+    def launch(self, stegl_id : str):
+        """Starts the recorded launch group of a replayed STEGL ID, returns its root."""
+        recorded = next((r for r, i in self.ids.items() if i == stegl_id), None)
+        if recorded not in self.trace.launches:
+            raise RuntimeError(f"No launch of {repr(stegl_id)} was recorded.")
+        self._set_reference(recorded, "launch")
+        root = next((plan for plan in self.trace.plans if plan.key == self.trace.roots.get(recorded)), None)
+        if root is None:
+            raise RuntimeError(f"The root process of {repr(stegl_id)} was not recorded.")
+        # The root starts right away, so it can be returned
+        return self._processes.get(root.key) or self._start(root)
+
+    def _start(self, plan : ProcessPlan):
+        if plan.key in self._processes:
+            return self._processes[plan.key]
+        if plan.parent is not None:
+            parent = self._processes.get(plan.parent)
+            if parent is None:
+                # Timers due at the same time run in any order
+                self._orphans.setdefault(plan.parent, []).append(plan)
+                return None
+            if not parent.running:
+                return None
+        ids = {self.ids.get(stegl_id, stegl_id) for stegl_id in plan.ids}
+        process = self._processes[plan.key] = SimulatedProcess(self, plan, ids)
+        for when in plan.execs:
+            self._at(plan.group, when[:2], lambda exe=when[2]: self._exec(process, exe))
+        if plan.exit is not None:
+            self._at(plan.group, plan.exit, lambda: self._exit(process))
+        self._notify(process)
+        for child in self._orphans.pop(plan.key, []):
+            self._start(child)
+        return process
+
+    def _exec(self, process, exe):
+        if process.running:
+            process.exe_path = exe
+            self._notify(process)
+
+    def _exit(self, process):
+        if process.running:
+            process.running = False
+            self._notify(process)
+
+    def signal(self, process, signal : str):
+        process._check()
+        self.signals.append((self._loop.time(), process.pid, signal))
+        if signal in ("terminate", "kill"):
+            # Respawns and the like happen relative to the first termination
+            self._set_reference(process.plan.group, "signal")
+            delay = process.plan.on_terminate if signal == "terminate" else process.plan.on_kill
+            if delay is not None:
+                self._loop.call_at(self._loop.time() + delay, lambda: self._exit(process))
+        else:
+            process.suspended = signal == "suspend"
+
+    def _notify(self, process):
+        for future, pids in self._waiters:
+            if not future.done() and (pids is None or process.pid in pids or process.plan.ppid in pids):
+                future.set_result(True)
+
+    async def wait_for_change(self, timeout : float = None, pids = None):
+        """Waits until a process (of `pids` or their children) started, exited or
+        executed another program. Returns False if `timeout` passed first."""
+        waiter = (self._loop.create_future(), None if pids is None else set(pids))
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[0], timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.remove(waiter)
+
+
+class _SimulatedMetadataCache(ProcessMetadataCache):
+    def _read_exe(self, process):
+        return process.exe()
+
+
+class SimulatedProcessTable(ProcessTable):
+    """Process table of the replayed processes."""
+
+    def __init__(self, world : SimulatedWorld):
+        super().__init__(world.root_pid, "environ", _SimulatedMetadataCache())
+        self.world = world
+
+    def launch(self, stegl_id : str, command, environ : dict, cwd : str = None):
+        return self.world.launch(stegl_id)
+
+    def _scan(self):
+        self.scan_count += 1
+        buckets = {stegl_id: [] for stegl_id in self.ids}
+        for p in self.world.running():
+            for stegl_id in p.ids.intersection(buckets):
+                buckets[stegl_id].append(p)
+        return buckets
+
+
+class SimulatedProcessWatcher(PollingProcessWatcher):
+    """Wakes on every change of the replayed processes like the event driven
+    backends, or polls like `PollingProcessWatcher` if not `event_driven`."""
+
+    name = "simulated"
+
+    def __init__(self, world : SimulatedWorld, event_driven : bool = True, poll_interval : float = 1.0):
+        super().__init__(poll_interval)
+        self.world = world
+        self.event_driven = event_driven
+
+    async def async_wait_for_change(self, timeout : float, pids = None):
+        # Waiting takes some time in reality, deadlines computed with rounding
+        # errors would otherwise never pass
+        timeout = max(MIN_WAIT, timeout)
+        if not self.event_driven:
+            return await super().async_wait_for_change(timeout, pids)
+        return await self.world.wait_for_change(timeout, pids)
+
+    async def async_wait_for_exit(self, processes, timeout : float = None):
+        if not self.event_driven:
+            return await super().async_wait_for_exit(processes, timeout)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        pids = set(p.pid for p in processes)
+        while True:
+            gone = [p for p in processes if not is_process_alive(p)]
+            if gone:
+                return gone
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return []
+            await self.world.wait_for_change(remaining, pids)
+
+
+def replay_configuration(config : dict):
+    """The configuration without the options that can't be replayed."""
+    config = copy.deepcopy(config)
+    game = config["GAME"]
+    for option in _UNSUPPORTED_GAME_OPTIONS:
+        game.pop(option, None)
+    game["launch_history"] = False
+    game["game_search_paths"] = [_portable(path) for path in game["game_search_paths"]]
+    if game.get("game_search_excludes"):
+        game["game_search_excludes"] = [_portable(path) for path in game["game_search_excludes"]]
+    for launch_config in [game["launch_config"]] + config["DEPENDENCIES"]:
+        for option in _UNSUPPORTED_CAPTURE_OPTIONS:
+            launch_config.pop(option, None)
+    return config
+
+
+def replay(
+    trace,
+    config : dict = None,
+    event_driven : bool = True,
+    poll_interval : float = 1.0,
+    default_termination_delay : float = 0.1,
+    max_duration : float = 7 * 24 * 3600
+):
+    """Replays a recorded session (a `ProcessTrace` or the path of a trace file)
+    through `AsyncExternalGame.run()` in simulated time, using the recorded
+    configuration unless `config` is given. `event_driven` and `poll_interval`
+    select the simulated watcher. Returns a dict with the outcome, the simulated
+    `duration`, the `phases` (durations of the traced spans), the `signals` sent,
+    the PIDs still running afterwards (`remaining`), the number of `scans`, the
+    console `output` and the real time the replay took (`replay_seconds`)."""
+    if not isinstance(trace, ProcessTrace):
+        trace = ProcessTrace.load(trace, default_termination_delay=default_termination_delay)
+    simulated_clock = SimulatedClock()
+    tracer = tracing.MemoryTracer()
+    output = []
+
+    async def run():
+        clock.CLOCK.set(simulated_clock)
+        tracing.TRACER.set(tracer)
+        recording.RECORDER.set(None)
+        SINK.set(lambda text, end="\n": output.append(f"{text}{end}"))
+        world = SimulatedWorld(trace)
+        table = SimulatedProcessTable(world)
+        game = AsyncExternalGame.from_configuration(
+            replay_configuration(config if config is not None else trace.config),
+            process_table=table, watcher=SimulatedProcessWatcher(world, event_driven, poll_interval)
+        )
+        groups = {launch_label(i, dep.name): dep.ID for i, dep in enumerate(game.dependencies)}
+        groups[launch_label()] = game.game_starter.ID
+        world.map_groups(groups)
+        try:
+            await game.run()
+            outcome = "success"
+        except Exception as e:
+            outcome = repr(e)
+        labels = {stegl_id: label for label, stegl_id in groups.items()}
+        return outcome, world, table, labels
+
+    start = time.perf_counter()
+    loop = SimulatedEventLoop(simulated_clock, max_duration)
+    try:
+        outcome, world, table, labels = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    phases = {}
+    for record in tracer.records:
+        if record["type"] != "span":
+            continue
+        name = record["name"]
+        if name == "launch":
+            name = f"launch {labels.get(record.get('stegl_id'), record.get('stegl_id'))}"
+        phases[name] = phases.get(name, 0.0) + record["duration"]
+    return {
+        "outcome": outcome,
+        "duration": simulated_clock.now,
+        "phases": phases,
+        "signals": world.signals,
+        "remaining": sorted(p.pid for p in world.running()),
+        "scans": table.scan_count,
+        "output": "".join(output),
+        "replay_seconds": time.perf_counter() - start
+    }
@@ -0,0 +1,303 @@
+"""Backends for waiting on changes of the process table.
+
+The `PollingProcessWatcher` works everywhere and simply sleeps. On Linux, event
+driven backends are available: `PidfdProcessWatcher` waits for process exits using
+pidfds, `NetlinkProcessWatcher` additionally receives fork/exec/exit events from
+the kernel's proc connector (requires CAP_NET_ADMIN).
+
+Every wait is available as a blocking method and as a coroutine (`async_*`)."""
+
+import asyncio
+import os
+import select
+import socket
+import struct
+import sys
+import time
+import psutil
+
+
+def is_process_alive(process):
+    """Like `process.is_running()`, but zombies are considered dead."""
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+class PollingProcessWatcher:
+    """Fallback backend which polls in fixed intervals."""
+
+    name = "polling"
+
+    def __init__(self, poll_interval : float = 1.0):
+        self.poll_interval = poll_interval
+
+    def wait_for_change(self, timeout : float, pids = None):
+        """Blocks until the process table might have changed or `timeout` seconds
+        passed. If `pids` is given, only changes concerning these processes (and
+        their children) are of interest. Returns False if the timeout passed without
+        any observed change, polling always reports a possible change."""
+        time.sleep(max(0, min(timeout, self.poll_interval)))
+        return True
+
+    def wait_for_exit(self, processes, timeout : float = None):
+        """Blocks until at least one of the passed processes exited or `timeout`
+        seconds passed. Returns the list of exited processes."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            gone, _ = psutil.wait_procs(processes, timeout=max(0, remaining))
+            if gone or (deadline is not None and time.monotonic() >= deadline):
+                return gone
+
+    async def async_wait_for_change(self, timeout : float, pids = None):
+        await asyncio.sleep(max(0, min(timeout, self.poll_interval)))
+        return True
+
+    async def async_wait_for_exit(self, processes, timeout : float = None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        # Exits are checked more often than the poll interval, as checking is cheap
+        interval = min(self.poll_interval, 0.1)
+        while True:
+            gone = [p for p in processes if not is_process_alive(p)]
+            if gone:
+                return gone
+            remaining = interval if deadline is None else min(interval, deadline - loop.time())
+            if remaining <= 0:
+                return []
+            await asyncio.sleep(remaining)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PidfdProcessWatcher(PollingProcessWatcher):
+    """Waits for process exits using pidfds (Linux 5.3+). Other changes of the
+    process table are still polled."""
+
+    name = "pidfd"
+
+    def __init__(self, poll_interval : float = 1.0):
+        if not hasattr(os, "pidfd_open"):
+            raise OSError("pidfd_open is not supported on this platform.")
+        super().__init__(poll_interval)
+
+    def _open_pidfds(self, processes):
+        """Returns a dict mapping pidfds to their processes, as well as the list of
+        processes that are already gone."""
+        fds = {}
+        gone = []
+        for p in processes:
+            try:
+                fd = os.pidfd_open(p.pid)
+            except ProcessLookupError:
+                gone.append(p)
+                continue
+            fds[fd] = p
+            # The PID might have been reused before the pidfd was opened
+            if not p.is_running():
+                gone.append(p)
+        return fds, gone
+
+    def wait_for_exit(self, processes, timeout : float = None):
+        fds, gone = self._open_pidfds(processes)
+        try:
+            if gone:
+                return gone
+            poller = select.poll()
+            for fd in fds:
+                poller.register(fd, select.POLLIN)
+            events = poller.poll(None if timeout is None else max(0, timeout) * 1000)
+            return [fds[fd] for fd, _ in events]
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    async def async_wait_for_exit(self, processes, timeout : float = None):
+        loop = asyncio.get_running_loop()
+        fds, gone = self._open_pidfds(processes)
+        try:
+            if gone:
+                return gone
+            exited = loop.create_future()
+            def on_exit(p):
+                if not exited.done():
+                    exited.set_result(p)
+            for fd, p in fds.items():
+                loop.add_reader(fd, on_exit, p)
+            try:
+                return [await asyncio.wait_for(exited, timeout)]
+            except asyncio.TimeoutError:
+                return []
+        finally:
+            for fd in fds:
+                loop.remove_reader(fd)
+                os.close(fd)
+
+
+class NetlinkProcessWatcher(PidfdProcessWatcher):
+    """Receives fork, exec and exit events through the netlink proc connector."""
+
+    name = "netlink"
+
+    NETLINK_CONNECTOR = 11
+    CN_IDX_PROC = 1
+    CN_VAL_PROC = 1
+    NLMSG_DONE = 3
+    PROC_CN_MCAST_LISTEN = 1
+    PROC_CN_MCAST_IGNORE = 2
+
+    PROC_EVENT_FORK = 0x00000001
+    PROC_EVENT_EXEC = 0x00000002
+    PROC_EVENT_EXIT = 0x80000000
+
+    _NLMSGHDR = struct.Struct("=IHHII")
+    _CN_MSG = struct.Struct("=IIIIHH")
+    _PROC_EVENT = struct.Struct("=IIQ")
+
+    def __init__(self, poll_interval : float = 1.0):
+        super().__init__(poll_interval)
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NetlinkProcessWatcher.NETLINK_CONNECTOR)
+        try:
+            self.sock.bind((0, NetlinkProcessWatcher.CN_IDX_PROC))
+            self._send_control(NetlinkProcessWatcher.PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+        # Processes forked from watched ones are watched as well
+        self._watched = set()
+        # Pending coroutine waits, all served by one reader of the socket:
+        # future -> whether any change is of interest
+        self._waiters = {}
+
+    def _send_control(self, op):
+        payload = struct.pack("=I", op)
+        cn_msg = self._CN_MSG.pack(self.CN_IDX_PROC, self.CN_VAL_PROC, 0, 0, len(payload), 0)
+        length = self._NLMSGHDR.size + len(cn_msg) + len(payload)
+        header = self._NLMSGHDR.pack(length, self.NLMSG_DONE, 0, 0, os.getpid())
+        self.sock.send(header + cn_msg + payload)
+
+    def _parse_events(self, data):
+        offset = 0
+        while offset + self._NLMSGHDR.size <= len(data):
+            length = self._NLMSGHDR.unpack_from(data, offset)[0]
+            if length == 0:
+                break
+            event_offset = offset + self._NLMSGHDR.size + self._CN_MSG.size
+            if event_offset + self._PROC_EVENT.size <= offset + length:
+                what = self._PROC_EVENT.unpack_from(data, event_offset)[0]
+                args_offset = event_offset + self._PROC_EVENT.size
+                if what == self.PROC_EVENT_FORK:
+                    _, parent_tgid, child_pid, child_tgid = struct.unpack_from("=IIII", data, args_offset)
+                    # Only processes are of interest, not threads
+                    if child_pid == child_tgid:
+                        yield what, child_tgid, parent_tgid
+                elif what in (self.PROC_EVENT_EXEC, self.PROC_EVENT_EXIT):
+                    pid, tgid = struct.unpack_from("=II", data, args_offset)
+                    if pid == tgid:
+                        yield what, tgid, None
+            offset += (length + 3) & ~3
+
+    def _drain(self):
+        """Reads all pending events. Returns whether there were any events at all and
+        whether any of them concerns a watched process."""
+        any_event = watched_event = False
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                # Receive buffer overrun, events were lost
+                return True, True
+            for what, pid, parent in self._parse_events(data):
+                any_event = True
+                if what == self.PROC_EVENT_FORK and parent in self._watched:
+                    self._watched.add(pid)
+                    watched_event = True
+                elif pid in self._watched:
+                    watched_event = True
+                    if what == self.PROC_EVENT_EXIT:
+                        # The PID may be reused by an unrelated process
+                        self._watched.discard(pid)
+        return any_event, watched_event
+
+    def wait_for_change(self, timeout : float, pids = None):
+        if pids is not None:
+            self._watched.update(pids)
+        deadline = time.monotonic() + max(0, timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return False
+            any_event, watched_event = self._drain()
+            if watched_event or (pids is None and any_event):
+                return True
+
+    def _on_readable(self):
+        any_event, watched_event = self._drain()
+        for changed, any_change in self._waiters.items():
+            if not changed.done() and (watched_event or (any_change and any_event)):
+                changed.set_result(True)
+
+    async def async_wait_for_change(self, timeout : float, pids = None):
+        # Several coroutines (e.g. concurrently launched groups) may wait at once,
+        # so events are read by one shared reader and dispatched to all of them
+        if pids is not None:
+            self._watched.update(pids)
+        loop = asyncio.get_running_loop()
+        changed = loop.create_future()
+        if not self._waiters:
+            loop.add_reader(self.sock, self._on_readable)
+        self._waiters[changed] = pids is None
+        try:
+            return await asyncio.wait_for(changed, max(0, timeout))
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            del self._waiters[changed]
+            if not self._waiters:
+                loop.remove_reader(self.sock)
+
+    def close(self):
+        try:
+            self._send_control(NetlinkProcessWatcher.PROC_CN_MCAST_IGNORE)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+WATCHER_BACKENDS = {
+    "polling": PollingProcessWatcher,
+    "pidfd": PidfdProcessWatcher,
+    "netlink": NetlinkProcessWatcher,
+}
+
+
+def create_watcher(backend : str = "auto", poll_interval : float = 1.0):
+    """Creates a process watcher. With "auto", the best backend available on this
+    system is used, falling back to polling."""
+    if backend != "auto":
+        if backend not in WATCHER_BACKENDS:
+            raise ValueError(f"Unknown process watcher backend {repr(backend)}.")
+        return WATCHER_BACKENDS[backend](poll_interval)
+
+    if sys.platform.startswith("linux"):
+        for watcher_class in (NetlinkProcessWatcher, PidfdProcessWatcher):
+            try:
+                return watcher_class(poll_interval)
+            except OSError:
+                pass
+    return PollingProcessWatcher(poll_interval)
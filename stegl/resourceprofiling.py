@@ -0,0 +1,207 @@
+"""Measuring the resource usage of launch groups.
+
+`ResourceProfiler` periodically samples CPU, RSS, I/O and thread counts of groups
+of processes (e.g. every dependency, the game starter without the game, and the
+game itself). The most recent samples are kept in a fixed-size ring buffer, while
+peaks and averages are aggregated over the whole session.
+
+`ActivityMonitor` detects when processes became quiet (e.g. a launcher finished
+uploading cloud saves)."""
+
+from collections import deque
+import asyncio
+import json
+import time
+import psutil
+
+from stegl import clock
+
+
+class ResourceProfiler:
+    """Samples the processes returned by `groups()` (a dict mapping a label to a list
+    of processes) every `interval` seconds. Labels listed in `overhead_exclude` (e.g.
+    the game itself) don't count towards the combined launcher overhead."""
+
+    OVERHEAD = "launcher_overhead"
+
+    def __init__(self, interval : float = 1.0, capacity : int = 600, overhead_exclude = ("game",)):
+        self.interval = interval
+        self.samples = deque(maxlen=capacity) # (time, label, cpu %, rss, I/O bytes/s, threads, processes)
+        self.overhead_exclude = set(overhead_exclude)
+        self.start_time = None
+
+        self._aggregates = {}
+        self._previous = {} # (pid, create_time) -> (time, cpu seconds, I/O bytes)
+
+    def _measure(self, process, now):
+        """Returns cpu %, rss, I/O rate and threads of a process. Rates are relative
+        to the previous sample of the same process, so a process' first sample has
+        none."""
+        with process.oneshot():
+            key = (process.pid, process.create_time())
+            cpu_times = process.cpu_times()
+            cpu = cpu_times.user + cpu_times.system
+            rss = process.memory_info().rss
+            threads = process.num_threads()
+            try:
+                counters = process.io_counters()
+                io = counters.read_bytes + counters.write_bytes
+            except (AttributeError, psutil.AccessDenied):
+                # Not available on every platform
+                io = None
+
+        previous = self._previous.get(key)
+        self._previous[key] = (now, cpu, io)
+        if previous is None or now <= previous[0]:
+            return 0.0, rss, 0.0, threads
+        elapsed = now - previous[0]
+        io_rate = (io - previous[2]) / elapsed if io is not None and previous[2] is not None else 0.0
+        return (cpu - previous[1]) / elapsed * 100, rss, io_rate, threads
+
+    def sample(self, groups : dict, now : float = None):
+        """Takes one sample of every group (blocking)."""
+        now = clock.monotonic() if now is None else now
+        # The first sample only serves as reference for the rates of the next one
+        priming = self.start_time is None
+        if priming:
+            self.start_time = now
+        seen = set()
+        overhead = [0.0, 0, 0.0, 0, 0]
+        for label, processes in groups.items():
+            totals = [0.0, 0, 0.0, 0, 0]
+            for p in processes:
+                try:
+                    measured = self._measure(p, now)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+                seen.add((p.pid, p.create_time()))
+                for i, value in enumerate(measured):
+                    totals[i] += value
+                totals[4] += 1
+            if not priming:
+                self._record(now, label, totals)
+            if label not in self.overhead_exclude:
+                overhead = [a + b for a, b in zip(overhead, totals)]
+        if not priming:
+            self._record(now, ResourceProfiler.OVERHEAD, overhead)
+
+        # Exited processes don't need their previous measurements any more
+        for key in [key for key in self._previous if key not in seen]:
+            del self._previous[key]
+
+    def _record(self, now, label, totals):
+        cpu, rss, io_rate, threads, processes = totals
+        self.samples.append((now - self.start_time, label, cpu, rss, io_rate, threads, processes))
+        aggregate = self._aggregates.setdefault(label, {
+            "samples": 0, "cpu_percent_sum": 0.0, "cpu_percent_peak": 0.0, "rss_sum": 0, "rss_peak": 0,
+            "io_bytes_per_second_sum": 0.0, "io_bytes_per_second_peak": 0.0, "threads_peak": 0, "processes_peak": 0
+        })
+        aggregate["samples"] += 1
+        aggregate["cpu_percent_sum"] += cpu
+        aggregate["cpu_percent_peak"] = max(aggregate["cpu_percent_peak"], cpu)
+        aggregate["rss_sum"] += rss
+        aggregate["rss_peak"] = max(aggregate["rss_peak"], rss)
+        aggregate["io_bytes_per_second_sum"] += io_rate
+        aggregate["io_bytes_per_second_peak"] = max(aggregate["io_bytes_per_second_peak"], io_rate)
+        aggregate["threads_peak"] = max(aggregate["threads_peak"], threads)
+        aggregate["processes_peak"] = max(aggregate["processes_peak"], processes)
+
+    async def run(self, groups):
+        """Samples until cancelled. `groups` is a coroutine function returning the
+        groups to sample."""
+        while True:
+            current = await groups()
+            await asyncio.to_thread(self.sample, current)
+            await asyncio.sleep(self.interval)
+
+    def summary(self):
+        """Peak and average usage per group over all samples."""
+        groups = {}
+        for label, aggregate in self._aggregates.items():
+            count = aggregate["samples"]
+            groups[label] = {
+                "samples": count,
+                "cpu_percent_average": aggregate["cpu_percent_sum"] / count,
+                "cpu_percent_peak": aggregate["cpu_percent_peak"],
+                "rss_average": aggregate["rss_sum"] / count,
+                "rss_peak": aggregate["rss_peak"],
+                "io_bytes_per_second_average": aggregate["io_bytes_per_second_sum"] / count,
+                "io_bytes_per_second_peak": aggregate["io_bytes_per_second_peak"],
+                "threads_peak": aggregate["threads_peak"],
+                "processes_peak": aggregate["processes_peak"]
+            }
+        return {
+            "duration": self.samples[-1][0] if self.samples else 0.0,
+            "interval": self.interval,
+            "groups": groups
+        }
+
+    def write_summary(self, path, **fields):
+        """Appends the summary (and additional `fields`) as one JSON line to `path`."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), **fields, **self.summary()}) + "\n")
+
+
+def _total_io_bytes(counters):
+    """All I/O of a process, including network I/O where available (Linux counts
+    every read/write call in *_chars, Windows includes other I/O in other_bytes)."""
+    if hasattr(counters, "read_chars"):
+        return counters.read_chars + counters.write_chars
+    return counters.read_bytes + counters.write_bytes + getattr(counters, "other_bytes", 0)
+
+
+class ActivityMonitor:
+    """Decides when a set of processes became quiet, i.e. their combined CPU usage
+    and I/O rate (disk and network) stayed below the thresholds for `window`
+    seconds. Processes appearing count as activity."""
+
+    def __init__(self, window : float = 3, cpu_percent : float = 2, io_bytes_per_second : float = 65536):
+        self.window = window
+        self.cpu_percent = cpu_percent
+        self.io_bytes_per_second = io_bytes_per_second
+        self.quiet_since = None
+
+        self._previous = {} # (pid, create_time) -> (cpu seconds, I/O bytes)
+        self._previous_time = None
+
+    def sample(self, processes, now : float = None):
+        """Samples the processes (blocking), returns CPU % and I/O rate since the
+        previous sample."""
+        now = clock.monotonic() if now is None else now
+        current = {}
+        appeared = False
+        for p in processes:
+            try:
+                with p.oneshot():
+                    key = (p.pid, p.create_time())
+                    cpu_times = p.cpu_times()
+                    try:
+                        io = _total_io_bytes(p.io_counters())
+                    except (AttributeError, psutil.AccessDenied):
+                        io = 0
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            current[key] = (cpu_times.user + cpu_times.system, io)
+            appeared = appeared or key not in self._previous
+
+        cpu = io = 0.0
+        if self._previous_time is not None and now > self._previous_time:
+            elapsed = now - self._previous_time
+            for key, (cpu_seconds, io_bytes) in current.items():
+                if key in self._previous:
+                    cpu += (cpu_seconds - self._previous[key][0]) / elapsed * 100
+                    io += (io_bytes - self._previous[key][1]) / elapsed
+        # Nothing is known about the activity before the first sample
+        first = self._previous_time is None
+        self._previous = current
+        self._previous_time = now
+
+        if not first and (appeared or cpu > self.cpu_percent or io > self.io_bytes_per_second):
+            self.quiet_since = None
+        elif self.quiet_since is None:
+            self.quiet_since = now
+        return cpu, io
+
+    def is_quiet(self, now : float = None):
+        now = clock.monotonic() if now is None else now
+        return self.quiet_since is not None and now - self.quiet_since >= self.window
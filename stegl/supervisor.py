@@ -0,0 +1,160 @@
+"""Resident supervisor running launch sessions on behalf of clients.
+
+The supervisor keeps psutil loaded and its process tables alive, so that a client
+(`launch-external-game`) only has to forward its configuration. Clients connect
+via a localhost socket; port and access token are published in a state file
+only readable by the current user."""
+
+import asyncio
+import json
+import os
+import secrets
+from pathlib import Path
+
+from stegl.logging import print_log, SINK
+from stegl.tracing import JsonLinesTracer, TRACER
+from stegl.processlaunching import AsyncExternalGame, ProcessTable
+from stegl.supervisorclient import STATE_PATH, prove, read_state
+
+
+class Supervisor:
+    def __init__(
+        self,
+        port : int = 0,
+        state_path : Path = STATE_PATH,
+        refresh_interval : float = 5
+    ):
+        self.port = port
+        self.state_path = Path(state_path)
+        self.refresh_interval = refresh_interval
+        self.token = secrets.token_hex(16)
+
+        # Shared by all sessions using the same tracking mode, kept up to date while
+        # sessions are running. Sessions not choosing a mode use "cgroup" tracking,
+        # which falls back to "environ" if no writable cgroup is available.
+        self.process_tables = {"cgroup": ProcessTable(tracking="cgroup")}
+        self.session_count = 0
+        self.active_sessions = 0
+
+    def process_table(self, config : dict):
+        tracking = config["GAME"].get("process_tracking", "cgroup")
+        if tracking not in self.process_tables:
+            self.process_tables[tracking] = ProcessTable(tracking=tracking)
+        return self.process_tables[tracking]
+
+    def _write_state(self, port):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.state_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"port": port, "token": self.token, "pid": os.getpid()}, f)
+
+    def _remove_state(self):
+        state = read_state(self.state_path)
+        if state is not None and state.get("token") == self.token:
+            self.state_path.unlink(missing_ok=True)
+
+    async def _keep_warm(self):
+        while True:
+            # Nothing to track while idle
+            tables = list(self.process_tables.values()) if self.active_sessions > 0 else []
+            for table in tables:
+                await asyncio.to_thread(table.snapshot, self.refresh_interval * 1000)
+            await asyncio.sleep(self.refresh_interval)
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle_client, "127.0.0.1", self.port)
+        port = server.sockets[0].getsockname()[1]
+        self._write_state(port)
+        print_log(f"STEGL supervisor listening on port {port}.")
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self._keep_warm())
+        finally:
+            self._remove_state()
+
+    async def _handle_client(self, reader, writer):
+        def send(message):
+            if not writer.is_closing():
+                writer.write((json.dumps(message) + "\n").encode("utf-8"))
+
+        try:
+            request = json.loads(await reader.readline())
+            # Clients only send their request once the supervisor proved knowing the token
+            if isinstance(request, dict) and request.get("command") == "hello":
+                send({"type": "hello", "proof": prove(self.token, str(request.get("nonce", "")))})
+                await writer.drain()
+                request = json.loads(await reader.readline())
+        except (ValueError, ConnectionError):
+            writer.close()
+            return
+        if not isinstance(request, dict):
+            writer.close()
+            return
+
+        if not secrets.compare_digest(str(request.get("token", "")), self.token) or request.get("command") != "launch":
+            send({"type": "rejected"})
+        else:
+            send({"type": "accepted"})
+            self.session_count += 1
+            # Output of this session (and all of its tasks) is streamed to the client
+            SINK.set(lambda text, end="\n": send({"type": "log", "text": str(text), "end": end}))
+            tracer = None
+            if request.get("trace"):
+                try:
+                    tracer = JsonLinesTracer(request["trace"])
+                    TRACER.set(tracer)
+                except OSError as e:
+                    print_log(f"Could not open trace file: {repr(e)}")
+            try:
+                code = await self._run_session(request, reader)
+            finally:
+                if tracer is not None:
+                    await asyncio.to_thread(tracer.close)
+            send({"type": "exit", "code": code})
+
+        try:
+            await writer.drain()
+            writer.close()
+        except ConnectionError:
+            pass
+
+    async def _run_session(self, request, reader):
+        try:
+            process_table = self.process_table(request["config"])
+            game = AsyncExternalGame.from_configuration(
+                request["config"],
+                cwd=request.get("cwd"),
+                environ=request.get("environ"),
+                process_table=process_table
+            )
+        except Exception as e:
+            print_log(f"An error occured: {repr(e)}")
+            return 1
+
+        session = asyncio.create_task(game.run())
+        # Reading only returns once the client disconnected
+        disconnected = asyncio.create_task(reader.read())
+        self.active_sessions += 1
+        try:
+            await asyncio.wait({session, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not session.done():
+                # E.g. the client was killed, the session must not outlive it
+                SINK.set(None)
+                print_log("Client disconnected, cancelling its session.")
+                session.cancel()
+                try:
+                    await session
+                except asyncio.CancelledError:
+                    pass
+                return 1
+
+            try:
+                session.result()
+                return 0
+            except Exception as e:
+                # The session terminated its processes already
+                print_log(f"An error occured: {repr(e)}")
+                return 1
+        finally:
+            self.active_sessions -= 1
+            disconnected.cancel()
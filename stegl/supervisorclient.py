@@ -0,0 +1,115 @@
+"""Client side of the STEGL supervisor (see supervisor.py). Only depends on the
+standard library, so forwarding a launch to a running supervisor stays fast."""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import socket
+import sys
+from pathlib import Path
+
+
+STATE_PATH = Path.home() / ".stegl" / "supervisor.json"
+
+
+def read_state(state_path : Path = STATE_PATH):
+    """Returns port, token and PID of the running supervisor, or None."""
+    try:
+        with Path(state_path).open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prove(token : str, nonce : str):
+    """Proof of knowing the token, without revealing it."""
+    return hmac.new(token.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def is_pid_running(pid : int):
+    if sys.platform == "win32":
+        # os.kill would terminate the process
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by another user
+        return True
+    return True
+
+
+def launch_via_supervisor(
+    config : dict,
+    cwd : str,
+    environ : dict,
+    on_log,
+    state_path : Path = STATE_PATH,
+    connect_timeout : float = 2,
+    trace_path : str = None
+):
+    """Forwards a launch request to a running supervisor and blocks until the session
+    ended, passing its output to `on_log(text, end)`. If `trace_path` is given, the
+    supervisor writes the session's timings to it (see tracing.py). Returns the exit
+    code of the session, or None if no supervisor is available."""
+    state = read_state(state_path)
+    # A stale state file (e.g. after a crash) might point to a port now used by another program
+    if state is None or not isinstance(state.get("pid"), int) or not is_pid_running(state["pid"]):
+        return None
+    try:
+        sock = socket.create_connection(("127.0.0.1", state["port"]), timeout=connect_timeout)
+    except (OSError, KeyError):
+        return None
+
+    with sock:
+        stream = sock.makefile("r", encoding="utf-8")
+        # The supervisor has to prove that it knows the token before anything else is sent
+        nonce = secrets.token_hex(16)
+        try:
+            sock.sendall((json.dumps({"command": "hello", "nonce": nonce}) + "\n").encode("utf-8"))
+            response = json.loads(stream.readline())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(response, dict) or not hmac.compare_digest(str(response.get("proof", "")), prove(str(state.get("token", "")), nonce)):
+            return None
+
+        request = {
+            "token": state.get("token"),
+            "command": "launch",
+            "config": config,
+            "cwd": cwd,
+            "environ": environ,
+            "trace": trace_path
+        }
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            # The supervisor must accept the request in time
+            response = json.loads(stream.readline())
+        except (OSError, ValueError):
+            return None
+        if response.get("type") != "accepted":
+            return None
+
+        # The session might run for hours
+        sock.settimeout(None)
+        for line in stream:
+            message = json.loads(line)
+            if message["type"] == "log":
+                on_log(message["text"], end=message["end"])
+            elif message["type"] == "exit":
+                return message["code"]
+    raise ConnectionError("The supervisor closed the connection unexpectedly.")
@@ -0,0 +1,249 @@
+"""Changing the scheduling of launch groups: throttling dependencies (e.g. game
+launchers) while the game is running and tuning the game's processes.
+
+`while_in_game` policies of dependencies:
+- "suspend": Suspends all processes (or freezes the whole cgroup, see cgroups.py).
+- "lower_priority": Lowers CPU priority and I/O priority of all processes.
+- "restrict_affinity": Restricts all processes to the given CPU cores.
+
+`GAME.tuning` sets priority, CPU affinity and I/O priority of the game processes.
+
+The original state of every changed process is remembered, so everything can be
+reverted before the processes are needed again (e.g. for cloud saves) or when
+STEGL stops early."""
+
+import os
+import psutil
+
+POLICIES = ("suspend", "lower_priority", "restrict_affinity")
+
+# Platform independent priority names, mapped to priority classes on Windows and
+# nice values elsewhere
+PRIORITIES = ("idle", "below_normal", "normal", "above_normal", "high", "realtime")
+IO_PRIORITIES = ("idle", "low", "normal", "high")
+
+
+def _priority_value(priority : str):
+    if psutil.WINDOWS:
+        return {
+            "idle": psutil.IDLE_PRIORITY_CLASS,
+            "below_normal": psutil.BELOW_NORMAL_PRIORITY_CLASS,
+            "normal": psutil.NORMAL_PRIORITY_CLASS,
+            "above_normal": psutil.ABOVE_NORMAL_PRIORITY_CLASS,
+            "high": psutil.HIGH_PRIORITY_CLASS,
+            "realtime": psutil.REALTIME_PRIORITY_CLASS
+        }[priority]
+    return {"idle": 19, "below_normal": 10, "normal": 0, "above_normal": -5, "high": -10, "realtime": -20}[priority]
+
+
+def _set_io_priority(p, io_priority : str):
+    if psutil.LINUX:
+        if io_priority == "idle":
+            p.ionice(psutil.IOPRIO_CLASS_IDLE)
+        else:
+            # Realtime requires privileges, best effort has levels 0 (highest) - 7
+            p.ionice(psutil.IOPRIO_CLASS_BE, {"low": 7, "normal": 4, "high": 0}[io_priority])
+    else:
+        p.ionice({
+            "idle": psutil.IOPRIO_VERYLOW,
+            "low": psutil.IOPRIO_LOW,
+            "normal": psutil.IOPRIO_NORMAL,
+            "high": psutil.IOPRIO_HIGH
+        }[io_priority])
+
+
+def _save_io_priority(p):
+    """Returns a function restoring the current I/O priority of the process."""
+    ionice = p.ionice()
+    def restore():
+        if psutil.LINUX:
+            # Only these classes take a value
+            has_value = ionice.ioclass in (psutil.IOPRIO_CLASS_RT, psutil.IOPRIO_CLASS_BE)
+            p.ionice(ionice.ioclass, ionice.value if has_value else None)
+        else:
+            p.ionice(ionice)
+    return restore
+
+
+def _can_restore_nice(p, nice : int):
+    """Whether the nice value of the process can be set back to `nice` after raising
+    it. Without privileges, Linux only allows lowering it down to RLIMIT_NICE."""
+    if psutil.WINDOWS or os.geteuid() == 0:
+        return True
+    try:
+        limit, _ = p.rlimit(psutil.RLIMIT_NICE)
+    except (AttributeError, psutil.AccessDenied):
+        return False
+    return limit == psutil.RLIM_INFINITY or 20 - nice <= limit
+
+
+def _revert(restore_functions):
+    """Calls the functions in reverse order, returns the number of failed ones
+    (e.g. as raising priorities again might require privileges)."""
+    failed = 0
+    while restore_functions:
+        try:
+            restore_functions.pop()()
+        except psutil.NoSuchProcess:
+            pass
+        except (psutil.AccessDenied, OSError, ValueError):
+            failed += 1
+    return failed
+
+
+class Throttle:
+    """Applies a `while_in_game` policy to processes and reverts it later."""
+
+    def __init__(self, policy : str, cores = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown while_in_game policy {repr(policy)}.")
+        if policy == "restrict_affinity" and not cores:
+            raise ValueError("The while_in_game policy \"restrict_affinity\" requires while_in_game_cores.")
+        self.policy = policy
+        self.cores = list(cores) if cores else None
+        self._restore = [] # Functions reverting the changes, in order of application
+        self._throttled = set() # (pid, create_time) of changed processes
+        self._frozen = False
+        # Processes whose CPU priority was kept by "lower_priority", see `_lower_priority`
+        self.kept_priority = 0
+
+    @property
+    def applied(self):
+        return len(self._restore) > 0
+
+    @property
+    def frozen(self):
+        """Whether the whole group is frozen, which includes processes started later."""
+        return self._frozen
+
+    def apply(self, processes, freeze = None):
+        """Applies the policy to the processes. For "suspend", `freeze(frozen)` may
+        be passed to freeze the whole group at once, which returns False if that
+        isn't possible. Applying is idempotent, so it can be repeated for processes
+        started later. Returns the number of changed processes (or groups)."""
+        if self._frozen:
+            # Processes joining a frozen group are frozen as well
+            return 0
+        if self.policy == "suspend" and freeze is not None and freeze(True):
+            self._frozen = True
+            self._restore.append(lambda: freeze(False))
+            return 1
+
+        changed = 0
+        for p in processes:
+            try:
+                key = (p.pid, p.create_time())
+                if key in self._throttled:
+                    continue
+                self._restore.append(getattr(self, f"_{self.policy}")(p))
+                self._throttled.add(key)
+                changed += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return changed
+
+    def revert(self):
+        """Reverts all changes, returns the number of processes that couldn't be restored."""
+        self._throttled.clear()
+        self._frozen = False
+        self.kept_priority = 0
+        return _revert(self._restore)
+
+    def _suspend(self, p):
+        p.suspend()
+        return p.resume
+
+    def _lower_priority(self, p):
+        nice = p.nice()
+        restore_io = _save_io_priority(p) if hasattr(p, "ionice") else None
+        # The dependency would be stuck at the lowered CPU priority after the game
+        # closed, so only its I/O priority is lowered in that case
+        lower_nice = _can_restore_nice(p, nice)
+        if not lower_nice:
+            self.kept_priority += 1
+        elif psutil.WINDOWS:
+            p.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            p.nice(max(nice, _priority_value("below_normal")))
+        if restore_io is not None:
+            _set_io_priority(p, "idle")
+
+        def restore():
+            if restore_io is not None:
+                restore_io()
+            if lower_nice:
+                p.nice(nice)
+        return restore
+
+    def _restrict_affinity(self, p):
+        affinity = p.cpu_affinity()
+        p.cpu_affinity(self.cores)
+        return lambda: p.cpu_affinity(affinity)
+
+
+def _current_exe(p):
+    """Reads the exe path again, as psutil caches it in the process object (which
+    would hide programs executed since). Returns None if the PID was reused."""
+    current = psutil.Process(p.pid)
+    if current.create_time() != p.create_time():
+        return None
+    return current.exe()
+
+
+class Tuning:
+    """Applies `GAME.tuning` to the game's processes. Applying is idempotent, so it
+    can be repeated whenever the game's process tree changed: new processes are
+    tuned, as are processes which executed another program since (which might
+    have reset their settings). Original values are saved the first time a
+    process is tuned."""
+
+    def __init__(self, priority : str = None, affinity : list = None, io_priority : str = None):
+        if priority is not None and priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {repr(priority)}, expected one of {', '.join(PRIORITIES)}.")
+        if io_priority is not None and io_priority not in IO_PRIORITIES:
+            raise ValueError(f"Unknown I/O priority {repr(io_priority)}, expected one of {', '.join(IO_PRIORITIES)}.")
+        self.priority = priority
+        self.affinity = list(affinity) if affinity else None
+        self.io_priority = io_priority
+
+        self._tuned = {} # (pid, create_time) -> exe at the time of tuning
+        self._restore = []
+
+    def _tune(self, p, save : bool):
+        if self.priority is not None:
+            if save:
+                self._restore.append(lambda nice=p.nice(): p.nice(nice))
+            p.nice(_priority_value(self.priority))
+        if self.affinity is not None and hasattr(p, "cpu_affinity"):
+            if save:
+                self._restore.append(lambda affinity=p.cpu_affinity(): p.cpu_affinity(affinity))
+            p.cpu_affinity(self.affinity)
+        if self.io_priority is not None and hasattr(p, "ionice"):
+            if save:
+                self._restore.append(_save_io_priority(p))
+            _set_io_priority(p, self.io_priority)
+
+    def apply(self, processes):
+        """Tunes all passed processes that weren't tuned yet or executed another
+        program since. Returns the number of tuned processes."""
+        tuned = 0
+        for p in processes:
+            try:
+                key = (p.pid, p.create_time())
+                exe = _current_exe(p)
+                if exe is None or self._tuned.get(key) == exe:
+                    continue
+                save = key not in self._tuned
+                # Marked first, so originals aren't saved twice if tuning fails halfway
+                self._tuned[key] = exe
+                self._tune(p, save)
+                tuned += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                pass
+        return tuned
+
+    def revert(self):
+        """Restores the original values of all tuned processes that are still running,
+        returns the number of values that couldn't be restored."""
+        self._tuned.clear()
+        return _revert(self._restore)
@@ -0,0 +1,174 @@
+"""Structured timing instrumentation of the launch lifecycle.
+
+Spans (phases with a duration) and events (points in time) are passed to the
+tracer of the current context, see `TRACER`. Without a tracer (the default),
+`span` and `event` do nothing. `JsonLinesTracer` writes every record as one JSON
+line, e.g.
+    {"type": "span", "name": "launch", "id": 3, "parent": 1, "start": 1700000000.12,
+     "duration": 1.73, "status": "ok", "stegl_id": "STEGL_1234_0", "outcome": "stable"}
+Records are written by a background thread, so tracing never blocks the event
+loop on file I/O. Span parents follow the context, so spans of concurrently
+launched dependencies are attributed correctly."""
+
+import contextvars
+import itertools
+import json
+import queue
+import threading
+import time
+
+from stegl import clock
+
+# Tracer of the current context (e.g. of a session run by the supervisor)
+TRACER = contextvars.ContextVar("TRACER", default=None)
+_CURRENT_SPAN = contextvars.ContextVar("_CURRENT_SPAN", default=None)
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed phase, used as a context manager. Attributes can be added until
+    the span ends."""
+
+    def __init__(self, tracer, name : str, attributes : dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.id = next(tracer._ids)
+        self.parent = None
+        self.start = None
+        self._start_monotonic = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _CURRENT_SPAN.get()
+        self.parent = parent.id if parent is not None else None
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.time()
+        self._start_monotonic = clock.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = clock.monotonic() - self._start_monotonic
+        _CURRENT_SPAN.reset(self._token)
+        if exc_type is None:
+            status = "ok"
+        else:
+            # E.g. asyncio.CancelledError isn't an Exception
+            status = "error" if issubclass(exc_type, Exception) else "cancelled"
+        self.tracer.emit({
+            "type": "span",
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent,
+            "start": self.start,
+            "duration": duration,
+            "status": status,
+            **self.attributes
+        })
+        return False
+
+
+class JsonLinesTracer:
+    """Writes spans and events as JSON lines to `path` (appending)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = itertools.count(1)
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write, name="stegl-tracer", daemon=True)
+        self._writer.start()
+
+    def _write(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(json.dumps(record, default=str) + "\n")
+            # Flushing only once the queue ran empty keeps bursts cheap
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def emit(self, record : dict):
+        self._queue.put(record)
+
+    def span(self, name : str, **attributes):
+        return Span(self, name, attributes)
+
+    def event(self, name : str, **attributes):
+        parent = _CURRENT_SPAN.get()
+        self.emit({
+            "type": "event",
+            "name": name,
+            "parent": parent.id if parent is not None else None,
+            "time": time.time(),
+            **attributes
+        })
+
+    def close(self):
+        """Writes all pending records and closes the file."""
+        self._queue.put(None)
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MemoryTracer:
+    """Keeps spans and events in `records`, each with the (monotonic) time it was
+    recorded at (`t`), e.g. for the replay simulator."""
+
+    def __init__(self):
+        self.records = []
+        self._ids = itertools.count(1)
+
+    def emit(self, record : dict):
+        record["t"] = clock.monotonic()
+        self.records.append(record)
+
+    def span(self, name : str, **attributes):
+        return Span(self, name, attributes)
+
+    def event(self, name : str, **attributes):
+        parent = _CURRENT_SPAN.get()
+        self.emit({"type": "event", "name": name, "parent": parent.id if parent is not None else None, **attributes})
+
+
+def span(name : str, **attributes):
+    """Returns a span of the current tracer, to be used as a context manager."""
+    tracer = TRACER.get()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **attributes)
+
+
+def event(name : str, **attributes):
+    """Records an event with the current tracer."""
+    tracer = TRACER.get()
+    if tracer is not None:
+        tracer.event(name, **attributes)
+
+
+def is_enabled():
+    """Whether a tracer is set. Allows skipping the preparation of expensive attributes."""
+    return TRACER.get() is not None
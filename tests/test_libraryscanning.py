@@ -0,0 +1,31 @@
+"""Tests recognising installed titles (see libraryscanning.py)."""
+
+import json
+
+import pytest
+
+from stegl.libraryscanning import scan_title, split_arguments
+
+
+def test_gog_arguments_are_unquoted(tmp_path):
+    (tmp_path / "goggame-1207658930.info").write_text(json.dumps({
+        "name": "Some Game",
+        "playTasks": [
+            {"type": "FileTask", "path": "bin/game.exe", "arguments": "-profile \"My Profile\" -windowed", "isPrimary": True}
+        ]
+    }))
+    title = scan_title(str(tmp_path))
+    assert title["source"] == "gog"
+    assert title["args"] == ["-profile", "My Profile", "-windowed"]
+
+
+@pytest.mark.parametrize("arguments, args", [
+    ("", []),
+    ("-a \"b c\"", ["-a", "b c"]),
+    ("-path=\"C:\\Games\\My Game\\\\\" -x", ["-path=C:\\Games\\My Game\\", "-x"]),
+    ("\"say \"\"hi\"\"\"", ["say \"hi\""]),
+    ("-name \\\"quoted\\\"", ["-name", "\"quoted\""]),
+    ("\"\" last", ["", "last"]),
+])
+def test_split_arguments(arguments, args):
+    assert split_arguments(arguments) == args
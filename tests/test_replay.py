@@ -0,0 +1,63 @@
+"""Regression tests replaying recorded sessions (see processsimulation.py).
+
+The traces in traces/ were recorded with `launch-external-game --record` on Linux:
+- launcher_handoff.rec: A dependency (sleep) and a launcher script staying open,
+  whose first game process (2 seconds) executes a second one (3 seconds).
+- launcher_respawn.rec: A dependency and a launcher script which ignores SIGTERM
+  and respawns its helper process whenever it exits."""
+
+import copy
+from pathlib import Path
+
+import pytest
+
+from stegl.processsimulation import ProcessTrace, replay
+
+TRACES = Path(__file__).parent / "traces"
+
+
+def _root_pid(trace, label = "game_starter"):
+    return trace.launches[trace.groups[label]][1]
+
+
+@pytest.mark.parametrize("event_driven", [True, False])
+def test_handoff_is_followed(event_driven):
+    result = replay(TRACES / "launcher_handoff.rec", event_driven=event_driven)
+    assert result["outcome"] == "success"
+    assert "Detected game process" in result["output"]
+    # Detected after the launch waiting (about 1 second), the game only closed once
+    # the second process exited (5 seconds after the launch) and the hand-off grace
+    # (2 seconds) passed. Without following the hand-off, it would have been 3 seconds.
+    assert result["phases"]["game_running"] == pytest.approx(6, abs=0.2)
+    assert result["remaining"] == []
+
+
+def test_respawned_processes_are_terminated():
+    trace = ProcessTrace.load(TRACES / "launcher_respawn.rec")
+    result = replay(trace)
+    assert result["outcome"] == "success"
+    assert result["remaining"] == []
+    # The launcher survives SIGTERM and is killed, its respawned helper is found
+    # and terminated by the next attempt
+    killed = [pid for _, pid, signal in result["signals"] if signal == "kill"]
+    assert killed == [_root_pid(trace)]
+    respawned = [plan.pid for plan in trace.plans if plan.start[0] == "signal"]
+    assert respawned
+    terminated = set(pid for _, pid, signal in result["signals"] if signal == "terminate")
+    assert terminated.issuperset(respawned)
+
+
+def test_termination_timeout_is_respected():
+    trace = ProcessTrace.load(TRACES / "launcher_respawn.rec")
+    config = copy.deepcopy(trace.config)
+    config["GAME"]["launch_config"]["termination_timeout"] = 3
+    result = replay(trace, config)
+    assert result["outcome"] == "success"
+    assert result["phases"]["terminate"] == pytest.approx(3, abs=0.2)
+
+
+def test_replay_is_deterministic():
+    first = replay(TRACES / "launcher_respawn.rec")
+    second = replay(TRACES / "launcher_respawn.rec")
+    for key in ("outcome", "duration", "phases", "signals", "remaining", "scans"):
+        assert first[key] == second[key]
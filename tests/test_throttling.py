@@ -0,0 +1,42 @@
+"""Tests changing the scheduling of processes (see throttling.py)."""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import psutil
+import pytest
+
+from stegl.throttling import Tuning
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="Re-executing is tested on Linux")
+def test_tuning_is_reapplied_after_exec(tmp_path):
+    ready = tmp_path / "ready"
+    sleep = os.path.realpath(shutil.which("sleep"))
+    # Executes `sleep` once `ready` exists
+    script = (
+        "import os, time\n"
+        f"while not os.path.exists({str(ready)!r}): time.sleep(0.01)\n"
+        f"os.execv({sleep!r}, ['sleep', '10'])\n"
+    )
+    launched = subprocess.Popen([sys.executable, "-c", script])
+    try:
+        # The same process object is passed every time, like the game's processes
+        process = psutil.Process(launched.pid)
+        tuning = Tuning(priority="below_normal")
+        assert tuning.apply([process]) == 1
+        assert tuning.apply([process]) == 0
+
+        ready.touch()
+        deadline = time.monotonic() + 5
+        while psutil.Process(launched.pid).exe() != sleep and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert tuning.apply([process]) == 1
+        assert tuning.apply([process]) == 0
+        tuning.revert()
+    finally:
+        launched.kill()
+        launched.wait()